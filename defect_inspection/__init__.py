@@ -0,0 +1 @@
+"""Helpers behind pages/NS-SUS Defect Inspection.py."""
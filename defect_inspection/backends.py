@@ -0,0 +1,301 @@
+"""Live inspection backends with a time budget, circuit breakers and a fallback chain.
+
+``FallbackChain.generate`` asks each backend in turn -- by default
+``gemini-2.5-flash``, then ``gemini-2.5-flash-lite`` -- and returns the first
+complete answer. The whole call has a time ``budget`` -- every attempt, retry,
+backoff and quota wait on every backend -- and each attempt a hard ``deadline``
+of at most what is left of it: the stream is read on a helper thread and
+abandoned when it runs out, so a hung request cannot hold the page past the
+budget. Quota and transient errors are retried with backoff as before -- once
+for a backend that has another one behind it, ``RETRIES`` times for the last,
+never past the budget -- and a timeout or any other error moves on to the next
+backend at once. Streamed text and the early status are tagged with the
+attempt they came from, so output of an attempt that failed can be discarded.
+
+Each backend has a ``CircuitBreaker``: after ``BREAKER_FAILURES`` failures in a
+row it is skipped for ``BREAKER_COOLDOWN`` seconds, then a single trial call
+decides whether it is healthy again. When every backend fails or is open,
+``generate`` raises ``BackendsUnavailable`` and the page falls back to a local
+verdict; answers from anything but the first backend are marked degraded.
+
+``stub`` serves the Gemini REST streaming endpoint locally with injected
+latency, errors and stalls, so the whole chain can be exercised offline:
+
+    python -m defect_inspection.backends stub --port 8765 --error-rate 0.3 --only gemini-2.5-flash
+    GEMINI_API_ENDPOINT=http://127.0.0.1:8765 streamlit run Home.py
+    python -m defect_inspection.backends bench --endpoint http://127.0.0.1:8765 --calls 50
+"""
+import os
+import json
+import time
+import queue
+import random
+import argparse
+import threading
+
+from defect_inspection.batch import with_retries, RETRIES
+from defect_inspection.stream import consume, texts
+
+PRIMARY_MODEL = 'gemini-2.5-flash'
+SECONDARY_MODEL = 'gemini-2.5-flash-lite'
+DEADLINE = 20.0          # วินาที ต่อ attempt หนึ่งครั้ง (ทั้ง stream)
+BUDGET = 45.0            # วินาที ต่อ generate หนึ่งครั้ง รวมทุก attempt/backoff ของทุกโมเดล
+BREAKER_FAILURES = 3     # พลาดติดกันกี่ครั้งถึงตัดวงจร
+BREAKER_COOLDOWN = 60.0  # วินาที ก่อนลองเรียกใหม่หนึ่งครั้ง
+ENDPOINT_ENV = 'GEMINI_API_ENDPOINT'
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class BackendsUnavailable(Exception):
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+class CircuitBreaker:
+    """closed -> (``failures`` in a row) -> open -> (``cooldown`` s) -> half-open: one trial call."""
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._count = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            return 'half-open' if time.monotonic() - self._opened_at >= self.cooldown else 'open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._trial:
+                return False
+            self._trial = True  # ปล่อยผ่านทีละหนึ่งครั้งเพื่อทดสอบ
+            return True
+
+    def success(self):
+        with self._lock:
+            self._count, self._opened_at, self._trial = 0, None, False
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            if self._trial or self._count >= self.failures:
+                self._opened_at, self._trial = time.monotonic(), False
+
+
+class GeminiBackend:
+    """One Gemini model; ``stream`` yields the answer's text chunks."""
+
+    def __init__(self, model_name):
+        import google.generativeai as genai
+
+        self.model = genai.GenerativeModel(model_name)
+        self.model_name = self.model.model_name
+
+    def stream(self, prompt, part, deadline):
+        # timeout ของ client คือเวลารอต่อการอ่านหนึ่งครั้ง ตั้งไว้ให้ thread ที่ถูกทิ้งจบเองได้
+        return texts(self.model.generate_content([prompt, part], stream=True, request_options={'timeout': deadline}))
+
+
+def configure(api_key=None, endpoint=None):
+    """Configure google-generativeai; ``endpoint`` (or ``$GEMINI_API_ENDPOINT``) points it at a stub over REST."""
+    import google.generativeai as genai
+
+    endpoint = endpoint or os.environ.get(ENDPOINT_ENV)
+    options = {}
+    if endpoint:
+        options = {'transport': 'rest', 'client_options': {'api_endpoint': endpoint}}
+        api_key = api_key or 'stub'
+    if api_key or options:
+        genai.configure(api_key=api_key, **options)
+
+
+def _within(chunks, seconds):
+    """Re-yield ``chunks`` (produced on a helper thread) until ``seconds`` have passed."""
+    q = queue.Queue()
+
+    def pump():
+        try:
+            for chunk in chunks():
+                q.put(('chunk', chunk))
+            q.put(('done', None))
+        except BaseException as e:
+            q.put(('error', e))
+
+    threading.Thread(target=pump, name='inspect-stream', daemon=True).start()
+    end = time.monotonic() + seconds
+    while True:
+        try:
+            kind, value = q.get(timeout=max(0.0, end - time.monotonic()))
+        except queue.Empty:
+            raise DeadlineExceeded(f"no complete answer within {seconds:.0f} s") from None
+        if kind == 'done':
+            return
+        if kind == 'error':
+            raise value
+        yield value
+
+
+class FallbackChain:
+    def __init__(self, backends, deadline=DEADLINE, retries=RETRIES, budget=BUDGET):
+        self.backends = backends
+        self.deadline = deadline
+        self.retries = retries
+        self.budget = budget
+        self.breakers = {b.model_name: CircuitBreaker() for b in backends}
+
+    @property
+    def model_name(self):
+        return self.backends[0].model_name
+
+    def generate(self, prompt, part, on_text=None, on_status=None, limiter=None, deadline=None, budget=None):
+        """``{'text', 'status', 'model', 'degraded', 'errors', 'attempt'}`` from the first backend that answers in time.
+
+        ``on_text(text_so_far, attempt)`` and ``on_status(status, attempt)`` carry the attempt number
+        (1, 2, ... across retries and backends); a callback with a new number means every earlier
+        attempt failed and what it streamed is void. ``attempt`` in the result is the one that answered.
+        """
+        deadline = deadline or self.deadline
+        end = time.monotonic() + (self.budget if budget is None else budget)
+        last = len(self.backends) - 1
+        errors, attempts = [], 0
+        for i, backend in enumerate(self.backends):
+            if time.monotonic() >= end:
+                errors.append(f"{backend.model_name}: time budget spent")
+                continue
+            breaker = self.breakers[backend.model_name]
+            if not breaker.allow():
+                errors.append(f"{backend.model_name}: circuit open")
+                continue
+
+            def call():
+                nonlocal attempts
+                attempts += 1
+                n, seconds = attempts, min(deadline, end - time.monotonic())
+                if seconds <= 0:
+                    raise DeadlineExceeded("time budget spent")
+                return consume(_within(lambda: backend.stream(prompt, part, seconds), seconds),
+                               on_text and (lambda text: on_text(text, n)), on_status and (lambda status: on_status(status, n)))
+            try:
+                (text, status), _ = with_retries(call, limiter, self.retries if i == last else min(1, self.retries), until=end)
+            except Exception as e:
+                breaker.failure()
+                errors.append(f"{backend.model_name}: {type(e).__name__}: {e}")
+                continue
+            breaker.success()
+            return {'text': text, 'status': status, 'model': backend.model_name, 'degraded': i > 0, 'errors': errors,
+                    'attempt': attempts}
+        raise BackendsUnavailable(errors)
+
+    def states(self):
+        return {name: b.state for name, b in self.breakers.items()}
+
+
+def chain(models=(PRIMARY_MODEL, SECONDARY_MODEL), deadline=DEADLINE, budget=BUDGET):
+    return FallbackChain([GeminiBackend(m) for m in models], deadline, budget=budget)
+
+
+# ==========================================
+# stub server
+# ==========================================
+def serve_stub(port, latency_ms, error_rate, stall_rate, fail_rate, only=None):
+    """Serve ``models/*:streamGenerateContent`` with injected faults (``only``: fault one model, others stay healthy)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            model = self.path.split('/models/')[-1].split(':')[0]
+            faulty = only is None or model == only
+            if faulty and random.random() < error_rate:
+                code = random.choice([429, 500, 503])
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({'error': {'code': code, 'message': 'injected', 'status': 'UNAVAILABLE'}}).encode())
+                return
+            status = 'FAIL' if random.random() < fail_rate else 'PASS'
+            pieces = [f"[STATUS]: {status}\n", f"* [DEFECT_DETECTED]: {'Simulated defect' if status == 'FAIL' else 'None'}\n",
+                      "* [CONFIDENCE]: 90%\n", f"* [ANALYSIS]: stub answer from {model}\n", "* [NEXT STEP]: -"]
+            stall = faulty and random.random() < stall_rate
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            for i, text in enumerate(pieces):
+                time.sleep(latency_ms / 1000 / len(pieces) * random.uniform(0.5, 1.5))
+                if stall and i == 1:
+                    time.sleep(3600)  # ค้างกลางคำตอบ
+                chunk = {'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}, 'index': 0}]}
+                self.wfile.write((('[' if i == 0 else ',') + json.dumps(chunk)).encode())
+                self.wfile.flush()
+            self.wfile.write(b']')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def bench(endpoint, calls, deadline, budget, models):
+    configure(endpoint=endpoint)
+    c = chain(models, deadline=deadline, budget=budget)
+    print(f"{calls} calls via {endpoint}, deadline {deadline:.0f} s per attempt, budget {budget:.0f} s per call, "
+          f"chain {' -> '.join(models)}")
+    times, by_model, failed = [], {}, 0
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        try:
+            r = c.generate("stub", {'mime_type': 'image/jpeg', 'data': b''})
+            by_model[r['model']] = by_model.get(r['model'], 0) + 1
+        except BackendsUnavailable:
+            failed += 1
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    print(f"answered: {by_model}; local fallback needed: {failed}")
+    print(f"p50 {times[len(times) // 2]:.2f} s, p95 {times[int(len(times) * 0.95)]:.2f} s, max {times[-1]:.2f} s; "
+          f"breakers {c.states()}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    s = sub.add_parser('stub', help="local Gemini stand-in with injected latency/errors/stalls")
+    s.add_argument('--port', type=int, default=8765)
+    s.add_argument('--latency', type=float, default=2000, help="ms per answer")
+    s.add_argument('--error-rate', type=float, default=0.2, help="HTTP 429/500/503 instead of an answer")
+    s.add_argument('--stall-rate', type=float, default=0.05, help="answer stops mid-stream")
+    s.add_argument('--fail-rate', type=float, default=0.1, help="answers that say FAIL")
+    s.add_argument('--only', help="inject faults only into this model")
+    b = sub.add_parser('bench', help="run calls through the fallback chain and report who answered")
+    b.add_argument('--endpoint', required=True)
+    b.add_argument('--calls', type=int, default=50)
+    b.add_argument('--deadline', type=float, default=DEADLINE, help="seconds per attempt")
+    b.add_argument('--budget', type=float, default=BUDGET, help="seconds per call, all attempts and backends")
+    b.add_argument('--models', nargs='+', default=[PRIMARY_MODEL, SECONDARY_MODEL])
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'stub':
+        server = serve_stub(args.port, args.latency, args.error_rate, args.stall_rate, args.fail_rate, args.only)
+        print(f"stub Gemini on http://127.0.0.1:{args.port} (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    elif args.cmd == 'bench':
+        bench(args.endpoint, args.calls, args.deadline, args.budget, args.models)
+
+
+if __name__ == '__main__':
+    main()
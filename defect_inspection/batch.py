@@ -0,0 +1,206 @@
+"""Concurrent inspection of many CCTV frames under the Gemini request quota.
+
+``run`` inspects frames on a bounded thread pool and yields each result as soon
+as it is done, so the page can show results while the rest are still running.
+Only ``workers * 2`` frames are in flight at a time, so a ZIP of a whole shift
+is never held decoded in memory.
+
+Every API attempt first takes a token from a shared ``TokenBucket`` (the
+quota is per API key, so one bucket per process), and quota/transient errors
+(HTTP 429/5xx, timeouts) are retried with exponential backoff and full jitter.
+
+``simulated_call`` stands in for Gemini with configurable latency and error
+rate, so the same engine can be benchmarked offline:
+
+    python -m defect_inspection.batch bench --frames 200 --workers 1 4 16 --rpm 600 --latency 800
+"""
+import io
+import time
+import random
+import zipfile
+import argparse
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+WORKERS = 4
+RPM = 60
+RETRIES = 4
+BACKOFF = 1.0        # วินาที ก่อน retry ครั้งแรก (เพิ่มเท่าตัวทุกครั้ง)
+MAX_BACKOFF = 30.0
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+class TokenBucket:
+    """``rate`` requests per second on average, at most ``burst`` at once."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, until=None):
+        """Block until a request may be sent; returns the seconds waited.
+
+        Raises ``TimeoutError`` instead of waiting past ``until`` (a ``time.monotonic()`` value).
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._at) * self.rate)
+                self._at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            if until is not None and now + delay > until:
+                raise TimeoutError("quota wait exceeds the time budget")
+            time.sleep(delay)
+            waited += delay
+
+
+def is_retryable(error):
+    # google.api_core exceptions มี .code เป็น HTTP status (429 = เกิน quota)
+    # timeout/connection error ของ requests (transport REST) เป็น OSError แต่ไม่ใช่ ConnectionError ของ Python
+    return getattr(error, 'code', None) in RETRYABLE_CODES or isinstance(error, OSError)
+
+
+def with_retries(call, limiter=None, retries=RETRIES, backoff=BACKOFF, until=None):
+    """``(call(), attempts)``; retries quota/transient errors, re-raises anything else.
+
+    With ``until`` (a ``time.monotonic()`` value) nothing waits past it: the last
+    error is re-raised instead of backing off or queueing for quota beyond it.
+    """
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire(until)
+        try:
+            return call(), attempt + 1
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(MAX_BACKOFF, backoff * 2 ** attempt))
+            if until is not None and time.monotonic() + delay >= until:
+                raise
+            time.sleep(delay)
+
+
+def _zip_images(zf):
+    return sorted((i for i in zf.infolist() if not i.is_dir() and i.filename.lower().endswith(IMAGE_EXTENSIONS)),
+                  key=lambda i: i.filename)
+
+
+def frames_from_uploads(uploads):
+    """``(name, bytes)`` of every image in the uploads (``(name, bytes)`` pairs); ZIPs are expanded lazily."""
+    for name, data in uploads:
+        if name.lower().endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(data)) as zf:
+                for info in _zip_images(zf):
+                    yield info.filename, zf.read(info)
+        elif name.lower().endswith(IMAGE_EXTENSIONS):
+            yield name, data
+
+
+def count_frames(uploads):
+    """Number of frames ``frames_from_uploads`` will yield (reads only the ZIP directories)."""
+    n = 0
+    for name, data in uploads:
+        if name.lower().endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(data)) as zf:
+                n += len(_zip_images(zf))
+        elif name.lower().endswith(IMAGE_EXTENSIONS):
+            n += 1
+    return n
+
+
+def _inspect(inspect, name, data):
+    started = time.perf_counter()
+    try:
+        result = dict(inspect(name, data))
+    except Exception as e:
+        result = {'status': 'ERROR', 'result_text': '', 'error': f"{type(e).__name__}: {e}"}
+    result.setdefault('error', None)
+    return dict(result, name=name, latency_ms=(time.perf_counter() - started) * 1000)
+
+
+def run(frames, inspect, workers=WORKERS):
+    """Yield ``inspect(name, data)`` (a dict, plus ``name``/``latency_ms``/``error``) for each frame as it completes.
+
+    ``inspect`` returns at least ``{'status', 'result_text'}``; an exception becomes ``status='ERROR'``.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inspect') as pool:
+        pending = set()
+        for name, data in frames:
+            pending.add(pool.submit(_inspect, inspect, name, data))
+            # อ่าน frame ล่วงหน้าไม่เกิน workers * 2 รูป
+            while len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield fut.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield fut.result()
+
+
+class SimulatedError(Exception):
+    def __init__(self, code):
+        super().__init__(f"simulated HTTP {code}")
+        self.code = code
+
+
+def simulated_call(latency_ms=2000, jitter=0.25, error_rate=0.0, fail_rate=0.0, rng=random):
+    """A stand-in for one Gemini call: sleeps ~``latency_ms``, sometimes raises 429/503, returns the text."""
+    time.sleep(latency_ms / 1000 * rng.uniform(1 - jitter, 1 + jitter))
+    if rng.random() < error_rate:
+        raise SimulatedError(rng.choice([429, 503]))
+    status = 'FAIL' if rng.random() < fail_rate else 'PASS'
+    return f"[STATUS]: {status}\n* [DEFECT_DETECTED]: {'Simulated defect' if status == 'FAIL' else 'None'}"
+
+
+def bench(frames, workers_list, rpm, latency_ms, error_rate, retries):
+    print(f"{frames} frames, quota {rpm}/min, ~{latency_ms} ms per call, {error_rate:.0%} transient errors")
+    print(f"{'workers':>7} {'seconds':>8} {'frames/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'retries':>8} {'errors':>7}")
+    for workers in workers_list:
+        limiter = TokenBucket(rpm / 60, burst=workers)
+        calls = itertools.count()
+
+        def call():
+            next(calls)
+            return simulated_call(latency_ms, error_rate=error_rate)
+
+        def inspect(name, data):
+            text, _ = with_retries(call, limiter, retries, backoff=0.2)
+            return {'status': 'FAIL' if 'FAIL' in text.upper() else 'PASS', 'result_text': text}
+
+        t0 = time.perf_counter()
+        results = list(run(((f"frame_{i:05d}.jpg", b'') for i in range(frames)), inspect, workers))
+        elapsed = time.perf_counter() - t0
+        lat = sorted(r['latency_ms'] for r in results)
+        errors = sum(r['status'] == 'ERROR' for r in results)
+        print(f"{workers:>7} {elapsed:>8.1f} {frames / elapsed:>9.2f} {lat[len(lat) // 2]:>8.0f} "
+              f"{lat[int(len(lat) * 0.95)]:>8.0f} {next(calls) - frames:>8} {errors:>7}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    b = sub.add_parser('bench', help="throughput of the batch engine against the simulated backend")
+    b.add_argument('--frames', type=int, default=200)
+    b.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    b.add_argument('--rpm', type=float, default=600, help="quota, requests per minute")
+    b.add_argument('--latency', type=float, default=800, help="simulated ms per call")
+    b.add_argument('--error-rate', type=float, default=0.05)
+    b.add_argument('--retries', type=int, default=RETRIES)
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'bench':
+        bench(args.frames, args.workers, args.rpm, args.latency, args.error_rate, args.retries)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,442 @@
+"""The inspection history log (``production_logs_v2.csv``): buffered appends, rotation, tail reads.
+
+Rows are buffered in memory and written by one process-wide ``HistoryLog``,
+in one append + ``fsync`` per flush: when ``FLUSH_ROWS`` rows are waiting, every
+``FLUSH_SECONDS`` from a background thread, and at exit. Readers see buffered
+rows immediately.
+
+Before a flush the active file is rotated when it has reached
+``ROTATE_BYTES`` or holds rows from an earlier day. The rotated file is moved
+to ``log_archive/`` and gzip-compressed in the background as a series of
+gzip members of ``MEMBER_ROWS`` rows each. The result is still one ordinary
+``.csv.gz``, which pandas and zcat read as is. A small ``.idx.json`` next to it
+records where each member starts, so any archived row can be reached by
+decompressing a single member.
+
+``tail(n, skip)`` returns the newest rows first: pending rows, then the active
+file read backwards from its end, then archives newest first via their
+indexes. The first pages cost the same however long the history is.
+
+    python -m defect_inspection.history tail -n 20 --skip 0
+    python -m defect_inspection.history list
+    python -m defect_inspection.history rotate
+    python -m defect_inspection.history bench --rows 1000000
+"""
+import io
+import os
+import sys
+import csv
+import gzip
+import json
+import time
+import atexit
+import shutil
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+
+LOG_FILE = 'production_logs_v2.csv'
+ARCHIVE_DIR = 'log_archive'
+HEADER = ['Timestamp', 'Line', 'Lot No.', 'Param 1', 'Param 2', 'Param 3', 'Status', 'Defect', 'Risk']
+ROTATE_BYTES = 64 * 2 ** 20
+FLUSH_ROWS = 200
+FLUSH_SECONDS = 1.0
+MEMBER_ROWS = 10000   # แถวต่อ gzip member = หน่วยที่ต้องคลายเมื่ออ่าน archive
+_BLOCK = 64 * 1024
+
+
+def _encode(rows):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue().encode('utf-8')
+
+
+def _parse(lines):
+    return list(csv.reader(line.decode('utf-8') for line in lines))
+
+
+def _read_back(path, need, header=True):
+    """The last ``need`` lines of a file (bytes, newest first), reading backwards in blocks."""
+    lines = []
+    with open(path, 'rb') as f:
+        pos = f.seek(0, os.SEEK_END)
+        rest = b''
+        while pos > 0 and len(lines) < need + 1:
+            step = min(_BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            block = f.read(step) + rest
+            parts = block.split(b'\n')
+            rest = parts[0]  # อาจเป็นบรรทัดที่ยังไม่ครบ อ่าน block ก่อนหน้ามาต่อ
+            lines.extend(reversed([p for p in parts[1:] if p.strip()]))
+        if pos == 0 and rest.strip():
+            lines.append(rest)
+    if header and pos == 0 and lines and lines[-1].startswith(b'Timestamp,'):
+        lines.pop()
+    return lines[:need]
+
+
+def _count_rows(path):
+    n = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            n += block.count(b'\n')
+    return max(0, n - 1)  # ไม่นับหัวตาราง
+
+
+def compress(src, dst, member_rows=MEMBER_ROWS):
+    """gzip ``src`` (a CSV) into ``dst`` as one member per ``member_rows`` rows and write its index."""
+    members = []
+    tmp = dst + '.tmp'
+    with open(src, 'rb') as f, open(tmp, 'wb') as out:
+        header = f.readline()
+        out.write(gzip.compress(header))
+        first = last = None
+        while True:
+            chunk = [line for _, line in zip(range(member_rows), f)]
+            if not chunk:
+                break
+            members.append([out.tell(), len(chunk)])
+            out.write(gzip.compress(b''.join(chunk)))
+            first = first or chunk[0][:19].decode('utf-8', 'replace')
+            last = chunk[-1][:19].decode('utf-8', 'replace')
+        members.append([out.tell(), 0])  # ตำแหน่งจบของ member สุดท้าย
+        out.flush()
+        os.fsync(out.fileno())
+    index = {'rows': sum(n for _, n in members), 'members': members, 'first': first, 'last': last}
+    with open(dst + '.idx.json', 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp, dst)
+    return index
+
+
+class HistoryLog:
+    def __init__(self, path=LOG_FILE, archive_dir=ARCHIVE_DIR, rotate_bytes=ROTATE_BYTES, daily=True,
+                 flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS):
+        self.path = path
+        self.archive_dir = archive_dir
+        self.rotate_bytes = rotate_bytes
+        self.daily = daily
+        self.flush_rows = flush_rows
+        self._buffer = []
+        self._listeners = []
+        self._active_rows = None
+        self._active_day = None
+        self._indexes = {}
+        self._lock = threading.RLock()
+        self._compressing = set()
+        self._stop = threading.Event()
+        for name in self._rotated():
+            # ไฟล์ที่หมุนไปแล้วแต่บีบอัดไม่เสร็จ (เช่น process ตายระหว่างทาง)
+            self._compress_later(os.path.join(self.archive_dir, name))
+        if flush_seconds:
+            threading.Thread(target=self._flusher, args=(flush_seconds,), name='history-flush', daemon=True).start()
+        atexit.register(self.close)
+
+    # ==========================================
+    # writing
+    # ==========================================
+    def subscribe(self, listener, replay=0):
+        """``listener(rows)`` on every append (rows as written), ``listener(None)`` when the log is cleared.
+
+        With ``replay`` the listener first gets the newest ``replay`` rows already
+        logged (oldest first), with no append slipping in between.
+        """
+        with self._lock:
+            if replay:
+                listener(self.tail(replay)[::-1])
+            self._listeners.append(listener)
+
+    def append(self, rows):
+        rows = [list(r) for r in rows]
+        if not rows:
+            return
+        with self._lock:
+            self._buffer.extend(rows)
+            for listener in self._listeners:
+                listener(rows)
+            if len(self._buffer) >= self.flush_rows:
+                self.flush()
+
+    def flush(self):
+        """Write pending rows in one append and fsync them."""
+        with self._lock:
+            if not self._buffer:
+                return
+            if self._should_rotate():
+                self.rotate()
+            new = not os.path.isfile(self.path)
+            before = 0 if new else self._count_active()
+            data = (_encode([HEADER]) if new else b'') + _encode(self._buffer)
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            if new:
+                self._active_day = self._buffer[0][0][:10]
+            self._active_rows = before + len(self._buffer)
+            self._buffer = []
+
+    def _flusher(self, seconds):
+        while not self._stop.wait(seconds):
+            try:
+                self.flush()
+            except OSError:
+                pass  # ลองใหม่รอบหน้า แถวยังอยู่ใน buffer
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+    # ==========================================
+    # rotation
+    # ==========================================
+    def _day(self):
+        if self._active_day is None:
+            first = _first_row(self.path)
+            self._active_day = first[0][:10] if first else ''
+        return self._active_day
+
+    def _should_rotate(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return False
+        if size >= self.rotate_bytes:
+            return True
+        return self.daily and self._day() not in ('', self._buffer[0][0][:10])
+
+    def rotate(self):
+        """Move the active file into the archive (compressed in the background); returns its archive name."""
+        with self._lock:
+            if not os.path.isfile(self.path):
+                return None
+            os.makedirs(self.archive_dir, exist_ok=True)
+            stem = os.path.splitext(os.path.basename(self.path))[0]
+            dst = os.path.join(self.archive_dir, f"{stem}.{datetime.now():%Y%m%d-%H%M%S-%f}.csv")
+            os.replace(self.path, dst)
+            self._active_rows, self._active_day = 0, None
+        self._compress_later(dst)
+        return os.path.basename(dst) + '.gz'
+
+    def _compress_later(self, src):
+        def run():
+            try:
+                compress(src, src + '.gz')
+                os.remove(src)
+            finally:
+                with self._lock:
+                    self._compressing.discard(src)
+        with self._lock:
+            if src in self._compressing:
+                return
+            self._compressing.add(src)
+        threading.Thread(target=run, name='history-compress', daemon=True).start()
+
+    def wait_compressed(self, timeout=60):
+        end = time.monotonic() + timeout
+        while self._compressing and time.monotonic() < end:
+            time.sleep(0.05)
+
+    def _rotated(self):
+        if not os.path.isdir(self.archive_dir):
+            return []
+        names = set(os.listdir(self.archive_dir))
+        return sorted(n for n in names if n.endswith('.csv') and n + '.gz' not in names)
+
+    def archives(self):
+        """Archive files, newest first (``.csv`` while still being compressed, ``.csv.gz`` after)."""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        names = set(os.listdir(self.archive_dir))
+        done = [n for n in names if n.endswith('.csv.gz') and n + '.idx.json' in names]
+        return sorted(done + self._rotated(), reverse=True)
+
+    def _index(self, name):
+        index = self._indexes.get(name)
+        if index is None:
+            path = os.path.join(self.archive_dir, name)
+            if name.endswith('.gz'):
+                with open(path + '.idx.json', encoding='utf-8') as f:
+                    index = json.load(f)
+                self._indexes[name] = index  # archive ที่บีบอัดแล้วไม่เปลี่ยนอีก
+            else:
+                index = {'rows': _count_rows(path)}
+        return index
+
+    # ==========================================
+    # reading
+    # ==========================================
+    def _count_active(self):
+        if self._active_rows is None:
+            self._active_rows = _count_rows(self.path) if os.path.isfile(self.path) else 0
+        return self._active_rows
+
+    def count(self):
+        with self._lock:
+            live = len(self._buffer) + self._count_active()
+            names = self.archives()
+        return live + sum(self._index(name)['rows'] for name in names)
+
+    def tail(self, n, skip=0):
+        """Rows (lists of strings, ``HEADER`` order) newest first: ``n`` of them after skipping the newest ``skip``."""
+        with self._lock:
+            pending = [[str(v) for v in r] for r in reversed(self._buffer)]
+            active_rows = self._count_active()
+            names = self.archives()
+        out = pending[skip:skip + n]
+        skip = max(0, skip - len(pending))
+        if len(out) < n and skip < active_rows:
+            lines = _read_back(self.path, skip + n - len(out)) if os.path.isfile(self.path) else []
+            out += _parse(lines[skip:])
+        skip = max(0, skip - active_rows)
+        for name in names:
+            if len(out) >= n:
+                break
+            rows = self._index(name)['rows']
+            if skip >= rows:
+                skip -= rows
+                continue
+            out += self._archive_tail(name, skip, n - len(out))
+            skip = 0
+        return out
+
+    def _archive_tail(self, name, skip, n):
+        path = os.path.join(self.archive_dir, name)
+        if not name.endswith('.gz'):
+            return _parse(_read_back(path, skip + n)[skip:])
+        out = []
+        members = self._index(name)['members']
+        with open(path, 'rb') as f:
+            # member จากท้ายไฟล์ ข้ามทั้งก้อนได้ด้วยจำนวนแถวใน index
+            for (start, rows), (end, _) in reversed(list(zip(members, members[1:]))):
+                if skip >= rows:
+                    skip -= rows
+                    continue
+                f.seek(start)
+                lines = [line for line in gzip.decompress(f.read(end - start)).split(b'\n') if line.strip()]
+                lines.reverse()
+                out += _parse(lines[skip:skip + n - len(out)])
+                skip = 0
+                if len(out) >= n:
+                    break
+        return out
+
+    def rows(self):
+        """Every row, oldest first (archives, active file, pending); for exports and rescoring."""
+        for name in reversed(self.archives()):
+            path = os.path.join(self.archive_dir, name)
+            opener = gzip.open if name.endswith('.gz') else open
+            with opener(path, 'rt', encoding='utf-8', newline='') as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                yield from reader
+        if os.path.isfile(self.path):
+            with open(self.path, encoding='utf-8', newline='') as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                yield from reader
+        with self._lock:
+            pending = [[str(v) for v in r] for r in self._buffer]
+        yield from pending
+
+    def clear(self):
+        """Delete the active file, every archive and the pending rows."""
+        with self._lock:
+            self._buffer = []
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+            if os.path.isdir(self.archive_dir):
+                stem = os.path.splitext(os.path.basename(self.path))[0]
+                for name in os.listdir(self.archive_dir):
+                    if name.startswith(stem + '.'):
+                        os.remove(os.path.join(self.archive_dir, name))
+            self._active_rows, self._active_day = 0, None
+            self._indexes = {}
+            for listener in self._listeners:
+                listener(None)
+
+
+def _first_row(path):
+    try:
+        with open(path, encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            return next(reader, None)
+    except OSError:
+        return None
+
+
+def bench(rows, page):
+    import pandas as pd
+
+    tmp = tempfile.mkdtemp()
+    try:
+        log = HistoryLog(os.path.join(tmp, LOG_FILE), os.path.join(tmp, ARCHIVE_DIR), rotate_bytes=8 * 2 ** 20,
+                         daily=False, flush_rows=5000, flush_seconds=0)
+        t0 = time.perf_counter()
+        for start in range(0, rows, 5000):
+            log.append([[f"2026-10-{1 + i * 30 // rows:02d} 08:{i % 60:02d}:00", 'CGL (Continuous Galvanizing Line)',
+                         f"LOT-{i:07d}", 800, 460, 40, 'PASS', 'AI Check', 'Low']
+                        for i in range(start, min(rows, start + 5000))])
+        log.flush()
+        log.wait_compressed(600)
+        write = time.perf_counter() - t0
+        print(f"{rows:,} rows written in {write:.1f} s ({rows / write:,.0f} rows/s); "
+              f"{len(log.archives())} archives, active {os.path.getsize(log.path) / 2 ** 20:.1f} MB")
+        for skip in (0, rows // 10, rows // 2, rows - page):
+            t0 = time.perf_counter()
+            got = log.tail(page, skip)
+            print(f"tail({page}, skip={skip:,}): {(time.perf_counter() - t0) * 1000:7.1f} ms  first {got[0][2]}")
+        t0 = time.perf_counter()
+        total = log.count()
+        print(f"count(): {total:,} in {(time.perf_counter() - t0) * 1000:.1f} ms")
+        # วิธีเดิม: อ่านทั้งไฟล์แล้ว sort ทุก rerun (ที่นี่อ่านทุกส่วนรวมกัน)
+        t0 = time.perf_counter()
+        frames = [pd.read_csv(os.path.join(log.archive_dir, n)) for n in log.archives()] + [pd.read_csv(log.path)]
+        pd.concat(frames).sort_values(by='Timestamp', ascending=False).head(page)
+        print(f"read_csv + sort_values of everything: {(time.perf_counter() - t0) * 1000:,.0f} ms")
+    finally:
+        shutil.rmtree(tmp)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default=LOG_FILE)
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    t = sub.add_parser('tail', help="newest rows first")
+    t.add_argument('-n', type=int, default=20)
+    t.add_argument('--skip', type=int, default=0)
+    sub.add_parser('list', help="active file and archives with their row counts")
+    sub.add_parser('rotate', help="archive the active file now")
+    b = sub.add_parser('bench', help="tail-read latency against a synthetic log")
+    b.add_argument('--rows', type=int, default=1000000)
+    b.add_argument('--page', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'bench':
+        bench(args.rows, args.page)
+        return
+    log = HistoryLog(args.path, args.archive_dir, flush_seconds=0)
+    if args.cmd == 'tail':
+        writer = csv.writer(sys.stdout)
+        writer.writerow(HEADER)
+        writer.writerows(log.tail(args.n, args.skip))
+    elif args.cmd == 'list':
+        print(f"{args.path}: {log._count_active():,} rows")
+        for name in log.archives():
+            index = log._index(name)
+            span = f"{index.get('first')} .. {index.get('last')}" if 'first' in index else 'compressing'
+            print(f"{os.path.join(args.archive_dir, name)}: {index['rows']:,} rows ({span})")
+    elif args.cmd == 'rotate':
+        name = log.rotate()
+        log.wait_compressed()
+        print(f"archived as {name}" if name else "nothing to rotate")
+
+
+if __name__ == '__main__':
+    main()
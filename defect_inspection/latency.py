@@ -0,0 +1,96 @@
+"""Time-to-status and time-to-complete of every inspection.
+
+Each inspection -- single or batch, simulated, served from the verdict cache,
+passed by the local pre-screen or answered by Gemini -- adds one row: how long
+until the PASS/FAIL verdict was known and how long until the full analysis
+was. Both are measured from the moment the inspection started.
+
+    python -m defect_inspection.latency report --days 7
+"""
+import time
+import sqlite3
+import argparse
+import threading
+
+LATENCY_FILE = 'inspection_latency.db'
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else None
+
+
+class LatencyLog:
+    def __init__(self, path=LATENCY_FILE):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS inspection_latency (
+                    Id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    Created_At REAL NOT NULL,
+                    Line TEXT NOT NULL,
+                    Lot TEXT,
+                    Source TEXT NOT NULL,
+                    Status TEXT NOT NULL,
+                    Status_Ms REAL NOT NULL,
+                    Complete_Ms REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_latency_created ON inspection_latency (Created_At)")
+
+    # หนึ่ง connection ต่อหนึ่ง thread (Streamlit รันแต่ละ session คนละ thread)
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def add(self, rows):
+        """Record inspections: ``(line, lot, source, status, status_ms, complete_ms)`` tuples."""
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT INTO inspection_latency (Created_At, Line, Lot, Source, Status, Status_Ms, Complete_Ms) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", [(now, *row) for row in rows])
+
+    def summary(self, days=None, limit=2000):
+        """``{source: {'n', 'status_p50', 'status_p95', 'complete_p50', 'complete_p95'}}`` over the latest ``limit`` rows."""
+        since = time.time() - days * 86400 if days else 0
+        rows = self._connect().execute(
+            "SELECT Source, Status_Ms, Complete_Ms FROM inspection_latency WHERE Created_At >= ? "
+            "ORDER BY Id DESC LIMIT ?", (since, limit)).fetchall()
+        by_source = {}
+        for source, status_ms, complete_ms in rows:
+            s = by_source.setdefault(source, ([], []))
+            s[0].append(status_ms)
+            s[1].append(complete_ms)
+        return {source: {'n': len(st), 'status_p50': _percentile(st, 0.5), 'status_p95': _percentile(st, 0.95),
+                         'complete_p50': _percentile(co, 0.5), 'complete_p95': _percentile(co, 0.95)}
+                for source, (st, co) in by_source.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default=LATENCY_FILE)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    r = sub.add_parser('report', help="p50/p95 time-to-status and time-to-complete per source")
+    r.add_argument('--days', type=float, default=None)
+    r.add_argument('--limit', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'report':
+        summary = LatencyLog(args.path).summary(args.days, args.limit)
+        print(f"{'source':<12} {'n':>7} {'status p50':>11} {'status p95':>11} {'complete p50':>13} {'complete p95':>13}")
+        for source, s in sorted(summary.items()):
+            print(f"{source:<12} {s['n']:>7,} {s['status_p50']:>9,.0f}ms {s['status_p95']:>9,.0f}ms "
+                  f"{s['complete_p50']:>11,.0f}ms {s['complete_p95']:>11,.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Shrink CCTV stills before they are sent to Gemini.
+
+An upload is decoded once, turned upright from its EXIF orientation, converted
+to RGB and re-encoded as JPEG at ``quality`` with its longest side capped at
+``max_side``. Very wide (or tall) strip images -- more than ``TILE_ASPECT``
+times longer than they are high -- are cut into overlapping crops instead, each
+capped separately, so a long coil strip keeps enough detail per crop; the crop
+verdicts are merged with ``merge_verdicts`` (FAIL if any crop fails).
+
+The result also carries a small preview JPEG for ``st.image``, so the page
+does not decode the full-resolution upload again on every rerun.
+
+    python -m defect_inspection.preprocess report frame1.jpg frame2.png --max-side 1280
+"""
+import io
+import math
+import time
+import argparse
+
+MAX_SIDE = 1600
+QUALITY = 85
+TILE_ASPECT = 3.0    # ยาวกว่าสูงเกิน 3 เท่า -> ตัดเป็นหลายภาพ
+TILE_RATIO = 2.0     # แต่ละภาพยาว 2 เท่าของด้านสั้น
+TILE_OVERLAP = 0.15  # ซ้อนกัน 15% กันรอยตำหนิตรงรอยต่อหาย
+PREVIEW_SIDE = 1024
+MIME_TYPE = 'image/jpeg'
+
+
+def settings(max_side=MAX_SIDE, quality=QUALITY, tile=True):
+    """Preprocessing settings as a dict (also part of the verdict cache key)."""
+    return {'max_side': int(max_side), 'quality': int(quality), 'tile': bool(tile)}
+
+
+def _upright(data):
+    from PIL import Image, ImageOps
+
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    return image if image.mode == 'RGB' else image.convert('RGB')
+
+
+def _encode(image, max_side, quality):
+    from PIL import Image
+
+    image = image.copy()
+    image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    image.save(buf, format='JPEG', quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def tile_boxes(width, height, aspect=TILE_ASPECT, ratio=TILE_RATIO, overlap=TILE_OVERLAP):
+    """Crop boxes ``(left, top, right, bottom)`` covering the image; one box unless it is a long strip."""
+    long_side, short_side = max(width, height), min(width, height)
+    if short_side == 0 or long_side / short_side <= aspect:
+        return [(0, 0, width, height)]
+    size = int(short_side * ratio)
+    n = math.ceil((long_side - size) / (size * (1 - overlap))) + 1
+    # วางให้ภาพสุดท้ายชนขอบพอดี ระยะซ้อนจริงจึง >= overlap เสมอ
+    starts = [round(i * (long_side - size) / (n - 1)) for i in range(n)]
+    if width >= height:
+        return [(s, 0, s + size, height) for s in starts]
+    return [(0, s, width, s + size) for s in starts]
+
+
+def prepare(data, max_side=MAX_SIDE, quality=QUALITY, tile=True):
+    """Preprocess raw upload bytes.
+
+    Returns ``{'parts': [jpeg bytes, ...], 'boxes', 'preview', 'original_size', 'original_bytes',
+    'sent_bytes', 'prep_ms'}``; ``parts`` has more than one entry only for tiled strips.
+    """
+    t0 = time.perf_counter()
+    image = _upright(data)
+    boxes = tile_boxes(*image.size) if tile else [(0, 0) + image.size]
+    parts = [_encode(image.crop(box) if len(boxes) > 1 else image, max_side, quality) for box in boxes]
+    return {
+        'parts': parts,
+        'boxes': boxes,
+        'preview': _encode(image, min(PREVIEW_SIDE, max_side), quality),
+        'original_size': image.size,
+        'original_bytes': len(data),
+        'sent_bytes': sum(len(p) for p in parts),
+        'prep_ms': (time.perf_counter() - t0) * 1000,
+    }
+
+
+def blob(part, mime_type=MIME_TYPE):
+    """A part in the form ``generate_content`` accepts next to the prompt."""
+    return {'mime_type': mime_type, 'data': part}
+
+
+def merge_verdicts(verdicts, total=None):
+    """One ``(status, text)`` from the verdicts of every crop: FAIL if any crop fails.
+
+    ``total`` is the number of crops when only the first ``len(verdicts)`` are in (while streaming).
+    """
+    total = total or len(verdicts)
+    if total == 1:
+        return verdicts[0]
+    status = 'FAIL' if any(s == 'FAIL' for s, _ in verdicts) else 'PASS'
+    text = '\n\n'.join(f"#### Section {i}/{total}: {s}\n{t}" for i, (s, t) in enumerate(verdicts, start=1))
+    return status, text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    r = sub.add_parser('report', help="bytes before/after and preprocessing time per image")
+    r.add_argument('images', nargs='+')
+    r.add_argument('--max-side', type=int, default=MAX_SIDE)
+    r.add_argument('--quality', type=int, default=QUALITY)
+    r.add_argument('--no-tile', action='store_true')
+    args = parser.parse_args(argv)
+
+    print(f"{'image':<32} {'size':>11} {'original':>10} {'sent':>10} {'saved':>6} {'parts':>5} {'ms':>6}")
+    total_in = total_out = 0
+    for path in args.images:
+        with open(path, 'rb') as f:
+            data = f.read()
+        p = prepare(data, args.max_side, args.quality, not args.no_tile)
+        total_in, total_out = total_in + p['original_bytes'], total_out + p['sent_bytes']
+        w, h = p['original_size']
+        print(f"{path[-32:]:<32} {f'{w}x{h}':>11} {p['original_bytes']:>10,} {p['sent_bytes']:>10,} "
+              f"{1 - p['sent_bytes'] / p['original_bytes']:>6.0%} {len(p['parts']):>5} {p['prep_ms']:>6.0f}")
+    if len(args.images) > 1:
+        print(f"{'total':<32} {'':>11} {total_in:>10,} {total_out:>10,} {1 - total_out / total_in:>6.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""Local pre-screen that decides which frames need Gemini at all.
+
+Each frame is reduced to a small feature vector (colour histograms plus
+brightness, edge and texture statistics of a 256 px thumbnail) and scored by a
+per-line scikit-learn classifier. The labelled history it learns from grows as
+the page is used: every frame Gemini judges is recorded with its verdict, and
+folders of hand-labelled frames can be imported as well.
+
+A frame whose defect probability is below ``pass_below`` is passed locally,
+without an API call; uncertain or suspicious frames still go to Gemini. A small
+``AUDIT_RATE`` of the locally passed frames is sent anyway, so how often the
+pre-screen agrees with Gemini (and how many defects it would have let through)
+stays measurable. Lines without a trained model send everything to Gemini.
+
+    python -m defect_inspection.prescreen import-dir labelled/CGL --line CGL   # PASS/ and FAIL/ subfolders
+    python -m defect_inspection.prescreen train
+    python -m defect_inspection.prescreen report
+"""
+import io
+import os
+import json
+import random
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+import numpy as np
+
+PRESCREEN_FILE = 'prescreen.db'
+MODEL_DIR = os.path.join('models', 'prescreen')
+FEATURE_VERSION = 1
+THUMB_SIDE = 256
+HIST_BINS = 16
+PASS_BELOW = 0.05      # ความน่าจะเป็นของเสียต่ำกว่านี้ -> ผ่านโดยไม่ถาม Gemini
+AUDIT_RATE = 0.05      # ส่วนของเคสที่ผ่านในเครื่องแต่ยังส่งไปตรวจซ้ำ เพื่อวัด agreement
+MIN_SAMPLES = 40
+MIN_PER_CLASS = 5
+CV_THRESHOLDS = [0.02, 0.05, 0.1, 0.2]
+
+
+def line_code(line_name):
+    """``'CGL (Continuous Galvanizing Line)'`` -> ``'CGL'`` (samples and models are kept per code)."""
+    return line_name.split()[0]
+
+
+def features(data):
+    """Feature vector (float32) of one encoded image."""
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(data))
+    image.draft('RGB', (THUMB_SIDE * 2, THUMB_SIDE * 2))  # JPEG: decode ที่ความละเอียดต่ำเลย เร็วกว่าหลายเท่า
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    image.thumbnail((THUMB_SIDE, THUMB_SIDE))
+    rgb = np.asarray(image, dtype=np.float32) / 255.0
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+    hist = [np.histogram(rgb[..., c], bins=HIST_BINS, range=(0.0, 1.0))[0] / gray.size for c in range(3)]
+    # ขอบ/รอย: gradient และ Laplacian ของภาพขาวดำ
+    gx, gy = np.diff(gray, axis=1)[:-1, :], np.diff(gray, axis=0)[:, :-1]
+    grad = np.hypot(gx, gy)
+    lap = 4 * gray[1:-1, 1:-1] - gray[:-2, 1:-1] - gray[2:, 1:-1] - gray[1:-1, :-2] - gray[1:-1, 2:]
+    # ความไม่สม่ำเสมอเฉพาะจุด: std ของบล็อก 16x16
+    h, w = (gray.shape[0] // 16) * 16, (gray.shape[1] // 16) * 16
+    blocks = gray[:h, :w].reshape(h // 16, 16, w // 16, 16).std(axis=(1, 3)) if h and w else np.zeros(1)
+    # สนิม/คราบ: สีแดงกว่าน้ำเงินผิดปกติ
+    warm = rgb[..., 0] - rgb[..., 2]
+    stats = [
+        gray.mean(), gray.std(), *np.percentile(gray, [1, 50, 99]),
+        grad.mean(), grad.std(), np.percentile(grad, 99), (grad > 0.1).mean(),
+        lap.var(), np.abs(lap).mean(),
+        blocks.mean(), blocks.max(), blocks.std(),
+        warm.mean(), np.percentile(warm, 99), rgb.std(axis=2).mean(),
+    ]
+    return np.concatenate(hist + [np.array(stats)]).astype(np.float32)
+
+
+def build_model():
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.linear_model import LogisticRegression
+
+    return make_pipeline(StandardScaler(), LogisticRegression(class_weight='balanced', max_iter=2000, C=0.5))
+
+
+class Prescreen:
+    def __init__(self, path=PRESCREEN_FILE, model_dir=MODEL_DIR, audit_rate=AUDIT_RATE):
+        self.path = path
+        self.model_dir = model_dir
+        self.audit_rate = audit_rate
+        self._local = threading.local()
+        self._models = {}   # code -> (mtime, model)
+        self._lock = threading.Lock()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS samples (
+                    Image_Hash TEXT NOT NULL,
+                    Line TEXT NOT NULL,
+                    Feature_Version INTEGER NOT NULL,
+                    Features BLOB NOT NULL,
+                    Label TEXT NOT NULL,
+                    Source TEXT NOT NULL,
+                    Created_At TEXT NOT NULL,
+                    PRIMARY KEY (Image_Hash, Line)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS screenings (
+                    Id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    Line TEXT NOT NULL,
+                    Image_Hash TEXT NOT NULL,
+                    Score REAL,
+                    Decision TEXT NOT NULL,
+                    Gemini_Status TEXT,
+                    Created_At TEXT NOT NULL
+                )
+            """)
+
+    # หนึ่ง connection ต่อหนึ่ง thread (Streamlit รันแต่ละ session คนละ thread)
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    # ==========================================
+    # models
+    # ==========================================
+    def _artifact(self, code):
+        return os.path.join(self.model_dir, f"{code}.joblib")
+
+    def model(self, code):
+        """The trained model of a line, reloaded when the artifact changes; None if not trained."""
+        path = self._artifact(code)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._models.get(code)
+            if entry is None or entry[0] != mtime:
+                import joblib
+                entry = (mtime, joblib.load(path))
+                self._models[code] = entry
+            return entry[1]
+
+    def score(self, line_name, data, feats=None):
+        """Defect probability of a frame under its line's model, or None if the line has no model."""
+        model = self.model(line_code(line_name))
+        if model is None:
+            return None
+        feats = features(data) if feats is None else feats
+        return float(model.predict_proba(feats[None, :])[0, 1])
+
+    def screen(self, line_name, image_hash, data, pass_below=PASS_BELOW):
+        """Score a frame and decide: ``'local_pass'``, ``'audit'`` (would pass, sent to check), ``'sent'`` or ``'no_model'``.
+
+        Returns ``{'id', 'score', 'decision', 'features'}``.
+        """
+        code = line_code(line_name)
+        feats = features(data)
+        score = self.score(line_name, data, feats)
+        if score is None:
+            decision = 'no_model'
+        elif score < pass_below:
+            decision = 'audit' if random.random() < self.audit_rate else 'local_pass'
+        else:
+            decision = 'sent'
+        conn = self._connect()
+        with conn:
+            cur = conn.execute("INSERT INTO screenings (Line, Image_Hash, Score, Decision, Created_At) VALUES (?, ?, ?, ?, ?)",
+                               (code, image_hash, score, decision, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        return {'id': cur.lastrowid, 'score': score, 'decision': decision, 'features': feats}
+
+    def record(self, line_name, image_hash, screening, gemini_status):
+        """Store Gemini's verdict on a screened frame: a new labelled sample plus the agreement record."""
+        if gemini_status not in ('PASS', 'FAIL'):
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute("UPDATE screenings SET Gemini_Status = ? WHERE Id = ?", (gemini_status, screening['id']))
+            self._add_sample(conn, line_code(line_name), image_hash, screening['features'], gemini_status, 'gemini')
+
+    def _add_sample(self, conn, code, image_hash, feats, label, source):
+        # label ที่คนติดเอง (manual) ไม่ถูกคำตอบของ Gemini เขียนทับ
+        conn.execute(
+            "INSERT INTO samples (Image_Hash, Line, Feature_Version, Features, Label, Source, Created_At) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (Image_Hash, Line) DO UPDATE SET Feature_Version = excluded.Feature_Version, "
+            "Features = excluded.Features, Label = excluded.Label, Source = excluded.Source, Created_At = excluded.Created_At "
+            "WHERE samples.Source != 'manual' OR excluded.Source = 'manual'",
+            (image_hash, code, FEATURE_VERSION, feats.astype(np.float32).tobytes(), label, source,
+             datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+    def import_dir(self, directory, code):
+        """Add hand-labelled frames from ``directory/PASS`` and ``directory/FAIL``; returns counts per label."""
+        from defect_inspection.verdicts import image_hash
+
+        counts = {}
+        conn = self._connect()
+        for label in ('PASS', 'FAIL'):
+            folder = os.path.join(directory, label)
+            if not os.path.isdir(folder):
+                continue
+            with conn:
+                for name in sorted(os.listdir(folder)):
+                    if not name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                        continue
+                    with open(os.path.join(folder, name), 'rb') as f:
+                        data = f.read()
+                    self._add_sample(conn, code, image_hash(data), features(data), label, 'manual')
+                    counts[label] = counts.get(label, 0) + 1
+        return counts
+
+    def samples(self, code):
+        rows = self._connect().execute(
+            "SELECT Features, Label FROM samples WHERE Line = ? AND Feature_Version = ? ORDER BY Created_At",
+            (code, FEATURE_VERSION)).fetchall()
+        if not rows:
+            return np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int8)
+        X = np.vstack([np.frombuffer(f, dtype=np.float32) for f, _ in rows])
+        y = np.array([label == 'FAIL' for _, label in rows], dtype=np.int8)
+        return X, y
+
+    def lines(self):
+        return [code for (code,) in self._connect().execute("SELECT DISTINCT Line FROM samples ORDER BY Line")]
+
+    def train(self, code):
+        """Fit and save the model of one line; returns the metadata (with cross-validated threshold stats)."""
+        X, y = self.samples(code)
+        n_fail = int(y.sum())
+        if len(y) < MIN_SAMPLES or min(n_fail, len(y) - n_fail) < MIN_PER_CLASS:
+            raise ValueError(f"{code}: {len(y)} samples ({n_fail} FAIL) -- need {MIN_SAMPLES}+ "
+                             f"with at least {MIN_PER_CLASS} of each label")
+        import joblib
+        from sklearn.metrics import roc_auc_score
+        from sklearn.model_selection import StratifiedKFold, cross_val_predict
+
+        folds = StratifiedKFold(n_splits=min(5, n_fail, len(y) - n_fail), shuffle=True, random_state=0)
+        proba = cross_val_predict(build_model(), X, y, cv=folds, method='predict_proba')[:, 1]
+        meta = {
+            'line': code,
+            'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'feature_version': FEATURE_VERSION,
+            'n_samples': len(y),
+            'n_fail': n_fail,
+            'cv_auc': float(roc_auc_score(y, proba)),
+            # ถ้าใช้ threshold นี้: ผ่านในเครื่องได้กี่ % และปล่อยของเสียหลุดไปกี่ชิ้น
+            'cv_thresholds': [{'pass_below': t, 'local_pass': float((proba < t).mean()),
+                               'missed_fail': int(((proba < t) & (y == 1)).sum())} for t in CV_THRESHOLDS],
+        }
+        model = build_model().fit(X, y)
+        os.makedirs(self.model_dir, exist_ok=True)
+        tmp = self._artifact(code) + '.tmp'
+        joblib.dump(model, tmp)
+        os.replace(tmp, self._artifact(code))
+        with open(os.path.join(self.model_dir, f"{code}.json"), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        return meta
+
+    # ==========================================
+    # savings / agreement
+    # ==========================================
+    def report(self):
+        """Per line: frames screened, share passed locally, and agreement with Gemini where both judged."""
+        out = {}
+        for code, decision, score, gemini in self._connect().execute(
+                "SELECT Line, Decision, Score, Gemini_Status FROM screenings"):
+            r = out.setdefault(code, {'screened': 0, 'local_pass': 0, 'audited': 0, 'audit_fail': 0,
+                                      'compared': 0, 'agree': 0})
+            r['screened'] += 1
+            r['local_pass'] += decision == 'local_pass'
+            if gemini is None or score is None:
+                continue
+            r['compared'] += 1
+            r['agree'] += (score >= 0.5) == (gemini == 'FAIL')
+            if decision == 'audit':
+                r['audited'] += 1
+                r['audit_fail'] += gemini == 'FAIL'
+        for r in out.values():
+            r['saved'] = r['local_pass'] / r['screened'] if r['screened'] else 0.0
+            r['agreement'] = r['agree'] / r['compared'] if r['compared'] else None
+        return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=PRESCREEN_FILE)
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    im = sub.add_parser('import-dir', help="add hand-labelled frames (PASS/ and FAIL/ subfolders)")
+    im.add_argument('directory')
+    im.add_argument('--line', required=True, help="line code, e.g. CGL")
+    tr = sub.add_parser('train', help="train every line with enough labelled samples")
+    tr.add_argument('--line', action='append', help="only these line codes (repeatable)")
+    sub.add_parser('report', help="frames saved and agreement with Gemini per line")
+    args = parser.parse_args(argv)
+
+    prescreen = Prescreen(args.db, args.model_dir)
+    if args.cmd == 'import-dir':
+        counts = prescreen.import_dir(args.directory, args.line)
+        print(f"{args.line}: imported {counts.get('PASS', 0)} PASS / {counts.get('FAIL', 0)} FAIL frames")
+    elif args.cmd == 'train':
+        for code in args.line or prescreen.lines():
+            try:
+                meta = prescreen.train(code)
+            except ValueError as e:
+                print(f"skipped {e}")
+                continue
+            print(f"{code}: {meta['n_samples']} samples ({meta['n_fail']} FAIL), cross-validated AUC {meta['cv_auc']:.3f}")
+            for t in meta['cv_thresholds']:
+                print(f"    pass below {t['pass_below']:.2f}: {t['local_pass']:6.1%} of frames skip Gemini, "
+                      f"{t['missed_fail']} FAIL frames would have passed")
+    elif args.cmd == 'report':
+        rows = prescreen.report()
+        if not rows:
+            print("no frames screened yet")
+        for code, r in sorted(rows.items()):
+            agreement = f"{r['agreement']:.1%} of {r['compared']}" if r['agreement'] is not None else '-'
+            print(f"{code:<6} screened {r['screened']:>6,}  skipped Gemini {r['saved']:6.1%}  agreement {agreement}  "
+                  f"audited local passes {r['audited']} ({r['audit_fail']} were FAIL)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+"""Parameter risk of a lot, from its P1-P3 values, before the image is analysed.
+
+Each parameter is first placed inside its ``LINE_CONFIG`` spec range
+(``u = -1`` at ``min``, ``0`` in the middle, ``+1`` at ``max``). On that scale a
+lot is then compared with the line's recent history: the mean and covariance of
+the last ``WINDOW`` lots logged for the same line in ``production_logs_v2.csv``
+give a z-score per parameter and a Mahalanobis distance for the combination
+(a floor of ``RIDGE`` on every spread keeps a line that always runs the same
+setpoint from turning every small change into an outlier). Only lots inside
+spec become history, and repeated log rows of one lot -- a batch logs every
+frame -- count as one lot.
+
+    High    a parameter outside its spec, or distance beyond the 99.9% point
+    Medium  a parameter within ``EDGE`` of a spec limit, or beyond the 99% point
+    Low     otherwise (history is only used once a line has ``MIN_HISTORY`` lots)
+
+``RiskEngine`` keeps per-line running sums and folds in rows appended to the
+log since it last looked, so scoring a lot on every rerun costs microseconds.
+Given the page's ``HistoryLog`` it starts from the newest ``SEED_ROWS`` rows
+(across rotated archives) and is then fed every append directly.
+``rescore`` scores a whole historical log, each row against the rows before it,
+in one vectorized NumPy pass:
+
+    python -m defect_inspection.risk rescore                # level counts per line
+    python -m defect_inspection.risk rescore --write        # rewrite the Risk column
+    python -m defect_inspection.risk rescore --path log_archive/production_logs_v2.20261001-000000-000000.csv.gz
+    python -m defect_inspection.risk bench --rows 200000
+"""
+import io
+import os
+import csv
+import time
+import argparse
+import threading
+from collections import deque
+
+import numpy as np
+
+from defect_inspection.lines import LINE_CONFIG
+
+LOG_FILE = 'production_logs_v2.csv'
+PARAMS = ['Param 1', 'Param 2', 'Param 3']
+WINDOW = 200          # ล็อตล่าสุดต่อไลน์ที่ใช้คิดค่าเฉลี่ย/ความแปรปรวน
+MIN_HISTORY = 20      # ยังมีประวัติไม่ถึงนี้ ใช้แค่สเปก min/max
+EDGE = 0.8            # |u| เกินนี้ = อยู่ใน 10% สุดท้ายก่อนชนขอบสเปก
+RIDGE = 0.02          # spread ขั้นต่ำ (สัดส่วนของครึ่งช่วงสเปก)
+D2_MEDIUM = 11.34     # chi-square 3 องศาอิสระ ที่ 99%
+D2_HIGH = 16.27       # ที่ 99.9%
+SEED_ROWS = 20000     # แถวล่าสุดจาก HistoryLog ที่ใช้ตั้งต้น (ต้องพอให้ทุกไลน์มีครบ WINDOW ล็อต)
+LEVELS = np.array(['Low', 'Medium', 'High', 'Unknown'])
+
+
+def spec_limits(line_config=LINE_CONFIG):
+    """``{line_name: (min (3,), max (3,))}`` of P1-P3."""
+    return {name: tuple(np.array([cfg[f'Param{i}'][k] for i in (1, 2, 3)], dtype=np.float64) for k in ('min', 'max'))
+            for name, cfg in line_config.items()}
+
+
+def _positions(lines, X, limits):
+    """Spec-relative ``u`` of every row (NaN for unknown lines or missing values) and the line index per row."""
+    names, inv = np.unique(np.asarray(lines, dtype=str), return_inverse=True)
+    lo = np.array([limits[n][0] if n in limits else np.full(3, np.nan) for n in names]).reshape(-1, 3)
+    hi = np.array([limits[n][1] if n in limits else np.full(3, np.nan) for n in names]).reshape(-1, 3)
+    mid, half = (lo + hi) / 2, (hi - lo) / 2
+    u = (np.asarray(X, dtype=np.float64) - mid[inv]) / half[inv]
+    return u, inv.reshape(-1), names
+
+
+def _lot_base(lots):
+    # batch บันทึกเป็น LOT/ชื่อไฟล์ -> ทุกเฟรมคือล็อตเดียวกัน
+    return np.char.partition(np.asarray(lots, dtype=str), '/')[:, 0]
+
+
+def _features(u):
+    """``[u, vec(u u^T)]`` per row: summing these gives the first and second moments."""
+    return np.concatenate([u, (u[:, :, None] * u[:, None, :]).reshape(-1, 9)], axis=1)
+
+
+def assess(u, sums, counts):
+    """Risk of rows ``u`` against histories given by moment ``sums`` (n, 12) over ``counts`` lots.
+
+    Returns ``{'level', 'z', 'd2'}`` arrays; ``z``/``d2`` are NaN where the history is too short.
+    """
+    n = len(u)
+    z = np.full((n, 3), np.nan)
+    d2 = np.full(n, np.nan)
+    known = np.isfinite(u).all(axis=1)
+    ok = known & (counts >= MIN_HISTORY)
+    if ok.any():
+        c = counts[ok][:, None]
+        mean = sums[ok, :3] / c
+        cov = sums[ok, 3:].reshape(-1, 3, 3) / c[:, :, None] - mean[:, :, None] * mean[:, None, :]
+        cov += RIDGE ** 2 * np.eye(3)
+        diff = u[ok] - mean
+        z[ok] = diff / np.sqrt(np.diagonal(cov, axis1=1, axis2=2))
+        d2[ok] = np.einsum('ni,ni->n', diff, np.linalg.solve(cov, diff[:, :, None])[:, :, 0])
+    spec = np.abs(np.where(known[:, None], u, 0)).max(axis=1)
+    with np.errstate(invalid='ignore'):
+        level = np.select([~known, (spec > 1) | (d2 >= D2_HIGH), (spec > EDGE) | (d2 >= D2_MEDIUM)], [3, 2, 1], 0)
+    return {'level': LEVELS[level], 'z': z, 'd2': d2}
+
+
+def rescore(lines, lots, X, line_config=LINE_CONFIG, window=WINDOW):
+    """Score every row of a log against the ``window`` distinct lots logged before it on the same line.
+
+    ``lines``/``lots`` are sequences of strings, ``X`` is (n, 3) P1-P3, in log order.
+    Returns ``assess``'s arrays plus ``u`` and ``history`` (lots the row was compared with).
+    """
+    u, inv, _ = _positions(lines, X, spec_limits(line_config))
+    n = len(u)
+    if n == 0:
+        return {'level': LEVELS[:0], 'z': np.empty((0, 3)), 'd2': np.empty(0), 'u': u, 'history': np.empty(0, int)}
+    order = np.argsort(inv, kind='stable')  # เรียงตามไลน์ คงลำดับเวลาในแต่ละไลน์
+    gs, us, bs = inv[order], u[order], _lot_base(lots)[order]
+    valid = (np.abs(us) <= 1).all(axis=1)  # นอกสเปก/ไม่มีค่า ไม่นับเป็นประวัติปกติของไลน์
+    first = np.r_[True, gs[1:] != gs[:-1]]
+    repeat = np.r_[False, (bs[1:] == bs[:-1]) & (us[1:] == us[:-1]).all(axis=1)] & ~first
+    keep = valid & ~repeat
+
+    # prefix sums ของ moment เฉพาะแถวที่นับเป็นล็อต: ผลรวมของหน้าต่างใดๆ = ผลต่างของสองตำแหน่ง
+    prefix = np.vstack([np.zeros(12), np.cumsum(_features(us[keep]), axis=0)])
+    before = np.cumsum(keep) - keep                              # ล็อตที่มาก่อนแถวนี้ (ทุกไลน์)
+    start = np.maximum.accumulate(np.where(first, before, 0))    # ล็อตแรกของไลน์นี้
+    lo = np.maximum(start, before - window)
+    counts = before - lo
+    result = assess(us, prefix[before] - prefix[lo], counts)
+
+    unsort = np.empty_like(order)
+    unsort[order] = np.arange(n)
+    out = {k: v[unsort] for k, v in result.items()}
+    out['u'], out['history'] = u, counts[unsort]
+    return out
+
+
+class _LineHistory:
+    def __init__(self, window):
+        self.lots = deque(maxlen=window)
+        self.sums = np.zeros(12)
+        self.last = None
+
+    def extend(self, bases, u):
+        """Fold in consecutive log rows of this line (same repeat rule as ``rescore``)."""
+        same = np.r_[(bases[0], tuple(u[0])) == self.last, (bases[1:] == bases[:-1]) & (u[1:] == u[:-1]).all(axis=1)]
+        self.last = (bases[-1], tuple(u[-1]))
+        f = _features(u[(np.abs(u) <= 1).all(axis=1) & ~same])
+        if len(f) >= self.lots.maxlen:
+            # โหลด log ทั้งไฟล์ครั้งแรก: ใช้แค่ช่วงท้าย ไม่ต้องไล่ทีละแถว
+            self.lots = deque(f[-self.lots.maxlen:], maxlen=self.lots.maxlen)
+            self.sums = f[-self.lots.maxlen:].sum(axis=0)
+            return
+        for row in f:
+            if len(self.lots) == self.lots.maxlen:
+                self.sums -= self.lots[0]
+            self.lots.append(row)
+            self.sums += row
+
+
+class RiskEngine:
+    """Per-line rolling statistics of the production log, folded in incrementally."""
+
+    def __init__(self, path=LOG_FILE, line_config=LINE_CONFIG, window=WINDOW, history=None):
+        self.path = path
+        self.line_config = line_config
+        self.limits = spec_limits(line_config)
+        self.window = window
+        self.history = history
+        self._lock = threading.Lock()
+        self._reset()
+        if history is not None:
+            # ไฟล์ log ถูกหมุน/บีบอัดได้ อ่านตาม offset ไม่ได้ รับแถวจาก writer โดยตรงแทน
+            from defect_inspection.history import HEADER
+
+            self._columns = [HEADER.index(c) for c in ['Line', 'Lot No.'] + PARAMS]
+            history.subscribe(self._on_append, replay=SEED_ROWS)
+
+    def _reset(self):
+        self._offset = 0
+        self._columns = None
+        self._lines = {}
+
+    def refresh(self):
+        """Fold in rows appended to the log since the last call (starts over if the log was cleared)."""
+        if self.history is not None:
+            return
+        with self._lock:
+            try:
+                size = os.path.getsize(self.path)
+            except OSError:
+                size = 0
+            if size < self._offset:
+                self._reset()
+            if size == self._offset:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                chunk = f.read(size - self._offset)
+            end = chunk.rfind(b'\n') + 1  # แถวสุดท้ายที่ยังเขียนไม่จบ รออ่านรอบหน้า
+            self._offset += end
+            rows = list(csv.reader(io.StringIO(chunk[:end].decode('utf-8'))))
+            if self._columns is None and rows:
+                header = rows.pop(0)
+                self._columns = [header.index(c) for c in ['Line', 'Lot No.'] + PARAMS]
+            self._ingest(rows)
+
+    def _on_append(self, rows):
+        with self._lock:
+            if rows is None:
+                self._lines = {}  # ล้าง log ทั้งหมด
+            else:
+                self._ingest(rows)
+
+    def _ingest(self, rows):
+        rows = [r for r in rows if len(r) > max(self._columns)]
+        if not rows:
+            return
+        i_line, i_lot, *i_params = self._columns
+        lines = [r[i_line] for r in rows]
+        X = np.array([[_float(r[i]) for i in i_params] for r in rows])
+        u, inv, names = _positions(lines, X, self.limits)
+        bases = _lot_base([r[i_lot] for r in rows])
+        for g, name in enumerate(names):
+            rows = inv == g
+            self._lines.setdefault(name, _LineHistory(self.window)).extend(bases[rows], u[rows])
+
+    def score(self, line_name, params):
+        """Risk of one lot: ``{'level', 'u', 'z', 'distance', 'history', 'reasons'}``."""
+        self.refresh()
+        u, _, _ = _positions([line_name], [params], self.limits)
+        with self._lock:
+            history = self._lines.get(line_name)
+            sums = history.sums.copy() if history else np.zeros(12)
+            count = len(history.lots) if history else 0
+        r = assess(u, sums[None, :], np.array([count]))
+        level, z, d2 = r['level'][0], r['z'][0], r['d2'][0]
+        return {
+            'level': str(level),
+            'u': u[0].tolist(),
+            'z': None if np.isnan(d2) else z.tolist(),
+            'distance': None if np.isnan(d2) else float(np.sqrt(d2)),
+            'history': count,
+            'reasons': self._reasons(line_name, params, u[0], z, d2),
+        }
+
+    def _reasons(self, line_name, params, u, z, d2):
+        cfg = self.line_config.get(line_name)
+        if cfg is None:
+            return [f"no spec for {line_name}"]
+        reasons = []
+        for i, (value, ui) in enumerate(zip(params, u), start=1):
+            p = cfg[f'Param{i}']
+            if ui > 1:
+                reasons.append(f"{p['name']} {value} above spec max {p['max']}")
+            elif ui < -1:
+                reasons.append(f"{p['name']} {value} below spec min {p['min']}")
+            elif abs(ui) > EDGE:
+                reasons.append(f"{p['name']} {value} near spec {'max' if ui > 0 else 'min'} {p[('max' if ui > 0 else 'min')]}")
+        if not np.isnan(d2) and d2 >= D2_MEDIUM:
+            worst = int(np.nanargmax(np.abs(z)))
+            reasons.append(f"unusual for this line (distance {np.sqrt(d2):.1f}; "
+                           f"{cfg[f'Param{worst + 1}']['name']} z={z[worst]:+.1f})")
+        return reasons
+
+
+def _float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+def read_log(path=LOG_FILE):
+    import pandas as pd
+
+    return pd.read_csv(path, dtype={'Line': str, 'Lot No.': str}, keep_default_na=False,
+                       converters={c: _float for c in PARAMS})
+
+
+def bench(rows, window):
+    rng = np.random.default_rng(0)
+    names = list(LINE_CONFIG)
+    lines = rng.choice(names, rows)
+    limits = spec_limits()
+    lo = np.array([limits[n][0] for n in lines])
+    hi = np.array([limits[n][1] for n in lines])
+    X = lo + (hi - lo) * rng.normal(0.5, 0.12, (rows, 3))
+    lots = np.array([f"LOT-{i:07d}" for i in range(rows)])
+
+    t0 = time.perf_counter()
+    result = rescore(lines, lots, X, window=window)
+    vectorized = time.perf_counter() - t0
+
+    # แบบทีละแถว (อย่างที่ RiskEngine ทำตอนมีล็อตใหม่) กับตัวอย่างส่วนต้น ผลต้องตรงกับแบบ one pass
+    sample = min(rows, 5000)
+    histories, mismatches = {}, 0
+    t0 = time.perf_counter()
+    for i in range(sample):
+        history = histories.setdefault(lines[i], _LineHistory(window))
+        u, _, _ = _positions([lines[i]], X[i:i + 1], limits)
+        level = assess(u, history.sums[None, :], np.array([len(history.lots)]))['level'][0]
+        mismatches += level != result['level'][i]
+        history.extend(lots[i:i + 1], u)
+    per_row = (time.perf_counter() - t0) / sample
+    counts = {str(level): int((result['level'] == level).sum()) for level in LEVELS}
+    print(f"{rows:,} rows, window {window}: one pass {vectorized * 1000:,.0f} ms ({rows / vectorized:,.0f} rows/s); "
+          f"row by row {per_row * 1e6:,.0f} us/row (~{per_row * rows:,.1f} s for all)")
+    print('  '.join(f"{k} {v:,}" for k, v in counts.items()) + f"; {mismatches} of the first {sample:,} differ between the two")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default=LOG_FILE)
+    parser.add_argument('--window', type=int, default=WINDOW)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    r = sub.add_parser('rescore', help="score every row of the log against the lots before it")
+    r.add_argument('--write', action='store_true', help="rewrite the Risk column with the new levels (run while nobody is logging)")
+    b = sub.add_parser('bench', help="one-pass rescore vs row-by-row scoring on a synthetic log")
+    b.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'rescore' and args.write and args.path.endswith('.gz'):
+        parser.error("--write needs an uncompressed log (archives are read-only)")
+    if args.cmd == 'bench':
+        bench(args.rows, args.window)
+    elif args.cmd == 'rescore':
+        df = read_log(args.path)
+        t0 = time.perf_counter()
+        result = rescore(df['Line'].to_numpy(), df['Lot No.'].to_numpy(), df[PARAMS].to_numpy(), window=args.window)
+        elapsed = time.perf_counter() - t0
+        changed = int((df['Risk'].astype(str).to_numpy() != result['level']).sum()) if 'Risk' in df else len(df)
+        print(f"{len(df):,} rows rescored in {elapsed * 1000:,.0f} ms; {changed:,} levels differ from the log")
+        print(df.assign(New_Risk=result['level']).groupby(['Line', 'New_Risk']).size().unstack(fill_value=0).to_string())
+        if args.write:
+            # เขียนไฟล์ใหม่ทั้งไฟล์แล้วสลับทีเดียว กันไฟล์ครึ่งๆ กลางๆ
+            import pandas as pd
+
+            raw = pd.read_csv(args.path, dtype=str, keep_default_na=False)
+            raw['Risk'] = result['level']
+            tmp = args.path + '.tmp'
+            raw.to_csv(tmp, index=False, encoding='utf-8', lineterminator='\r\n')  # เหมือน csv.writer ของหน้าเว็บ
+            os.replace(tmp, args.path)
+            print(f"wrote {args.path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Streamed Gemini answers: render the text as it arrives, decide the status early.
+
+The prompt asks for ``[STATUS]: PASS`` / ``[STATUS]: FAIL`` on the first line,
+so ``consume`` can report the verdict as soon as that field has streamed in --
+a FAIL alert shows while the rest of the analysis is still being written. When
+an answer has no ``[STATUS]`` field at all, the old rule applies once the text
+is complete: FAIL if "FAIL" appears anywhere in it.
+"""
+import re
+import time
+
+STATUS_RE = re.compile(r'\[STATUS\]\W*(PASS|FAIL)\b', re.IGNORECASE)
+
+
+def parse_status(text):
+    """``'PASS'``/``'FAIL'`` from the ``[STATUS]`` field, or None if it has not arrived yet."""
+    m = STATUS_RE.search(text)
+    return m.group(1).upper() if m else None
+
+
+def final_status(text):
+    # ไม่มีช่อง [STATUS] ให้ใช้เกณฑ์เดิม (Check FAIL only if explicit)
+    return parse_status(text) or ("FAIL" if "FAIL" in text.upper() else "PASS")
+
+
+def texts(response):
+    """Text of each chunk of a ``generate_content(..., stream=True)`` response."""
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            continue  # chunk ที่ไม่มีข้อความ (เช่น finish/safety) ข้ามไป
+        if text:
+            yield text
+
+
+def consume(chunks, on_text=None, on_status=None):
+    """Read streamed text chunks; returns ``(text, status)``.
+
+    ``on_text(text_so_far)`` is called after every chunk and ``on_status(status)``
+    once, as soon as the status is known (at the latest when the text is complete).
+    """
+    text, status = '', None
+    for chunk in chunks:
+        text += chunk
+        if status is None:
+            status = parse_status(text)
+            if status is not None and on_status:
+                on_status(status)
+        if on_text:
+            on_text(text)
+    if status is None:
+        status = final_status(text)
+        if on_status:
+            on_status(status)
+    return text, status
+
+
+def simulated_stream(text, seconds=2.0, chunk_words=4):
+    """``text`` in chunks of a few words spread over ``seconds`` (Simulation Mode)."""
+    words = re.split(r'(\s+)', text)
+    step = chunk_words * 2
+    n = max(1, -(-len(words) // step))
+    for i in range(0, len(words), step):
+        time.sleep(seconds / n)
+        yield ''.join(words[i:i + step])
@@ -0,0 +1,159 @@
+"""Persistent cache of live Gemini inspection verdicts.
+
+A verdict is keyed by the SHA-256 of the image bytes together with everything
+else that goes into the request: the production line and its ``LINE_CONFIG``
+entry, P1/P2/P3, the prompt template version, the model name and the image
+preprocessing settings. Analysing the same CCTV frame again with the same
+settings returns the stored ``result_text``/status without calling the API;
+changing any of them (or the prompt, or the model) is a different key.
+
+Entries live in one SQLite file shared by every session and replica. Entries
+older than ``TTL_DAYS`` are never served, and once the cache holds more than
+``MAX_BYTES`` of verdict text or ``MAX_ENTRIES`` verdicts the least recently
+used ones are dropped. Hit/miss counters are kept in the same file, so the hit
+rate survives restarts.
+
+    python -m defect_inspection.verdicts stats
+    python -m defect_inspection.verdicts clear
+"""
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+CACHE_FILE = 'inspection_verdicts.db'
+TTL_DAYS = 30
+MAX_BYTES = 50 * 2 ** 20
+MAX_ENTRIES = 20000
+
+
+def image_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def verdict_key(image_digest, line_name, line_config, params, prompt_version, model_name, preprocess=None):
+    """Cache key of one inspection request (``image_digest`` from ``image_hash`` of the raw upload)."""
+    # ใส่ LINE_CONFIG ทั้งก้อน: แก้ Defect_Focus/สเปกของไลน์แล้วคำตอบเก่าจะไม่ถูกใช้
+    blob = json.dumps([image_digest, line_name, line_config, [float(p) for p in params], prompt_version, model_name,
+                       preprocess], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class VerdictCache:
+    def __init__(self, path=CACHE_FILE, ttl_days=TTL_DAYS, max_bytes=MAX_BYTES, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl_days * 86400
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS verdicts (
+                    Key TEXT PRIMARY KEY,
+                    Result_Text TEXT NOT NULL,
+                    Status TEXT NOT NULL,
+                    Model TEXT,
+                    Created_At REAL NOT NULL,
+                    Last_Used REAL NOT NULL,
+                    Size INTEGER NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_verdicts_last_used ON verdicts (Last_Used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS verdict_stats (Name TEXT PRIMARY KEY, N INTEGER NOT NULL)")
+
+    # หนึ่ง connection ต่อหนึ่ง thread (Streamlit รันแต่ละ session คนละ thread)
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, conn, name):
+        conn.execute("INSERT INTO verdict_stats (Name, N) VALUES (?, 1) "
+                     "ON CONFLICT (Name) DO UPDATE SET N = N + 1", (name,))
+
+    def get(self, key):
+        """``{'result_text', 'status', 'model', 'created_at'}`` of a live verdict, or None."""
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            row = conn.execute("SELECT Result_Text, Status, Model, Created_At FROM verdicts "
+                               "WHERE Key = ? AND Created_At >= ?", (key, now - self.ttl)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE verdicts SET Last_Used = ? WHERE Key = ?", (now, key))
+            self._count(conn, 'hits' if row is not None else 'misses')
+        if row is None:
+            return None
+        return {'result_text': row[0], 'status': row[1], 'model': row[2], 'created_at': row[3]}
+
+    def put(self, key, result_text, status, model=None):
+        conn = self._connect()
+        now = time.time()
+        size = len(key) + len(result_text.encode('utf-8'))
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO verdicts (Key, Result_Text, Status, Model, Created_At, Last_Used, Size) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", (key, result_text, status, model, now, now, size))
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM verdicts WHERE Created_At < ?", (now - self.ttl,))
+        # LRU: ไล่จากใช้ล่าสุดลงไป เกินเพดานขนาดหรือจำนวนเมื่อไรลบที่เหลือทั้งหมด
+        conn.execute("""
+            DELETE FROM verdicts WHERE Key IN (
+                SELECT Key FROM (
+                    SELECT Key,
+                           SUM(Size) OVER (ORDER BY Last_Used DESC, Key) AS Running,
+                           ROW_NUMBER() OVER (ORDER BY Last_Used DESC, Key) AS N
+                    FROM verdicts
+                ) WHERE Running > ? OR N > ?
+            )
+        """, (self.max_bytes, self.max_entries))
+
+    def stats(self):
+        conn = self._connect()
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(Size), 0) FROM verdicts").fetchone()
+        counts = dict(conn.execute("SELECT Name, N FROM verdict_stats").fetchall())
+        hits, misses = counts.get('hits', 0), counts.get('misses', 0)
+        return {
+            'entries': entries,
+            'bytes': size,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None,
+        }
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM verdicts")
+            conn.execute("DELETE FROM verdict_stats")
+        conn.execute("VACUUM")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default=CACHE_FILE)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('stats', help="entries, size and hit rate")
+    sub.add_parser('clear', help="drop every cached verdict and reset the counters")
+    args = parser.parse_args(argv)
+
+    cache = VerdictCache(args.path)
+    if args.cmd == 'stats':
+        s = cache.stats()
+        rate = f"{s['hit_rate']:.1%}" if s['hit_rate'] is not None else '-'
+        print(f"{s['entries']:,} verdicts, {s['bytes']:,} bytes; {s['hits']:,} hits / {s['misses']:,} misses ({rate})")
+    elif args.cmd == 'clear':
+        cache.clear()
+        print(f"cleared {args.path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,69 @@
 import streamlit as st
-import os
-import sys
-import subprocess
 import time
 import random
-
-# --- 0. FORCE UPDATE SYSTEM ---
-try:
-    import google.generativeai as genai
-except ImportError:
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "google-generativeai>=0.8.3"])
-    st.rerun()
-
-import google.generativeai as genai
-from PIL import Image
-import csv
-import pandas as pd
+import math
 import datetime
+from defect_inspection.lines import LINE_CONFIG
+from defect_inspection.risk import RiskEngine, MIN_HISTORY
+from defect_inspection.stream import consume, simulated_stream
+from defect_inspection.backends import configure as configure_gemini, chain as gemini_chain, BackendsUnavailable, BUDGET
+from defect_inspection.latency import LatencyLog
+from defect_inspection.history import HistoryLog, HEADER as LOG_HEADER
+from defect_inspection.verdicts import VerdictCache, image_hash, verdict_key
+from defect_inspection.preprocess import prepare, settings as preprocess_settings, blob, merge_verdicts
+from defect_inspection.batch import TokenBucket, with_retries, frames_from_uploads, count_frames, simulated_call, run as run_batch, RPM
+
+# google-generativeai / PIL / pandas import ตอนใช้จริง (Live mode / มีรูป / มี log) ไม่ใช่ตอนเปิดหน้า
 
 # --- 1. Config & Setup ---
 st.set_page_config(page_title="NS-SUS Defect Inspection", layout="wide")
 
-# ตั้งค่า API Key (ถ้ามี)
-if "GOOGLE_API_KEY" in st.secrets:
-    genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
+@st.cache_resource
+def get_inspection_chain():
+    # import + ตั้งค่า API Key ครั้งเดียวต่อ process ตอนกด Run Analysis ใน Live mode ครั้งแรก
+    # gemini-2.5-flash -> gemini-2.5-flash-lite, circuit breaker ใช้ร่วมกันทุก session/ทุก thread ของ batch
+    try:
+        api_key = st.secrets.get("GOOGLE_API_KEY")
+    except FileNotFoundError:
+        api_key = None  # ไม่มี secrets.toml
+    configure_gemini(api_key)
+    return gemini_chain()
+
+@st.cache_resource
+def get_verdict_cache():
+    # ผลตรวจ Live เก็บตาม hash รูป + ไลน์ + P1-P3 + prompt version + model: กดซ้ำรูปเดิมไม่เสีย Quota
+    return VerdictCache()
+
+@st.cache_resource
+def get_rate_limiter(rpm):
+    # quota ผูกกับ API key -> bucket เดียวทั้ง process ทุก session/ทุก thread ของ batch ใช้ร่วมกัน
+    return TokenBucket(rpm / 60, burst=4)
+
+@st.cache_resource
+def get_prescreen():
+    # โมเดลคัดกรองในเครื่อง (numpy/sklearn) โหลดเมื่อใช้ Live mode เท่านั้น
+    from defect_inspection.prescreen import Prescreen
+    return Prescreen()
+
+@st.cache_resource
+def get_latency_log():
+    # เวลาจนรู้ผล PASS/FAIL และจนได้คำอธิบายครบ ของทุกการตรวจ
+    return LatencyLog()
+
+@st.cache_resource
+def get_history_log():
+    # writer เดียวทั้ง process: buffer + fsync เป็นชุด, หมุนไฟล์รายวัน/ตามขนาดไป log_archive/*.csv.gz
+    return HistoryLog()
+
+@st.cache_resource
+def get_risk_engine():
+    # สถิติ P1-P3 ย้อนหลังต่อไลน์: ตั้งต้นจากแถวล่าสุดของ history log แล้วรับทุกแถวที่ append เข้ามา
+    return RiskEngine(history=get_history_log())
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def prepare_upload(file_id, _data, max_side, quality, tile):
+    # decode + หมุนตาม EXIF + ย่อ ครั้งเดียวต่อไฟล์ที่อัปโหลด (file_id) และค่าตั้ง: rerun ไม่ต้อง decode รูปเต็มใหม่
+    return prepare(_data, max_side, quality, tile)
 
 # --- 2. SIDEBAR CONFIG (แผงควบคุมลับสำหรับคน Demo) ---
 st.sidebar.title("🔧 Developer Settings")
@@ -34,14 +74,19 @@ if use_simulation:
     force_fail = st.sidebar.checkbox("⚠️ Force Defect (สั่งให้เจอของเสีย)", value=False)
 else:
     st.sidebar.warning("LIVE AI MODE: ระบบจะเรียกใช้ Google Gemini จริง (ระวัง Quota)")
+gemini_rpm = st.sidebar.number_input("Gemini quota (requests/min)", min_value=1, max_value=10000, value=RPM,
+                                     help="ทุก session และทุกงาน batch โหมด live ใน server นี้ใช้ quota ก้อนเดียวกัน (โหมดจำลองแยก quota ของตัวเอง)")
+gemini_budget = st.sidebar.slider("Time budget per inspection (s)", 5, 120, int(BUDGET),
+                                  help="รวมทุกครั้งที่ลองใหม่/สลับไปโมเดลสำรอง เกินเวลานี้ใช้ผลตรวจในเครื่องแทนการรอค้าง")
+backend_status_box = st.sidebar.empty()
 # === ส่วนที่เพิ่ม: ปุ่ม Reset Database ===
 st.sidebar.divider()
 st.sidebar.markdown("### Database Management")
 if st.sidebar.button("Reset Database (Clear All)", type="primary", use_container_width=True):
-    log_file = 'production_logs_v2.csv'
-    if os.path.exists(log_file):
+    history_log = get_history_log()
+    if history_log.count():
         try:
-            os.remove(log_file)
+            history_log.clear()  # ไฟล์ปัจจุบัน + archive ทั้งหมด
             st.toast("History Log Cleared!", icon="✅") # แจ้งเตือนแบบ Toast สวยๆ
             time.sleep(1)
             st.rerun()
@@ -49,41 +94,272 @@ if st.sidebar.button("Reset Database (Clear All)", type="primary", use_container
             st.sidebar.error(f"Error: {e}")
     else:
         st.sidebar.info("Log file is already empty.")
+
+st.sidebar.markdown("### Image Preprocessing")
+use_preprocess = st.sidebar.toggle("Shrink images before sending", value=True, help="ย่อ/บีบอัดรูปก่อนส่งให้ Gemini (ลด bandwidth, token และเวลา)")
+if use_preprocess:
+    max_side = st.sidebar.slider("Max resolution (px, longest side)", 512, 4096, 1600, step=128)
+    jpeg_quality = st.sidebar.slider("JPEG quality", 50, 95, 85)
+    tile_strips = st.sidebar.checkbox("Split wide strip images into overlapping sections", value=True)
+else:
+    max_side, jpeg_quality, tile_strips = 4096, 90, False  # ใช้ทำภาพ preview เท่านั้น ส่งไฟล์ต้นฉบับ
+
+st.sidebar.markdown("### Local Pre-screen")
+use_prescreen = st.sidebar.toggle("Skip Gemini for clearly clean frames", value=True,
+                                  help="โมเดลในเครื่องให้คะแนนรูปก่อน รูปที่สะอาดชัดเจนไม่ต้องส่ง Gemini (ไลน์ที่ยังไม่ได้ train ส่งทุกรูป)")
+prescreen_pass_below = st.sidebar.slider("Pass locally below defect probability", 0.0, 0.5, 0.05, step=0.01,
+                                         disabled=not use_prescreen)
+prescreen_stats_box = st.sidebar.empty()
+
+st.sidebar.markdown("### Verdict Cache")
+cache_stats_box = st.sidebar.empty()  # เติมท้ายสคริปต์ ให้นับรวมการกดรอบนี้ด้วย
+
+st.sidebar.markdown("### Inspection Latency")
+latency_stats_box = st.sidebar.empty()
         
 # --- 3. LOGIC & DATA (Updated based on NSSUS.pdf) ---
-LINE_CONFIG = {
-    "CDCM (Continuous Descaling & Cold Rolling)": { 
-        # อ้างอิงจาก  รวมกระบวนการ Descaling และ Rolling ไว้ด้วยกัน
-        "Product": "CR (Cold Rolled Steel)",
-        "Param1": {"name": "Pickling Acid Temp (°C)", "unit": "°C", "default": 85, "min": 60, "max": 100}, # เพิ่มส่วน Descaling 
-        "Param2": {"name": "Rolling Force (MN)", "unit": "MN", "default": 1500, "min": 0, "max": 3000},
-        "Param3": {"name": "Rolling Speed (mpm)", "unit": "mpm", "default": 1200, "min": 0, "max": 2000},
-        "Defect_Focus": "Residual Scale, Pickling stain, Chatter marks, Edge cracks" # เพิ่ม Defect จากการกัดกรด
-    },
-    "CGL (Continuous Galvanizing Line)": {
-        "Product": "GA/GI (Galvanized Steel)",
-        "Param1": {"name": "Annealing Furnace Temp (°C)", "unit": "°C", "default": 800, "min": 700, "max": 900}, # เพิ่มส่วน Annealing 
-        "Param2": {"name": "Zinc Pot Temp (°C)", "unit": "°C", "default": 460, "min": 440, "max": 480},
-        "Param3": {"name": "Air Knife Pressure (kPa)", "unit": "kPa", "default": 40, "min": 0, "max": 100}, # ควบคุม Coating Weight [cite: 80]
-        "Defect_Focus": "Dross, Uncoated spots, Zinc adhesion (Peeling), Fluting"
-    },
-    "EPL (Electrolytic Plating Line)": {
-        "Product": "TP/TFS (Tinplate/Tin Free)",
-        "Param1": {"name": "Plating Current Density (A/dm²)", "unit": "A/dm²", "default": 20, "min": 0, "max": 100},
-        "Param2": {"name": "Reflow Temperature (°C)", "unit": "°C", "default": 250, "min": 230, "max": 300}, # เพิ่ม Reflow Process 
-        "Param3": {"name": "Coating Weight (g/m²)", "unit": "g/m²", "default": 2.8, "min": 1.0, "max": 11.0}, # สำคัญสำหรับ TP/TFS 
-        "Defect_Focus": "Pinholes, Plating burns (White/Black), Reflow stain, Woodgrain"
-    }
-}
+# LINE_CONFIG (สินค้า, สเปก min/max ของ P1-P3, Defect_Focus) อยู่ใน defect_inspection/lines.py ใช้ร่วมกับ risk engine
+PROMPT_VERSION = 1  # เปลี่ยน prompt ด้านล่างแล้วต้องเพิ่มเลขนี้ (ผลใน verdict cache ของ prompt เก่าจะไม่ถูกใช้)
+
+def build_prompt(line_name, config, p1_val, p2_val):
+    return f"""
+    Role: Senior Process Engineer at NS-Siam United Steel & Chief Financial Officer.
+    Your Goal: Balance Quality Assurance with Production Efficiency. Avoid false positives that cause unnecessary downtime (Economic Loss).
+    
+    Context: Inspecting {config['Product']} on {line_name}.
+    Focus Defects: {config['Defect_Focus']}.
+    
+    Task: Analyze the image for CRITICAL defects only.
+    
+    Decision Logic:
+    1. STRICTLY differentiate between actual defects (cracks, rust, dents) vs. acceptable variations (lighting shadows, minor dust, water stains).
+    2. If the surface looks generally consistent or the anomaly is negligible, decide "PASS".
+    3. Only decide "FAIL" if the defect is clearly visible and affects the product's function.
+    
+    Response format:
+    [STATUS]: (PASS / FAIL) -> ตอบ FAIL เฉพาะเมื่อมั่นใจ 100% ว่าเป็นของเสียร้ายแรง
+    * [DEFECT_DETECTED]: (ระบุสิ่งที่เจอ หรือตอบ "None" ถ้าปกติ กระชับคำตอบใน 1-2 ประโยค)
+    * [CONFIDENCE]: (ระบุ % ความมั่นใจ)
+    * [ANALYSIS]: (วิเคราะห์สาเหตุทางวิศวกรรมสั้นๆ เชื่อมโยงกับ parameter: P1={p1_val}, P2={p2_val} ถ้าเกี่ยวข้อง, กระชับคำตอบใน 1-2 ประโยค)
+    * [NEXT STEP]: (เสนอทางแก้ที่ "คุ้มค่าที่สุด" เชิงเศรษฐศาสตร์ เช่น "ปรับ P1 เล็กน้อยแล้วรันต่อ" หรือ "ตัดส่วนเสียทิ้ง (Crop)" แทนการหยุดเครื่องจักรทันที, กระชับคำตอบใน 1-2 ประโยค)
+    
+    Respond in Thai. Professional & Concise tone.
+    """
+
+def save_logs(rows):
+    # เข้า buffer ของ HistoryLog ทันที (แสดงใน History Log ได้เลย) เขียนลงดิสก์ + fsync เป็นชุดภายใน ~1 วินาที
+    get_history_log().append(rows)
 
 def save_log(timestamp, line_name, lot_id, p1_val, p2_val, p3_val, status, defect_type, risk_level):
-    file_name = 'production_logs_v2.csv'
-    header_needed = not os.path.isfile(file_name)
-    with open(file_name, mode='a', newline='', encoding='utf-8') as file:
-        writer = csv.writer(file)
-        if header_needed:
-            writer.writerow(['Timestamp', 'Line', 'Lot No.', 'Param 1', 'Param 2', 'Param 3', 'Status', 'Defect', 'Risk'])
-        writer.writerow([timestamp, line_name, lot_id, p1_val, p2_val, p3_val, status, defect_type, risk_level])
+    save_logs([[timestamp, line_name, lot_id, p1_val, p2_val, p3_val, status, defect_type, risk_level]])
+
+# Source -> คอลัมน์ Defect ใน log (ผลที่ไม่ได้มาจากโมเดลหลักติดคำว่า Degraded)
+LOG_LABELS = {"Cache": "AI Check (Cached)", "Gemini": "AI Check",
+              "Gemini (Fallback)": "AI Check (Degraded: Fallback Model)", "Local Fallback": "Local Verdict (Degraded)"}
+
+def result_source(result):
+    """Where a live ``inspect_frame`` verdict came from (batch table / Source in the latency log)."""
+    if result.get('cached'):
+        return "Cache"
+    if result.get('prescreened'):
+        return "Pre-screen"
+    return {"fallback": "Gemini (Fallback)", "local": "Local Fallback"}.get(result.get('degraded'), "Gemini")
+
+def show_status(box, status):
+    if status is None:
+        box.empty()  # ผลที่ประกาศไปแล้วมาจาก attempt ที่ล้มเหลว
+    elif status == "FAIL":
+        box.error("🚨 DEFECT DETECTED")
+    else:
+        box.success("✅ QUALITY APPROVED")
+
+def simulated_result(config, p1_val, fail):
+    if fail:
+        defects = config['Defect_Focus'].split(', ')
+        chosen_defect = defects[0] if defects else "Surface Crack"
+        result_text = f"""
+        ### 🚨 [STATUS]: FAIL
+        **Defect Detected:** {chosen_defect}
+        **Confidence Score:** 94.5%
+        
+        ---
+        **🔬 Engineering Analysis:**
+        * **Observation:** Detected significant {chosen_defect} on the material surface.
+        * **Root Cause:** Abnormal parameter settings (P1: {p1_val}) correlated with surface stress.
+        
+        **🛠️ Recommended Action:**
+        * Immediate stop recommended. 
+        * Check roller conditions and adjust P1 parameter.
+        """
+        return result_text, "FAIL"
+    else:
+        result_text = f"""
+        ### ✅ [STATUS]: PASS
+        **Defect Detected:** None
+        **Confidence Score:** 98.2%
+        
+        ---
+        **🔬 Engineering Analysis:**
+        * **Observation:** Surface texture appears consistent and free of defects.
+        * **Compliance:** Meets strict quality standards for {config['Product']}.
+        
+        **🛠️ Recommended Action:**
+        * Continue production. Parameters are stable.
+        """
+        return result_text, "PASS"
+
+def simulate_frame(config, p1_val, fail, on_text=None, on_status=None):
+    """Simulation Mode counterpart of ``inspect_frame``: the canned answer streamed, with the same timing keys."""
+    started = time.perf_counter()
+    elapsed = lambda: (time.perf_counter() - started) * 1000
+    status_ms = None
+
+    def announce(status):
+        nonlocal status_ms
+        status_ms = elapsed()
+        if on_status:
+            on_status(status)
+
+    # ทยอยส่งข้อความภายใน ~2 วินาทีเหมือน stream ของจริง
+    result_text, _ = simulated_result(config, p1_val, fail)
+    result_text, status = consume(simulated_stream(result_text, 2.0), on_text, announce)
+    return {'status': status, 'result_text': result_text, 'status_ms': status_ms, 'complete_ms': elapsed()}
+
+def live_backend():
+    return {
+        'chain': get_inspection_chain(),
+        'limiter': get_rate_limiter(gemini_rpm),
+        'budget': gemini_budget,
+        'cache': get_verdict_cache(),
+        'local': get_prescreen(),  # ผลตรวจในเครื่องตอน Gemini ใช้ไม่ได้ทั้งหมด
+        'prescreen': get_prescreen() if use_prescreen else None,
+        'pass_below': prescreen_pass_below,
+    }
+
+def prescreen_result(score, pass_below):
+    return f"""
+    ### ✅ [STATUS]: PASS
+    **Defect Detected:** None (local pre-screen)
+    
+    ---
+    **🔬 Local Pre-screen:** defect probability {score:.1%} is below the {pass_below:.0%} threshold for this line,
+    so the frame was not sent to Gemini.
+    """
+
+def local_fallback_result(status, score, pass_below, errors):
+    if score is None:
+        finding = "no local model is trained for this line"
+    else:
+        finding = f"local pre-screen defect probability {score:.1%} (pass below {pass_below:.0%})"
+    action = ("Passed by the local model; re-check with Gemini when it is back." if status == "PASS"
+              else "Hold the lot for manual inspection.")
+    reasons = "\n".join(f"* {e}" for e in errors)
+    return f"""
+    ### ⚠️ [STATUS]: {status} (degraded — Gemini unavailable)
+    **Local verdict:** {finding}
+
+    **🛠️ Recommended Action:** {action}
+
+    ---
+    **Why Gemini was not used:**
+{reasons}
+    """
+
+def inspect_frame(data, mime_type, line_name, config, params, preprocess, prepared=None, backend=None,
+                  on_text=None, on_status=None):
+    """Live verdict of one frame: verdict cache, then the local pre-screen, then Gemini (streamed) under the shared quota.
+
+    Gemini goes through the fallback chain, every part, retry and fallback of the frame within one
+    ``budget``; if no model answers in time the frame gets a local verdict (PASS only below the
+    pre-screen threshold, otherwise held as FAIL) marked ``degraded='local'``.
+
+    ``backend`` comes from ``live_backend()``, resolved up front when called from batch worker threads.
+    ``on_text`` gets the analysis so far as it streams in and ``on_status`` the verdict as soon as it is
+    known -- or ``None`` when a verdict already shown came from an attempt that then failed;
+    ``status_ms``/``complete_ms`` in the result are measured from the start of the call.
+    """
+    started = time.perf_counter()
+    elapsed = lambda: (time.perf_counter() - started) * 1000
+    backend = backend or live_backend()
+    chain, limiter, cache, prescreen = backend['chain'], backend['limiter'], backend['cache'], backend['prescreen']
+    digest = image_hash(data)
+    key = verdict_key(digest, line_name, config, params, PROMPT_VERSION, chain.model_name, preprocess)
+    cached = cache.get(key)
+    if cached:
+        if on_status:
+            on_status(cached['status'])
+        done_ms = elapsed()
+        return {'status': cached['status'], 'result_text': cached['result_text'], 'cached': True,
+                'created_at': cached['created_at'], 'status_ms': done_ms, 'complete_ms': done_ms}
+    screening = None
+    if prescreen is not None:
+        screening = prescreen.screen(line_name, digest, data, backend['pass_below'])
+        if screening['decision'] == 'local_pass':
+            if on_status:
+                on_status('PASS')
+            done_ms = elapsed()
+            return {'status': 'PASS', 'result_text': prescreen_result(screening['score'], backend['pass_below']),
+                    'cached': False, 'prescreened': True, 'status_ms': done_ms, 'complete_ms': done_ms}
+    prompt = build_prompt(line_name, config, params[0], params[1])
+    if preprocess:
+        prepared = prepared or prepare(data, **preprocess)
+        parts = [blob(part) for part in prepared['parts']]
+    else:
+        parts = [blob(data, mime_type)]
+    api_started = time.perf_counter()
+    ends = time.monotonic() + backend['budget']  # งบเวลาของทั้งรูป ไม่ใช่ต่อส่วน
+    verdicts, status_ms, announced = [], None, None
+
+    def void(attempt):
+        # callback จาก attempt ใหม่ = attempt ก่อนหน้าของส่วนนี้ล้มเหลว: ผลที่มันประกาศไว้ใช้ไม่ได้
+        nonlocal status_ms, announced
+        if announced is not None and announced[0] == len(verdicts) and announced[1] != attempt:
+            status_ms = announced = None
+            if on_status:
+                on_status(None)
+
+    def announce(part_status, attempt):
+        # ส่วนใดส่วนหนึ่ง FAIL = รู้ผลทั้งรูปทันที, PASS ต้องรอส่วนสุดท้าย
+        nonlocal status_ms, announced
+        void(attempt)
+        if status_ms is None and (part_status == "FAIL" or len(verdicts) == len(parts) - 1):
+            status_ms, announced = elapsed(), (len(verdicts), attempt)
+            if on_status:
+                on_status(part_status)
+
+    def show(text, attempt):
+        void(attempt)
+        on_text(merge_verdicts(verdicts + [("…", text)], len(parts))[1])
+
+    answers = []
+    try:
+        for part in parts:
+            # retry/สลับโมเดล เริ่ม stream ใหม่ทั้งคำตอบ ข้อความบนจอถูกแทนที่ตั้งแต่ต้น
+            answer = chain.generate(prompt, part, show if on_text else None, announce, limiter,
+                                    budget=max(0.0, ends - time.monotonic()))
+            answers.append(answer)
+            verdicts.append((answer['status'], answer['text']))
+    except BackendsUnavailable as e:
+        # ไม่มีโมเดลไหนตอบทันเวลา: ผ่านได้เฉพาะรูปที่ pre-screen มั่นใจว่าสะอาด ที่เหลือกักไว้ให้คนตรวจ
+        score = screening['score'] if screening is not None else backend['local'].score(line_name, data)
+        status = "PASS" if score is not None and score < backend['pass_below'] else "FAIL"
+        if on_status:
+            on_status(status)
+        done_ms = elapsed()
+        return {'status': status, 'result_text': local_fallback_result(status, score, backend['pass_below'], e.errors),
+                'cached': False, 'degraded': 'local', 'errors': e.errors, 'status_ms': done_ms, 'complete_ms': done_ms}
+    status, result_text = merge_verdicts(verdicts)
+    degraded = 'fallback' if any(a['degraded'] for a in answers) else None
+    if not degraded:
+        # ผลจากโมเดลสำรองไม่เก็บ cache: รูปเดิมจะได้ตรวจใหม่ด้วยโมเดลหลักเมื่อกลับมา
+        cache.put(key, result_text, status, chain.model_name)
+    if screening is not None:
+        # คำตอบของ Gemini = ข้อมูลสอนรอบถัดไป + ใช้วัด agreement
+        prescreen.record(line_name, digest, screening, status)
+    return {'status': status, 'result_text': result_text, 'cached': False, 'parts': len(parts),
+            'sent_bytes': sum(len(p['data']) for p in parts), 'api_ms': (time.perf_counter() - api_started) * 1000,
+            'status_ms': status_ms, 'complete_ms': elapsed(), 'degraded': degraded,
+            'model': ", ".join(sorted({a['model'] for a in answers})), 'errors': [err for a in answers for err in a['errors']]}
 
 # --- 4. UI Layout ---
 # --- 4. UI Layout (ปรับปรุงใหม่: จัดระเบียบ UI) ---
@@ -124,6 +400,17 @@ with st.container(border=True):
     with i4: 
         p3_val = st.number_input("P3", value=current_config['Param3']['default'], label_visibility="collapsed")
 
+    # ความเสี่ยงจาก parameter คิดทันทีที่กรอก (ก่อนวิเคราะห์รูป) และเป็นค่า Risk ที่บันทึกลง log
+    risk = get_risk_engine().score(selected_line_name, (p1_val, p2_val, p3_val))
+    risk_icon = {"Low": "🟢", "Medium": "🟠", "High": "🔴"}.get(risk['level'], "⚪")
+    if risk['distance'] is None:
+        risk_basis = f"spec limits only ({risk['history']}/{MIN_HISTORY} lots of history on this line)"
+    else:
+        risk_basis = f"distance {risk['distance']:.1f} from the last {risk['history']} lots on this line"
+    st.markdown(f"**Parameter Risk:** {risk_icon} **{risk['level']}** · {risk_basis}")
+    if risk['reasons']:
+        st.caption(" · ".join(risk['reasons']))
+
 # === ZONE 2: INSPECTION & UPLOAD (แบ่งซ้ายขวา) ===
 # col_visual (ซ้าย 70%) = เอารูปไว้ตรงนี้ให้ใหญ่ๆ
 # col_control (ขวา 30%) = เอาปุ่ม Upload ไว้ข้างๆ
@@ -143,9 +430,9 @@ with col_control:
 with col_visual:
     st.subheader("Visual Inspection Monitor (แทนภาพจากกล้องวงจรปิดที่ตรวจสอบสินค้าในไลน์ผลิต)")
     if uploaded_file:
-        image = Image.open(uploaded_file)
-        # แสดงรูปเต็มความกว้างคอลัมน์
-        st.image(image, caption=f"Live Feed: {selected_line_name}", use_container_width=True)
+        prepared = prepare_upload(uploaded_file.file_id, uploaded_file.getvalue(), max_side, jpeg_quality, tile_strips)
+        # แสดงรูปเต็มความกว้างคอลัมน์ (ภาพ preview ที่ย่อไว้แล้ว ไม่ decode ไฟล์เต็มทุก rerun)
+        st.image(prepared['preview'], caption=f"Live Feed: {selected_line_name}", use_container_width=True)
     else:
         # แสดงกรอบว่างๆ ให้รู้ว่ารอรูป
         st.info("Waiting for image upload...")
@@ -161,114 +448,200 @@ with col_visual:
 if uploaded_file and run_btn:
     st.divider()
     st.subheader("Analysis Result")
+    # ผล PASS/FAIL ขึ้นทันทีที่ช่อง [STATUS] มาถึง คำอธิบายทยอยขึ้นตามที่ stream มา
+    alert_box = st.empty()
+    result_box = st.container(border=True).empty()
     
     with st.spinner(f"Consulting {selected_line_name} Expert Module..."):
         
         result_text = ""
         status = "PASS"
+        source = "Simulated"
+        payload_note = None
+        status_ms = complete_ms = None
         
         # === LOGIC การทำงาน (เหมือนเดิม) ===
         if use_simulation:
-            time.sleep(2.0) # ลดเวลาลงนิดนึงจะได้ทันใจ
-            
-            if force_fail:
-                defects = current_config['Defect_Focus'].split(', ')
-                chosen_defect = defects[0] if defects else "Surface Crack"
-                result_text = f"""
-                ### 🚨 [STATUS]: FAIL
-                **Defect Detected:** {chosen_defect}
-                **Confidence Score:** 94.5%
-                
-                ---
-                **🔬 Engineering Analysis:**
-                * **Observation:** Detected significant {chosen_defect} on the material surface.
-                * **Root Cause:** Abnormal parameter settings (P1: {p1_val}) correlated with surface stress.
-                
-                **🛠️ Recommended Action:**
-                * Immediate stop recommended. 
-                * Check roller conditions and adjust P1 parameter.
-                """
-                status = "FAIL"
-            else:
-                result_text = f"""
-                ### ✅ [STATUS]: PASS
-                **Defect Detected:** None
-                **Confidence Score:** 98.2%
-                
-                ---
-                **🔬 Engineering Analysis:**
-                * **Observation:** Surface texture appears consistent and free of defects.
-                * **Compliance:** Meets strict quality standards for {current_config['Product']}.
-                
-                **🛠️ Recommended Action:**
-                * Continue production. Parameters are stable.
-                """
-                status = "PASS"
+            result = simulate_frame(current_config, p1_val, force_fail,
+                                    on_text=result_box.markdown, on_status=lambda s: show_status(alert_box, s))
+            result_text, status = result['result_text'], result['status']
+            status_ms, complete_ms = result['status_ms'], result['complete_ms']
         
         else:
             # 📡 LIVE MODE
             try:
-                try:
-                    model = genai.GenerativeModel('gemini-2.5-flash')
-                except:
-                    model = genai.GenerativeModel('gemini-pro')
-
-                prompt = f"""
-                Role: Senior Process Engineer at NS-Siam United Steel & Chief Financial Officer.
-                Your Goal: Balance Quality Assurance with Production Efficiency. Avoid false positives that cause unnecessary downtime (Economic Loss).
-                
-                Context: Inspecting {current_config['Product']} on {selected_line_name}.
-                Focus Defects: {current_config['Defect_Focus']}.
-                
-                Task: Analyze the image for CRITICAL defects only.
-                
-                Decision Logic:
-                1. STRICTLY differentiate between actual defects (cracks, rust, dents) vs. acceptable variations (lighting shadows, minor dust, water stains).
-                2. If the surface looks generally consistent or the anomaly is negligible, decide "PASS".
-                3. Only decide "FAIL" if the defect is clearly visible and affects the product's function.
-                
-                Response format:
-                [STATUS]: (PASS / FAIL) -> ตอบ FAIL เฉพาะเมื่อมั่นใจ 100% ว่าเป็นของเสียร้ายแรง
-                * [DEFECT_DETECTED]: (ระบุสิ่งที่เจอ หรือตอบ "None" ถ้าปกติ กระชับคำตอบใน 1-2 ประโยค)
-                * [CONFIDENCE]: (ระบุ % ความมั่นใจ)
-                * [ANALYSIS]: (วิเคราะห์สาเหตุทางวิศวกรรมสั้นๆ เชื่อมโยงกับ parameter: P1={p1_val}, P2={p2_val} ถ้าเกี่ยวข้อง, กระชับคำตอบใน 1-2 ประโยค)
-                * [NEXT STEP]: (เสนอทางแก้ที่ "คุ้มค่าที่สุด" เชิงเศรษฐศาสตร์ เช่น "ปรับ P1 เล็กน้อยแล้วรันต่อ" หรือ "ตัดส่วนเสียทิ้ง (Crop)" แทนการหยุดเครื่องจักรทันที, กระชับคำตอบใน 1-2 ประโยค)
-                
-                Respond in Thai. Professional & Concise tone.
-                """
-                
-                response = model.generate_content([prompt, image])
-                result_text = response.text
-                
-                # Logic การตัดเกรด (Check FAIL only if explicit)
-                if "FAIL" in result_text.upper():
-                    status = "FAIL"
-                else:
-                    status = "PASS"
-                    
+                preprocess = preprocess_settings(max_side, jpeg_quality, tile_strips) if use_preprocess else None
+                result = inspect_frame(uploaded_file.getvalue(), uploaded_file.type, selected_line_name, current_config,
+                                       (p1_val, p2_val, p3_val), preprocess, prepared,
+                                       on_text=result_box.markdown, on_status=lambda s: show_status(alert_box, s))
+                result_text, status, source = result['result_text'], result['status'], result_source(result)
+                status_ms, complete_ms = result['status_ms'], result['complete_ms']
+                if source in ("Gemini", "Gemini (Fallback)"):
+                    # bytes ที่ส่ง + เวลา Gemini เทียบกับตอนส่งไฟล์ต้นฉบับ (เก็บต่อ session)
+                    sent, api_ms = result['sent_bytes'], result['api_ms']
+                    latencies = st.session_state.setdefault("gemini_latency_ms", {"preprocessed": [], "original": []})
+                    latencies["preprocessed" if use_preprocess else "original"].append(api_ms)
+                    payload_note = (f"📦 Sent {sent / 1024:,.0f} KB in {result['parts']} part(s) "
+                                    f"(upload {prepared['original_bytes'] / 1024:,.0f} KB, "
+                                    f"{1 - sent / prepared['original_bytes']:.0%} smaller) · "
+                                    f"preprocessing {prepared['prep_ms']:.0f} ms · Gemini {api_ms:,.0f} ms")
+                    if latencies["preprocessed"] and latencies["original"]:
+                        pre = sum(latencies["preprocessed"]) / len(latencies["preprocessed"])
+                        raw = sum(latencies["original"]) / len(latencies["original"])
+                        payload_note += f" · avg Gemini latency {pre:,.0f} ms preprocessed vs {raw:,.0f} ms original ({pre - raw:+,.0f} ms)"
+
             except Exception as e:
+                alert_box.empty()
+                result_box.empty()
                 st.error(f"⚠️ Live AI Failed: {e}")
                 status = "ERROR"
 
         # === DISPLAY RESULT (แสดงผลแบบเต็มจอ) ===
         if status != "ERROR":
-            if status == "FAIL":
-                st.error("🚨 DEFECT DETECTED")
-                box_color = "#FFEBEB"
-            else:
-                st.success("✅ QUALITY APPROVED")
-                box_color = "#E8FDF5"
-            
-            with st.container(border=True):
-                st.markdown(result_text)
+            if status_ms is None:
+                status_ms = complete_ms  # ไม่ได้รู้ผลก่อนคำตอบครบ
+            show_status(alert_box, status)
+            result_box.markdown(result_text)
+            st.caption(f"⏱️ Verdict after {status_ms / 1000:.1f} s · full analysis after {complete_ms / 1000:.1f} s")
+            if payload_note:
+                st.caption(payload_note)
+            if source == "Gemini (Fallback)":
+                st.warning(f"⚠️ Degraded: answered by fallback model `{result['model']}` — " + "; ".join(result['errors']))
+            elif source == "Local Fallback":
+                st.warning("⚠️ Degraded: Gemini unavailable, local verdict only (see reasons above)")
+            if source == "Cache":
+                st.caption(f"♻️ From verdict cache (analysed {datetime.datetime.fromtimestamp(result['created_at']):%Y-%m-%d %H:%M}) — no API call")
             
             # Save Log
             current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            mode_label = "Simulated" if use_simulation else "AI Check"
-            save_log(current_time, selected_line_name, lot_number, p1_val, p2_val, p3_val, status, mode_label, "Low")
+            save_log(current_time, selected_line_name, lot_number, p1_val, p2_val, p3_val, status, LOG_LABELS.get(source, source), risk['level'])
+            get_latency_log().add([(selected_line_name, lot_number, source, status, status_ms, complete_ms)])
+
+# === ZONE 4: BATCH INSPECTION (หลายรูป / ZIP ทั้งกะ) ===
+BATCH_LOG_EVERY = 50  # เขียน log เป็นชุดละ 50 แถว
+
+st.divider()
+with st.expander("🗂️ Batch Inspection (many frames or a ZIP of a shift)"):
+    batch_files = st.file_uploader("Upload frames or ZIP", type=["jpg", "png", "jpeg", "zip"],
+                                   accept_multiple_files=True, key="batch_files")
+    batch_workers = st.slider("Parallel inspections", 1, 16, 4)
+    if batch_files and st.button("Run Batch Inspection", type="primary"):
+        import pandas as pd
+
+        preprocess = preprocess_settings(max_side, jpeg_quality, tile_strips) if use_preprocess else None
+        params = (p1_val, p2_val, p3_val)
+        if use_simulation:
+            # bucket ของงานนี้เอง (แบบ batch bench): ไม่แย่ง quota จริงที่ session อื่นใช้เรียก Gemini
+            limiter = TokenBucket(gemini_rpm / 60, burst=batch_workers)
+
+            def inspect(name, data):
+                # backend จำลอง: latency ใกล้เคียงโหมดเดี่ยว ผ่าน quota/retry แบบเดียวกับของจริง
+                with_retries(lambda: simulated_call(2000), limiter)
+                result_text, status = simulated_result(current_config, p1_val, force_fail)
+                return {'status': status, 'result_text': result_text, 'cached': False}
+        else:
+            backend = live_backend()
+
+            def inspect(name, data):
+                mime_type = "image/png" if name.lower().endswith(".png") else "image/jpeg"
+                return inspect_frame(data, mime_type, selected_line_name, current_config, params, preprocess,
+                                     backend=backend)
+
+        uploads = [(f.name, f.getvalue()) for f in batch_files]
+        total = count_frames(uploads)
+        frames = frames_from_uploads(uploads)
+        progress = st.progress(0.0, text=f"Inspecting {total} frames...")
+        table = st.empty()
+        rows, pending_log, pending_latency, started = [], [], [], time.perf_counter()
+        for result in run_batch(frames, inspect, batch_workers):
+            source = "Simulated" if use_simulation else result_source(result)
+            status_ms = result.get('status_ms')
+            if status_ms is None:
+                status_ms = result['latency_ms']  # backend จำลองไม่ stream: รู้ผลพร้อมคำตอบครบ
+            rows.append({'Frame': result['name'], 'Status': result['status'], 'Source': source,
+                         'Verdict after (ms)': round(status_ms), 'Latency (ms)': round(result['latency_ms']),
+                         'Error': result['error'] or ""})
+            if result['status'] != "ERROR":
+                frame_lot = f"{lot_number}/{result['name']}"
+                pending_log.append([datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), selected_line_name,
+                                    frame_lot, p1_val, p2_val, p3_val, result['status'], LOG_LABELS.get(source, source), risk['level']])
+                pending_latency.append((selected_line_name, frame_lot, source, result['status'], status_ms, result['latency_ms']))
+            if len(pending_log) >= BATCH_LOG_EVERY:
+                save_logs(pending_log)
+                get_latency_log().add(pending_latency)
+                pending_log, pending_latency = [], []
+            # ผลแต่ละรูปขึ้นทันทีที่เสร็จ ไม่รอทั้งชุด
+            elapsed = time.perf_counter() - started
+            progress.progress(len(rows) / total, text=f"{len(rows)}/{total} frames · {len(rows) / elapsed:.2f} frames/s")
+            table.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        save_logs(pending_log)
+        get_latency_log().add(pending_latency)
+        progress.progress(1.0, text=f"Done: {len(rows)} frames in {time.perf_counter() - started:.1f}s")
+        fails = sum(r['Status'] == "FAIL" for r in rows)
+        errors = sum(r['Status'] == "ERROR" for r in rows)
+        if fails:
+            st.error(f"🚨 {fails} of {len(rows)} frames FAILED")
+        else:
+            st.success(f"✅ All {len(rows) - errors} inspected frames passed")
+        if errors:
+            st.warning(f"⚠️ {errors} frames could not be inspected (see Error column)")
 
 st.divider()
+HISTORY_PAGE_SIZE = 50  # แถวต่อหน้าใน History Log
 st.subheader("History Log")
-if os.path.isfile('production_logs_v2.csv'):
-    df = pd.read_csv('production_logs_v2.csv')
-    st.dataframe(df.sort_values(by="Timestamp", ascending=False), use_container_width=True)
+history_log = get_history_log()
+history_total = history_log.count()
+if history_total:
+    import pandas as pd
+
+    history_pages = max(1, math.ceil(history_total / HISTORY_PAGE_SIZE))
+    if st.session_state.get("history_page_no", 1) > history_pages:
+        st.session_state["history_page_no"] = history_pages
+    history_page_no = st.session_state.get("history_page_no", 1)
+    # อ่านจากท้ายไฟล์เฉพาะหน้าที่แสดง (ใหม่สุดก่อน) ไม่ว่า log จะยาวแค่ไหน
+    first = (history_page_no - 1) * HISTORY_PAGE_SIZE
+    df = pd.DataFrame(history_log.tail(HISTORY_PAGE_SIZE, first), columns=LOG_HEADER)
+    st.dataframe(df, use_container_width=True, hide_index=True)
+    h1, h2 = st.columns([1, 3])
+    with h1:
+        st.number_input(f"Page (of {history_pages:,})", min_value=1, max_value=history_pages, key="history_page_no")
+    with h2:
+        st.caption(f"Showing rows {first + 1:,}–{first + len(df):,} of {history_total:,} (newest first)")
+
+# === Verdict cache hit rate (sidebar) ===
+cache_stats = get_verdict_cache().stats()
+if cache_stats['hit_rate'] is None:
+    cache_stats_box.caption(f"No live analyses yet · {cache_stats['entries']:,} cached verdicts")
+else:
+    cache_stats_box.caption(
+        f"Hit rate **{cache_stats['hit_rate']:.0%}** ({cache_stats['hits']:,} hits / {cache_stats['misses']:,} misses) · "
+        f"{cache_stats['entries']:,} verdicts, {cache_stats['bytes'] / 1024:,.0f} KB"
+    )
+
+# === Pre-screen savings / agreement (sidebar, Live mode) ===
+if not use_simulation and use_prescreen:
+    screened = get_prescreen().report()
+    total = sum(r['screened'] for r in screened.values())
+    if total:
+        saved = sum(r['local_pass'] for r in screened.values())
+        compared = sum(r['compared'] for r in screened.values())
+        agreement = f"{sum(r['agree'] for r in screened.values()) / compared:.0%} agreement with Gemini" if compared else "no agreement data yet"
+        prescreen_stats_box.caption(f"Skipped Gemini for **{saved / total:.0%}** of {total:,} frames · {agreement}")
+    else:
+        prescreen_stats_box.caption("No frames screened yet (train with `python -m defect_inspection.prescreen train`)")
+
+# === Time-to-verdict / time-to-complete (sidebar) ===
+latency = get_latency_log().summary(days=7)
+if latency:
+    latency_stats_box.caption("  \n".join(
+        f"{source}: verdict p50 **{v['status_p50'] / 1000:.1f} s**, full p50 {v['complete_p50'] / 1000:.1f} s "
+        f"(p95 {v['status_p95'] / 1000:.1f} / {v['complete_p95'] / 1000:.1f} s, n={v['n']:,})"
+        for source, v in sorted(latency.items())))
+else:
+    latency_stats_box.caption("No inspections in the last 7 days")
+
+# === Gemini circuit breakers (sidebar, Live mode) ===
+if not use_simulation:
+    tripped = {name: state for name, state in get_inspection_chain().states().items() if state != "closed"}
+    if tripped:
+        backend_status_box.warning("Circuit open: " + ", ".join(f"`{name}` ({state})" for name, state in tripped.items()))
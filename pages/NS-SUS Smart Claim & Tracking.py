@@ -2,118 +2,131 @@ import streamlit as st
 import pandas as pd
 import time
 import os
-from datetime import datetime
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.naive_bayes import MultinomialNB
-from sklearn.pipeline import make_pipeline
 import io
+from datetime import datetime
+import math
+import functools
+from datetime import timedelta
+from smart_claim.store import open_store, DuplicateCaseError, StaleCaseError
+from smart_claim.writer import WriteCoordinator
+from smart_claim.cache import ReadCache
+from smart_claim.similar import SimilarityIndex, similar_cases
+from smart_claim.routing import ComplaintRouter
+from smart_claim.intake import ingest
+from smart_claim.eta import complaint_clusters
+from smart_claim.export import export, FORMATS as EXPORT_FORMATS
+from smart_claim.archive import HOT
+from smart_claim.reports import ReportCache, report as render_report, batch_zip
 
 # ==========================================
 # 1. ระบบจัดการฐานข้อมูล
 # ==========================================
-DB_FILE = 'tracking_db_v3_mcs.csv' 
+DB_FILE = 'tracking_db_v4_mcs.db'
+LEGACY_DB_FILE = 'tracking_db_v3_mcs.csv'  # ไฟล์ CSV เดิม จะถูก import เข้า DB ให้ครั้งเดียว
+ARCHIVE_DIR = 'archive'
+ARCHIVE_AFTER_DAYS = 90  # เคสที่ปิดนานกว่านี้ย้ายไป archive รายเดือน
+
+@st.cache_resource
+def get_store():
+    # migration + import CSV เก่า + ย้ายเคสปิดเก่าเข้า archive รันครั้งเดียวต่อ process (ไม่ใช่ทุกครั้งที่โหลดหน้า)
+    store = open_store(DB_FILE, legacy_csv=LEGACY_DB_FILE, archive_dir=ARCHIVE_DIR)
+    store.archive_closed(ARCHIVE_AFTER_DAYS)
+    return store
+
+@st.cache_resource
+def get_writer():
+    # writer thread เดียวทั้ง process: ทุก session ส่งงานเขียนเข้าคิวนี้
+    return WriteCoordinator(get_store())
+
+@st.cache_resource
+def get_similarity_index():
+    # index เดียวทั้ง process; sync เคสใหม่ (Case_ID ที่ยังไม่เคยเห็น) ก่อน query ทุกครั้ง
+    return SimilarityIndex()
+
+@st.cache_resource
+def get_read_cache():
+    # cache เดียวทั้ง process: ทุก session ใช้ตารางเคสชุดเดียวกันจนกว่าจะมีการเขียน (data version เปลี่ยน)
+    return ReadCache(get_store())
 
 def init_db():
-    expected_columns = ['Lot_ID', 'Date', 'Complaint', 'Department', 'Status', 'Estimated_Days', 'Current_Handler', 'Action_History', 'Final_Decision', 'Resolution_Note']
-    
-    if not os.path.exists(DB_FILE):
-        df = pd.DataFrame(columns=expected_columns)
-        df.to_csv(DB_FILE, index=False)
-    else:
-        df = pd.read_csv(DB_FILE)
-        missing_cols = [col for col in expected_columns if col not in df.columns]
-        if missing_cols:
-            for col in missing_cols: df[col] = ""
-        
-        if 'Current_Handler' in df.columns and 'Department' in df.columns:
-            mask = (df['Current_Handler'] == "System") | (df['Current_Handler'].isnull())
-            if mask.any():
-                df.loc[mask, 'Current_Handler'] = df.loc[mask, 'Department']
-        df.to_csv(DB_FILE, index=False)
-
-def save_to_db(lot_id, complaint, dept, status, days):
-    df = pd.read_csv(DB_FILE)
-    new_data = pd.DataFrame({
-        'Lot_ID': [lot_id],
-        'Date': [datetime.now().strftime("%Y-%m-%d %H:%M")],
-        'Complaint': [complaint],
-        'Department': [dept],
-        'Status': [status],
-        'Estimated_Days': [days],
-        'Current_Handler': [dept], 
-        'Action_History': [f"[{datetime.now().strftime('%Y-%m-%d %H:%M')}] Case Created -> AI Assigned to {dept}"],
-        'Final_Decision': [""],
-        'Resolution_Note': [""]
-    })
-    df = pd.concat([df, new_data], ignore_index=True)
-    df.to_csv(DB_FILE, index=False)
-
-def update_status(lot_id, new_status, action_note, next_handler=None, final_decision=None, resolution_note=None, force_handler=None):
-    df = pd.read_csv(DB_FILE)
-    idx = df[df['Lot_ID'].astype(str) == str(lot_id)].index
-    if not idx.empty:
-        if force_handler:
-            df.loc[idx, 'Current_Handler'] = force_handler
-            df.loc[idx, 'Department'] = force_handler 
-            new_status = f"Re-assigned to {force_handler}"
-            action_note += f" (⚠️ MCS Manual Override)"
-
-        df.loc[idx, 'Status'] = new_status
-        history = df.loc[idx, 'Action_History'].values[0]
-        new_history = f"{history} || [{datetime.now().strftime('%Y-%m-%d %H:%M')}] {action_note}"
-        df.loc[idx, 'Action_History'] = new_history
-        
-        if next_handler: df.loc[idx, 'Current_Handler'] = next_handler
-        if final_decision: df.loc[idx, 'Final_Decision'] = final_decision
-        if resolution_note: df.loc[idx, 'Resolution_Note'] = resolution_note
-            
-        df.to_csv(DB_FILE, index=False)
-        return True
-    return False
+    return get_store()
+
+def save_to_db(lot_id, complaint, dept, status, days, cluster=None):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M")
+    get_writer().insert_case({
+        'Lot_ID': lot_id,
+        'Date': now,
+        'Complaint': complaint,
+        'Department': dept,
+        'Status': status,
+        'Estimated_Days': days,
+        'Current_Handler': dept,
+        'Final_Decision': "",
+        'Resolution_Note': "",
+        'Cluster': cluster
+    }, event={'Timestamp': now, 'Actor': "AI", 'Action': "created", 'Note': f"Case Created -> AI Assigned to {dept}"})
+
+def update_status(lot_id, new_status, action_note, next_handler=None, final_decision=None, resolution_note=None, force_handler=None, actor=None, action="updated", case_id=None, version=None):
+    changes = {}
+    if force_handler:
+        action = "reassigned"
+        changes['Current_Handler'] = force_handler
+        changes['Department'] = force_handler
+        new_status = f"Re-assigned to {force_handler}"
+        action_note += f" (⚠️ MCS Manual Override)"
+
+    changes['Status'] = new_status
+    if next_handler: changes['Current_Handler'] = next_handler
+    if final_decision: changes['Final_Decision'] = final_decision
+    if resolution_note: changes['Resolution_Note'] = resolution_note
+
+    event = {'Timestamp': datetime.now().strftime('%Y-%m-%d %H:%M'), 'Actor': actor, 'Action': action, 'Note': action_note}
+    # case_id + version: เขียนลง claim ที่การ์ดแสดงอยู่ และไม่ทับการแก้จาก session อื่น (StaleCaseError)
+    updated = get_writer().update_case(lot_id, changes, event=event, case_id=case_id, expected_version=version)
+    if updated and force_handler:
+        # MCS แก้การ assign -> สอน router ต่อทันที (partial_fit เคสเดียว)
+        case = get_store().get_case(lot_id) if case_id is None else get_store().get_claim(case_id)
+        load_model().learn(case['Complaint'], force_handler)
+    return updated
+
+def get_case_history(case_id):
+    return get_store().case_history(case_id)
 
-def get_all_data():
-    if not os.path.exists(DB_FILE): return pd.DataFrame()
-    return pd.read_csv(DB_FILE)
+def export_report(store, fmt, date_from, date_to, departments, statuses):
+    # ไฟล์ export ถูก cache ไว้ตาม data version + filter: กดซ้ำโดยข้อมูลไม่เปลี่ยน = อ่านไฟล์เดิม
+    with open(export(store, fmt, date_from, date_to, departments, statuses), 'rb') as f:
+        return f.read()
+
+def find_similar(complaint, k=5):
+    return similar_cases(get_similarity_index(), get_store(), complaint, k)
+
+OPLOG_COLUMNS = ['Lot_ID', 'Date', 'Complaint', 'Department', 'Status', 'Current_Handler']
+
+def get_case_frame(name, columns=None, filters=None, partition=HOT):
+    # อ่านจาก Parquet snapshot เฉพาะคอลัมน์/แถวที่หน้านั้นแสดง แล้ว cache ร่วมทุก session ตาม data version
+    # หลังมีการเขียน snapshot ใหม่ build เบื้องหลัง ระหว่างนั้นใช้ snapshot ก่อนหน้า (ไม่ต้องรอ export ทั้งตาราง)
+    # ปกติอ่านแค่ไฟล์หลัก (เคสเปิด + เคสปิดล่าสุด); เดือนใน archive อ่านเมื่อมีคนเลือกดู
+    from smart_claim.snapshot import read_latest  # pyarrow: โหลดเมื่อมี view จาก snapshot ถูก render
+
+    source = get_store().hot if partition == HOT else get_store().partition(partition)
+
+    def load():
+        version, df = read_latest(source, columns, filters)
+        return df, version >= source.data_version()
+    return get_read_cache().get(f"{name}:{partition}", load, may_lag=True)
+
+# === HELPER: รายงานปิดเคสสำหรับลูกค้า (render ครั้งเดียวต่อ version ของเคส) ===
+@st.cache_resource
+def get_report_cache():
+    return ReportCache()
 
-# === HELPER: สร้างรายงาน Text File ===
 def generate_customer_report(case_data):
-    report = f"""
-    =======================================================
-    OFFICIAL CLAIM RESOLUTION REPORT
-    NS-SUS SMART CLAIM TRACKING SYSTEM
-    =======================================================
-    Date: {datetime.now().strftime("%Y-%m-%d")}
-    Reference Lot ID: {case_data['Lot_ID']}
-    
-    -------------------------------------------------------
-    CASE INFORMATION
-    -------------------------------------------------------
-    Issue Reported: {case_data['Complaint']}
-    Date Reported: {case_data['Date']}
-    Responsible Department: {case_data['Department']}
-    
-    -------------------------------------------------------
-    INVESTIGATION & RESOLUTION
-    -------------------------------------------------------
-    Status: {case_data['Status']}
-    
-    FINAL DECISION: [{case_data['Final_Decision']}]
-    
-    NOTE TO CUSTOMER:
-    {case_data['Resolution_Note']}
-    
-    -------------------------------------------------------
-    ACTION HISTORY:
-    {str(case_data['Action_History']).replace(' || ', '\n    - ')}
-    
-    -------------------------------------------------------
-    Thank you for your trust in NS-SUS Quality Standards.
-    
-    Sincerely,
-    Marketing & Customer Service (MCS) Team
-    =======================================================
-    """
-    return report
+    return render_report(get_store(), case_data, get_report_cache())
+
+def build_report_zip(closed_from, closed_to, departments, summary):
+    buf = io.BytesIO()
+    batch_zip(get_store(), buf, closed_from, closed_to, departments, summary)
+    return buf.getvalue()
 
 init_db()
 
@@ -122,40 +135,149 @@ init_db()
 # ==========================================
 @st.cache_resource
 def load_model():
-    try:
-        data = {
-            'text': [
-                'สนิมขึ้นที่ขอบเหล็ก', 'สินค้าบุบ', 'ขนาดความหนาไม่ได้ตามสเปค', 
-                'ผิวเหล็กเป็นรอยขีดข่วน', 'ความแข็งไม่ได้มาตรฐาน', 'สีเคลือบหลุดร่อน',
-                'มีคราบน้ำมันเยอะเกินไป', 'เหล็กยืดตัวไม่ได้', 'ขอบเหล็กคมเกินไป',
-                'ค่า Yield Strength ต่ำ', 'Defect ที่ผิว', 'รอยกดทับ', 'เหล็กแตก',
-                'ใบ COA ไม่ตรงกับสินค้า', 'เอกสารรับรองคุณภาพผิด', 'หาใบเซอร์ไม่เจอ',
-                'ระบุเกรดเหล็กในใบส่งของผิด', 'ไม่ผ่านมาตรฐาน ISO', 'ตรวจสอบย้อนกลับไม่ได้',
-                'สเปคในระบบไม่ตรงกับป้าย', 'เอกสารประกอบการเคลมไม่ครบ', 'Label ผิด',
-                'ส่งของล่าช้ากว่ากำหนด', 'ติดต่อฝ่ายขายไม่ได้', 'พนักงานขับรถพูดจาไม่สุภาพ',
-                'ส่งสินค้าผิดสถานที่', 'แพ็คเกจจิ้งเสียหายจากการขนส่ง', 'ขอใบเสนอราคาช้า',
-                'ประสานงานยอดแย่', 'รถขนส่งมาไม่ตรงเวลา', 'แจ้งสถานะสินค้าผิด',
-                'ค่าขนส่งแพงเกินไป', 'บริการหลังการขายไม่ดี'
-            ],
-            'department': [
-                'QC', 'QC', 'QC', 'QC', 'QC', 'QC',
-                'QC', 'QC', 'QC', 'QC', 'QC', 'QC', 'QC',
-                'QA', 'QA', 'QA', 'QA', 'QA', 'QA',
-                'QA', 'QA', 'QA',
-                'MCS', 'MCS', 'MCS', 'MCS', 'MCS', 'MCS',
-                'MCS', 'MCS', 'MCS', 'MCS', 'MCS'
-            ]
-        }
-        pd.DataFrame(data).to_csv('complaints_data.csv', index=False)
-        df = pd.read_csv('complaints_data.csv')
-        model = make_pipeline(CountVectorizer(), MultinomialNB())
-        model.fit(df['text'], df['department'])
-        return model
-    except Exception as e:
-        return None
+    # โหลด model เวอร์ชันที่ใช้งานอยู่ (pin ได้) ตอน predict ครั้งแรกเท่านั้น ไม่เทรนใหม่ทุกครั้งที่เปิด server
+    return ComplaintRouter()
 
 global_model = load_model()
 
+# ==========================================
+# 2.1 Action Center: การ์ดงานทีละเคส
+# ==========================================
+TASK_PAGE_SIZE = 20
+TASK_AGE_FILTERS = {"Any age": None, "> 1 day": 1, "> 3 days": 3, "> 7 days": 7, "> 14 days": 14}
+
+def render_task_counters(slot, user_dept):
+    # ตัวเลขจาก aggregates (ไม่กี่แถว) วาดลงใน st.empty เดิม การ์ดที่ rerun แยกจึงอัปเดตได้โดยไม่ต้อง rerun ทั้งหน้า
+    stats = get_store().dashboard_stats()
+    mine = stats['active'] if user_dept == "MCS" else stats['by_handler'].get(user_dept, 0)
+    with slot.container():
+        m1, m2 = st.columns(2)
+        m1.metric(f"Pending for {user_dept}", mine)
+        m2.metric("Open claims (all teams)", stats['active'])
+
+def _first_task_page():
+    st.session_state["task_page_no"] = 1
+
+def _task_action(lot_id, case_id, version, **kwargs):
+    try:
+        update_status(lot_id, case_id=case_id, version=version, **kwargs)
+    except StaleCaseError:
+        # เคสถูกแก้จากที่อื่นหลังการ์ดนี้ถูกวาด -> ไม่เขียนทับ การ์ด rerun แล้วแสดงสถานะล่าสุดให้ดูก่อน
+        # (callback ของ fragment วาด element เองไม่ได้ จึงฝาก flag ไว้ให้การ์ดแสดง)
+        st.session_state[f"stale_{case_id}"] = True
+    st.session_state[f"acted_{case_id}"] = True
+
+@st.fragment
+def task_card(case_id, user_dept, counter_slot):
+    # แต่ละการ์ดเป็น fragment: กดปุ่มในการ์ดแล้ว rerun แค่การ์ดนี้ + ตัวนับ ไม่ใช่ทุกการ์ดในหน้า
+    # การ์ดผูกกับ claim (Case_ID) ไม่ใช่ lot: lot เดียวมีได้หลาย claim
+    if st.session_state.pop(f"acted_{case_id}", False):
+        render_task_counters(counter_slot, user_dept)
+    stale = st.session_state.pop(f"stale_{case_id}", False)
+    row = get_store().get_claim(case_id)
+    unique_suffix = f"_{case_id}"
+    if row is None or row['Status'] == 'Case Closed' or (user_dept != "MCS" and row['Current_Handler'] != user_dept):
+        with st.container(border=True):
+            if stale:
+                st.warning("This claim was changed by someone else; your action was not applied.")
+            st.success(f"✅ **{row['Lot_ID'] if row else f'Claim #{case_id}'}** — {row['Status'] if row else 'removed'}")
+        return
+
+    # version ที่การ์ดนี้แสดง: ปุ่มส่งไปด้วย ถ้าเคสเปลี่ยนไปแล้ว store จะไม่ยอมเขียน
+    target = (row['Lot_ID'], row['Case_ID'], row['Row_Version'])
+    with st.container(border=True):
+        if stale:
+            st.warning("This claim was changed by someone else; your action was not applied. Check its current state below.")
+        c1, c2 = st.columns([1.5, 1])
+        with c1:
+            st.markdown(f"#### 📌 {row['Lot_ID']}")
+            st.caption(f"Claim #{row['Case_ID']}")
+            st.markdown(f"**Issue:** {row['Complaint']}")
+            opened = pd.to_datetime(row['Date'], errors='coerce')
+            age = f" · open {(datetime.now() - opened).days} day(s)" if pd.notna(opened) else ""
+            st.info(f"**Current Handler:** {row['Current_Handler']}{age}")
+            # on_change="rerun" -> โหลด event จาก DB เฉพาะตอนที่เปิด expander เท่านั้น
+            history_log = st.expander("History Log", key=f"hist{unique_suffix}", on_change="rerun")
+            if history_log.open:
+                with history_log:
+                    for ev in get_case_history(row['Case_ID']):
+                        st.caption(f"• [{ev['Timestamp']}] {ev['Note']}")
+
+        with c2:
+            st.write("### Action")
+            if user_dept == "MCS":
+                if row['Current_Handler'] == "MCS":
+                    st.markdown("##### Final Decision")
+                    decision = st.selectbox("Outcome", ["Approve", "Compromise", "Reject"], key=f"d{unique_suffix}")
+                    note = st.text_input("Note to Customer", key=f"n{unique_suffix}")
+                    st.button("Close Case", key=f"btn{unique_suffix}", type="primary", on_click=_task_action,
+                              args=target,
+                              kwargs=dict(new_status="Case Closed", action_note=f"MCS: {decision}", next_handler="Completed",
+                                          final_decision=decision, resolution_note=note, actor="MCS", action="closed"))
+
+                st.markdown("---")
+                st.markdown("##### Manual Control Override")
+                target_depts = ["QC", "QA", "MCS"]
+                new_handler = st.selectbox("Re-assign to:", target_depts, key=f"move{unique_suffix}")
+                st.button("⚠️ Force Re-assign", key=f"btn_move{unique_suffix}", on_click=_task_action,
+                          args=target,
+                          kwargs=dict(new_status=f"Re-assigned to {new_handler}", action_note="MCS Manual Control Override",
+                                      force_handler=new_handler, actor="MCS"))
+
+            else:
+                note = st.text_input("Investigation Note", key=f"in{unique_suffix}")
+                st.button("➡️ Forward to MCS", key=f"fwd{unique_suffix}", on_click=_task_action,
+                          args=target,
+                          kwargs=dict(new_status="Investigation Complete", action_note=f"{user_dept}: {note}",
+                                      next_handler="MCS", actor=user_dept, action="forwarded"))
+
+# ==========================================
+# 2.2 Customer Tracking: แสดงผลทีละ claim
+# ==========================================
+def render_claim(r):
+    st.progress(100 if r['Status'] == 'Case Closed' else 50)
+
+    c1, c2 = st.columns(2)
+    with c1:
+        st.write(f"**Lot ID:** {r['Lot_ID']}")
+        st.write(f"**Status:** {r['Status']}")
+    with c2:
+        st.write(f"**Dept:** {r['Department']}")
+        st.write(f"**Handler:** {r['Current_Handler']}")
+    st.caption(f"Claim #{r['Case_ID']} · reported {r['Date']}")
+
+    if r['Status'] != 'Case Closed':
+        # ETA จากเวลาปิดเคสจริงของเคสที่คล้ายกัน (ไม่ใช่ค่าคงที่ต่อแผนก)
+        eta = get_store().eta_model().predict(r['Department'], r.get('Cluster'))
+        opened = pd.to_datetime(r['Date'], errors='coerce')
+        if pd.notna(opened):
+            expected = (opened + timedelta(days=eta['days'])).strftime('%Y-%m-%d')
+            if eta['low'] is not None:
+                band = (f"{(opened + timedelta(days=eta['low'])).strftime('%Y-%m-%d')} – "
+                        f"{(opened + timedelta(days=eta['high'])).strftime('%Y-%m-%d')}")
+                st.write(f"**Expected Resolution:** {expected} (likely {band}, based on {eta['n']} similar cases)")
+            else:
+                st.write(f"**Expected Resolution:** {expected}")
+
+    if r['Status'] == 'Case Closed':
+        st.divider()
+        st.info(f"**Final Decision:** {r['Final_Decision']}\n\n**Note:** {r['Resolution_Note']}")
+
+        # === ✨ FEATURE ใหม่: ปุ่มดาวน์โหลด Report ===
+        report_content = generate_customer_report(r)
+        st.download_button(
+            label="📄 Download Official Resolution Report",
+            data=report_content,
+            file_name=f"Resolution_Report_{r['Lot_ID']}_{r['Case_ID']}.txt",
+            mime="text/plain",
+            key=f"report_{r['Case_ID']}"
+        )
+
+def _track_lot(lot_id):
+    st.session_state["track_id"] = lot_id
+    st.session_state["track_go"] = True
+
+
 # ==========================================
 # 3. User Interface
 # ==========================================
@@ -163,46 +285,60 @@ st.set_page_config(page_title="NS-SUS Smart Claim", layout="wide")
 
 with st.sidebar:
     st.title("🔧 Tools")
-    if st.button("🗑️ Reset Database (Clear All)", type="primary"):
-        if os.path.exists(DB_FILE):
-            os.remove(DB_FILE)
-            init_db()
-            st.success("Database Cleared! 🧹")
-            time.sleep(1)
-            st.rerun()
+    st.caption(f"Routing model: {global_model.describe()}")
+    cache_stats = get_read_cache().stats()
+    st.caption(f"Read cache: {cache_stats['hit_rate']:.0%} hits "
+               f"({cache_stats['hits']:,} hits / {cache_stats['misses']:,} loads)")
+    # ล้างทีละ partition ได้: ไฟล์หลัก (เคสเปิด + เคสปิดล่าสุด) หรือ archive รายเดือน
+    reset_scopes = {"All partitions": None, "Working set (open + recent)": HOT}
+    reset_scope = st.selectbox("Reset scope", list(reset_scopes) + get_store().months())
+    if st.button("🗑️ Reset Database", type="primary"):
+        partition = reset_scopes.get(reset_scope, reset_scope)
+        if partition in (None, HOT):
+            get_writer().submit('clear').result()
+        for month in get_store().months():
+            if partition in (None, month):
+                get_store().clear(month)
+        get_similarity_index().reset()
+        st.success(f"{reset_scope} cleared! 🧹")
+        time.sleep(1)
+        st.rerun()
 
 st.title("NS-SUS Smart Claim & Tracking")
 
 tab1, tab2, tab3, tab4 = st.tabs(["Executive Dashboard", "Submit & Log", "Workflow & Action Center", "Customer Tracking"])
 
-df = get_all_data()
-
 # --- TAB 1: EXECUTIVE DASHBOARD ---
 with tab1:
     st.markdown("### Real-time Analytics Dashboard")
     
-    if not df.empty:
+    stats = get_store().dashboard_stats()  # ตัวเลขที่คำนวณไว้แล้วตอนเขียน ไม่ต้อง scan ทั้งตาราง
+    if stats['total'] > 0:
         col1, col2, col3, col4 = st.columns(4)
-        total = len(df)
-        closed = len(df[df['Status'] == 'Case Closed'])
-        active = total - closed
+        total = stats['total']
+        closed = stats['closed']
+        active = stats['active']
         success_rate = (closed / total) * 100 if total > 0 else 0
         
         col1.metric("Total Claims", total)
         col2.metric("Resolved", closed, delta=f"{success_rate:.1f}% Rate")
         col3.metric("Active Issues", active, delta_color="inverse")
-        col4.metric("Avg. Resolution", "2.1 Days")
+        resolution = stats['resolution']
+        if resolution:
+            col4.metric("Avg. Resolution", f"{resolution['mean_days']:.1f} Days",
+                        help=f"{resolution['n']} closed cases · ±{resolution['std_days']:.1f} days · "
+                             f"range {resolution['min_days']:.1f}-{resolution['max_days']:.1f} days")
+        else:
+            col4.metric("Avg. Resolution", "-")
         
         st.divider()
         c1, c2 = st.columns(2)
         with c1:
             st.subheader("Defects by Dept")
-            if 'Department' in df.columns:
-                st.bar_chart(df['Department'].value_counts(), color="#FF4B4B")
+            st.bar_chart(pd.Series(stats['by_department'], name="count"), color="#FF4B4B")
         with c2:
             st.subheader("Work Status")
-            if 'Status' in df.columns:
-                st.bar_chart(df['Status'].value_counts(), color="#29B5E8")
+            st.bar_chart(pd.Series(stats['by_status'], name="count"), color="#29B5E8")
     else:
         st.info("Waiting for data stream...")
 
@@ -224,35 +360,86 @@ with tab2:
                         time.sleep(0.5)
                         predicted_dept = global_model.predict([complaint_input])[0]
                         status = f"Assigned to {predicted_dept}"
-                        days = 3
-                        if predicted_dept == "QA": days = 1
-                        elif predicted_dept == "MCS": days = 2
-                        elif predicted_dept == "QC": days = 5
-                        save_to_db(lot_input, complaint_input, predicted_dept, status, days)
-                    st.success(f"New case assigned to **{predicted_dept}**")
-                    time.sleep(0.5)
-                    st.rerun()
+                        cluster = complaint_clusters([complaint_input])[0]
+                        eta = get_store().eta_model().predict(predicted_dept, cluster)
+                        days = max(1, math.ceil(eta['days']))
+                        # เคสเก่าที่คล้ายกัน (หาก่อนบันทึก จะได้ไม่เจอตัวเอง) -> MCS ดู Final_Decision เดิมได้เลย
+                        st.session_state["similar_cases"] = (lot_input, find_similar(complaint_input))
+                        try:
+                            save_to_db(lot_input, complaint_input, predicted_dept, status, days, cluster)
+                            saved = True
+                        except DuplicateCaseError:
+                            saved = False
+                    if saved:
+                        st.success(f"New case assigned to **{predicted_dept}** · ETA ~{days} day(s)")
+                        time.sleep(0.5)
+                        st.rerun()
+                    else:
+                        st.warning(f"Lot **{lot_input}** already has an open claim case.")
                 else:
                     st.warning("Please fill in all fields.")
+
+            similar_to = st.session_state.get("similar_cases")
+            if similar_to and similar_to[1]:
+                st.markdown(f"##### 🔎 Similar past cases to **{similar_to[0]}**")
+                st.dataframe(
+                    pd.DataFrame(similar_to[1])[['Similarity', 'Lot_ID', 'Date', 'Complaint', 'Status', 'Final_Decision', 'Resolution_Note']],
+                    column_config={'Similarity': st.column_config.ProgressColumn("Similarity", min_value=0.0, max_value=1.0, format="%.2f")},
+                    use_container_width=True, hide_index=True)
+
+            # === นำเข้าเคสทีละมากๆ จากไฟล์ของ distributor ===
+            with st.expander("📦 Bulk Import (CSV / XLSX)"):
+                st.caption("Columns: **Lot No.** and **Issue / Complaint**. Rows are routed and saved in chunks.")
+                bulk_file = st.file_uploader("Complaint file", type=["csv", "xlsx"], key="bulk_file")
+                if bulk_file and st.button("Import All", type="primary", key="bulk_go"):
+                    progress = st.progress(0.0, text="Importing...")
+                    total_bytes = max(bulk_file.size, 1)
+                    def _on_chunk(r):
+                        done = min(bulk_file.tell() / total_bytes, 1.0)
+                        progress.progress(done, text=f"{r.rows:,} rows read · {r.inserted:,} saved · {r.rows_per_sec:,.0f} rows/s")
+                    try:
+                        report = ingest(bulk_file, bulk_file.name, global_model, get_writer(), chunksize=1000, on_chunk=_on_chunk,
+                                        eta_model=get_store().eta_model())
+                    except ValueError as e:
+                        st.error(f"Cannot read file: {e}")
+                    else:
+                        progress.progress(1.0, text="Done")
+                        st.success(f"Imported **{report.inserted:,}** of {report.rows:,} rows in {report.elapsed:.1f}s "
+                                   f"({report.rows_per_sec:,.0f} rows/s)")
+                        if report.rejected:
+                            rejected = report.rejected_frame()
+                            st.warning(f"{len(rejected):,} rows rejected")
+                            st.dataframe(rejected, use_container_width=True, hide_index=True)
+                            st.download_button("Download rejection list", rejected.to_csv(index=False).encode('utf-8'),
+                                               file_name="bulk_import_rejected.csv", mime="text/csv")
         
         with c2:
             st.write("### 📥 Export Data")
-            if not df.empty:
-                buffer = io.BytesIO()
-                csv_data = df.to_csv(index=False).encode('utf-8')
+            if stats['total'] > 0:
+                e1, e2 = st.columns(2)
+                with e1:
+                    export_from = st.date_input("From", value=None, key="export_from")
+                with e2:
+                    export_to = st.date_input("To", value=None, key="export_to")
+                export_depts = st.multiselect("Department", sorted(stats['by_department']), key="export_depts")
+                export_statuses = st.multiselect("Status", sorted(stats['by_status']), key="export_statuses")
+                export_fmt = st.radio("Format", list(EXPORT_FORMATS), horizontal=True, key="export_fmt")
+                # ส่ง callable: ไฟล์ถูกสร้างตอนกดดาวน์โหลดเท่านั้น ไม่ใช่ทุกครั้งที่หน้า rerun
                 st.download_button(
-                    label="📄 Download CSV Report",
-                    data=csv_data,
-                    file_name="NSSUS_Report.csv",
-                    mime="text/csv",
+                    label=f"📄 Download {export_fmt.upper()} Report",
+                    data=functools.partial(export_report, get_store(), export_fmt, export_from, export_to,
+                                           export_depts, export_statuses),
+                    file_name=f"NSSUS_Report.{export_fmt}",
+                    mime=EXPORT_FORMATS[export_fmt],
+                    on_click="ignore",
                     use_container_width=True
                 )
 
     st.divider()
     st.subheader("Operational Log")
-    if not df.empty:
-        df_display = df.iloc[::-1].copy()
-        st.dataframe(df_display[['Lot_ID', 'Date', 'Complaint', 'Department', 'Status', 'Current_Handler']], use_container_width=True, hide_index=True)
+    oplog = get_case_frame('oplog', OPLOG_COLUMNS)
+    if not oplog.empty:
+        st.dataframe(oplog.iloc[::-1], use_container_width=True, hide_index=True)
     else:
         st.info("No data available.")
 
@@ -260,102 +447,103 @@ with tab2:
 with tab3:
     st.header("Workflow & Action Center")
     user_roles = ["QC", "QA", "MCS"]
-    user_dept = st.selectbox("Login As:", user_roles)
+    user_dept = st.selectbox("Login As:", user_roles, on_change=_first_task_page)
     
     subtab_active, subtab_history = st.tabs(["Pending Tasks", "Completed History"])
 
-    if not df.empty:
-        completed_tasks = df[df['Status'] == 'Case Closed']
-        active_tasks_all = df[df['Status'] != 'Case Closed']
-        
-        my_active_tasks = pd.DataFrame()
+    with subtab_active:
         if user_dept == "MCS":
-            my_active_tasks = active_tasks_all
             st.success("MCS Manual Control Override Mode Active")
-        else:
-            if 'Current_Handler' in df.columns:
-                my_active_tasks = active_tasks_all[active_tasks_all['Current_Handler'] == user_dept]
-
-        with subtab_active:
-            if not my_active_tasks.empty:
-                for index, row in my_active_tasks.iterrows():
-                    # ✅ FIXED: ใส่ Suffix เพื่อป้องกัน Duplicate Key
-                    unique_suffix = f"_{row['Lot_ID']}_{index}"
-
-                    with st.container(border=True):
-                        c1, c2 = st.columns([1.5, 1])
-                        with c1:
-                            st.markdown(f"#### 📌 {row['Lot_ID']}")
-                            st.markdown(f"**Issue:** {row['Complaint']}")
-                            st.info(f"**Current Handler:** {row['Current_Handler']}") 
-                            with st.expander("History Log"):
-                                if pd.notna(row['Action_History']):
-                                    for h in str(row['Action_History']).split(' || '):
-                                        st.caption(f"• {h}")
-
-                        with c2:
-                            st.write("### Action")
-                            if user_dept == "MCS":
-                                if row['Current_Handler'] == "MCS":
-                                    st.markdown("##### Final Decision")
-                                    decision = st.selectbox("Outcome", ["Approve", "Compromise", "Reject"], key=f"d{unique_suffix}")
-                                    note = st.text_input("Note to Customer", key=f"n{unique_suffix}")
-                                    if st.button("Close Case", key=f"btn{unique_suffix}", type="primary"):
-                                        update_status(row['Lot_ID'], "Case Closed", f"MCS: {decision}", "Completed", decision, note)
-                                        st.rerun()
-                                
-                                st.markdown("---")
-                                st.markdown("##### Manual Control Override")
-                                target_depts = ["QC", "QA", "MCS"]
-                                new_handler = st.selectbox("Re-assign to:", target_depts, key=f"move{unique_suffix}")
-                                if st.button("⚠️ Force Re-assign", key=f"btn_move{unique_suffix}"):
-                                    update_status(row['Lot_ID'], f"Re-assigned to {new_handler}", "MCS Manual Control Override", force_handler=new_handler)
-                                    st.success(f"Corrected assignment to {new_handler}")
-                                    st.rerun()
-
-                            else: 
-                                note = st.text_input("Investigation Note", key=f"in{unique_suffix}")
-                                if st.button("➡️ Forward to MCS", key=f"fwd{unique_suffix}"):
-                                    update_status(row['Lot_ID'], "Investigation Complete", f"{user_dept}: {note}", "MCS")
-                                    st.rerun()
+        counter_slot = st.empty()
+        render_task_counters(counter_slot, user_dept)
+
+        f1, f2, f3 = st.columns(3)
+        with f1:
+            if user_dept == "MCS":
+                handler_filter = st.selectbox("Handler", ["All"] + user_roles, key="task_handler", on_change=_first_task_page)
             else:
-                st.success(f"🎉 No pending tasks for **{user_dept}**")
-        
-        with subtab_history:
+                handler_filter = user_dept
+        with f2:
+            age_filter = st.selectbox("Age", list(TASK_AGE_FILTERS), key="task_age", on_change=_first_task_page)
+        with f3:
+            sort_order = st.selectbox("Sort", ["Oldest first", "Newest first"], key="task_sort", on_change=_first_task_page)
+
+        opened_before = None
+        if TASK_AGE_FILTERS[age_filter]:
+            opened_before = (datetime.now() - timedelta(days=TASK_AGE_FILTERS[age_filter])).strftime("%Y-%m-%d %H:%M")
+        handler = None if handler_filter == "All" else handler_filter
+        page_no = st.session_state.get("task_page_no", 1)
+        # อ่านเฉพาะหน้าที่แสดง (LIMIT/OFFSET บน partial index) ไม่ว่า backlog จะใหญ่แค่ไหน
+        page, matching = get_store().task_page(handler, opened_before, sort_order == "Newest first",
+                                               TASK_PAGE_SIZE, (page_no - 1) * TASK_PAGE_SIZE)
+        pages = max(1, math.ceil(matching / TASK_PAGE_SIZE))
+        if page_no > pages:
+            page_no = st.session_state["task_page_no"] = pages
+            page, matching = get_store().task_page(handler, opened_before, sort_order == "Newest first",
+                                                   TASK_PAGE_SIZE, (page_no - 1) * TASK_PAGE_SIZE)
+
+        if not page.empty:
+            for case_id in page['Case_ID']:
+                task_card(int(case_id), user_dept, counter_slot)
+            p1, p2 = st.columns([1, 3])
+            with p1:
+                st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, key="task_page_no")
+            with p2:
+                st.caption(f"Showing {len(page)} of {matching:,} matching cases")
+        else:
+            st.success(f"🎉 No pending tasks for **{user_dept}**")
+
+    with subtab_history:
+        period = st.selectbox(f"Period (closed more than {ARCHIVE_AFTER_DAYS} days ago → monthly archive)",
+                              [HOT] + get_store().months(),
+                              format_func=lambda p: f"Recent (last {ARCHIVE_AFTER_DAYS} days)" if p == HOT else f"Archive {p}")
+        completed_tasks = get_case_frame('closed', filters=[('Status', '==', 'Case Closed')], partition=period)
+        if not completed_tasks.empty:
             st.dataframe(completed_tasks, use_container_width=True)
+        else:
+            st.info("No closed cases in this period.")
 
 # --- TAB 4: Customer Tracking ---
 with tab4:
     st.subheader("Customer Status Check")
-    track_id = st.text_input("Enter Lot No.", placeholder="LOT-XXXX-XXX")
-    if st.button("Search"):
-        df_latest = get_all_data()
-        if not df_latest.empty:
-            res = df_latest[df_latest['Lot_ID'].astype(str) == str(track_id)]
-            if not res.empty:
-                r = res.iloc[-1]
+    track_id = st.text_input("Enter Lot No.", placeholder="LOT-XXXX-XXX", key="track_id")
+    if st.button("Search") or st.session_state.pop("track_go", False):
+        # ค้นด้วย index ของ Lot_ID (ไม่ต้องโหลด/scan ทั้งตาราง) และแสดงทุก claim ของ lot นี้
+        claims = get_store().find_cases(track_id.strip())
+        if claims:
+            if len(claims) == 1:
                 st.success("✅ Found Case")
-                st.progress(100 if r['Status'] == 'Case Closed' else 50)
-                
-                c1, c2 = st.columns(2)
-                with c1:
-                    st.write(f"**Lot ID:** {r['Lot_ID']}")
-                    st.write(f"**Status:** {r['Status']}")
-                with c2:
-                    st.write(f"**Dept:** {r['Department']}")
-                    st.write(f"**Handler:** {r['Current_Handler']}")
-                
-                if r['Status'] == 'Case Closed':
-                    st.divider()
-                    st.info(f"**Final Decision:** {r['Final_Decision']}\n\n**Note:** {r['Resolution_Note']}")
-                    
-                    # === ✨ FEATURE ใหม่: ปุ่มดาวน์โหลด Report ===
-                    report_content = generate_customer_report(r)
-                    st.download_button(
-                        label="📄 Download Official Resolution Report",
-                        data=report_content,
-                        file_name=f"Resolution_Report_{r['Lot_ID']}.txt",
-                        mime="text/plain"
-                    )
+            else:
+                st.success(f"✅ Found {len(claims)} claims for this lot (newest first)")
+            for r in claims:
+                with st.container(border=True):
+                    render_claim(r)
+        else:
+            matches = get_store().search_lots(track_id.strip(), limit=10) if track_id.strip() else []
+            if matches:
+                st.info(f"No exact match. Lots starting with **{track_id.strip()}**:")
+                for lot, n in matches:
+                    st.button(f"{lot} ({n} claim{'s' if n > 1 else ''})", key=f"track_{lot}",
+                              on_click=_track_lot, args=(lot,))
             else:
                 st.error("Not Found")
+
+    # === รายงานปิดเคสทั้งเดือนสำหรับ MCS: ZIP เดียว ไม่ต้องค้นทีละ lot ===
+    with st.expander("📦 Month-end Resolution Reports (ZIP)"):
+        today = datetime.now().date()
+        r1, r2 = st.columns(2)
+        with r1:
+            reports_from = st.date_input("Closed from", value=today.replace(day=1), key="reports_from")
+        with r2:
+            reports_to = st.date_input("Closed to", value=today, key="reports_to")
+        reports_depts = st.multiselect("Department", sorted(get_store().dashboard_stats()['by_department']),
+                                       key="reports_depts")
+        reports_summary = st.checkbox("Include XLSX summary sheet", value=True, key="reports_summary")
+        st.download_button(
+            label="📄 Download Reports (ZIP)",
+            data=functools.partial(build_report_zip, reports_from, reports_to, reports_depts, reports_summary),
+            file_name=f"Resolution_Reports_{reports_from}_{reports_to}.zip",
+            mime="application/zip",
+            on_click="ignore",
+            use_container_width=True
+        )
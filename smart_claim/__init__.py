@@ -0,0 +1 @@
+"""Storage and helpers behind pages/NS-SUS Smart Claim & Tracking.py."""
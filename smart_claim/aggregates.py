@@ -0,0 +1,222 @@
+"""Materialized dashboard aggregates for the case store.
+
+Counts per Department / Status / Current_Handler, open/closed totals and
+running resolution-time statistics are kept in two small tables that are
+updated inside the same transaction as every case write, so the Executive
+Dashboard reads a handful of rows instead of scanning the whole case table.
+``rebuild`` recomputes everything from ``cases`` and ``verify`` compares the
+two, for when the numbers need to be trusted.
+"""
+import math
+from collections import Counter
+
+CLOSED_STATUS = 'Case Closed'
+DIMENSIONS = ['Department', 'Status', 'Current_Handler']
+
+# ชั่วโมงที่ใช้ปิดเคส (Date -> Closed_At)
+_HOURS_SQL = "(julianday(Closed_At) - julianday(Date)) * 24.0"
+
+
+def create_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS case_counts (
+            Dimension TEXT NOT NULL,
+            Value TEXT NOT NULL,
+            N INTEGER NOT NULL,
+            PRIMARY KEY (Dimension, Value)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS resolution_stats (
+            Scope TEXT PRIMARY KEY,
+            N INTEGER NOT NULL,
+            Mean_Hours REAL NOT NULL,
+            M2 REAL NOT NULL,
+            Min_Hours REAL,
+            Max_Hours REAL
+        )
+    """)
+
+
+def _bump(conn, dimension, value, delta):
+    value = '' if value is None else str(value)
+    conn.execute(
+        "INSERT INTO case_counts (Dimension, Value, N) VALUES (?, ?, ?) "
+        "ON CONFLICT (Dimension, Value) DO UPDATE SET N = N + excluded.N",
+        (dimension, value, delta),
+    )
+
+
+def _state(row):
+    return 'closed' if row.get('Status') == CLOSED_STATUS else 'open'
+
+
+def _hours(conn, date, closed_at):
+    if not date or not closed_at:
+        return None
+    hours = conn.execute("SELECT (julianday(?) - julianday(?)) * 24.0", (closed_at, date)).fetchone()[0]
+    return None if hours is None else max(hours, 0.0)
+
+
+def _add_resolution(conn, hours, scope='all'):
+    # Welford: อัปเดต mean/variance ทีละเคสโดยไม่ต้องย้อนไปอ่านเคสเก่า
+    row = conn.execute("SELECT N, Mean_Hours, M2, Min_Hours, Max_Hours FROM resolution_stats WHERE Scope = ?",
+                       (scope,)).fetchone()
+    n, mean, m2, lo, hi = tuple(row) if row else (0, 0.0, 0.0, hours, hours)
+    n += 1
+    delta = hours - mean
+    mean += delta / n
+    m2 += delta * (hours - mean)
+    conn.execute(
+        "INSERT OR REPLACE INTO resolution_stats (Scope, N, Mean_Hours, M2, Min_Hours, Max_Hours) VALUES (?, ?, ?, ?, ?, ?)",
+        (scope, n, mean, m2, min(lo, hours), max(hi, hours)),
+    )
+
+
+def apply_insert(conn, row):
+    for dim in DIMENSIONS:
+        _bump(conn, dim, row.get(dim), 1)
+    _bump(conn, 'State', _state(row), 1)
+    if _state(row) == 'closed':
+        hours = _hours(conn, row.get('Date'), row.get('Closed_At'))
+        if hours is not None:
+            _add_resolution(conn, hours)
+
+
+def apply_inserts(conn, rows):
+    """Bulk version of ``apply_insert``: one upsert per distinct value, not per row."""
+    counts = Counter()
+    for row in rows:
+        for dim in DIMENSIONS:
+            counts[(dim, row.get(dim))] += 1
+        counts[('State', _state(row))] += 1
+    for (dim, value), n in counts.items():
+        _bump(conn, dim, value, n)
+    for row in rows:
+        if _state(row) == 'closed':
+            hours = _hours(conn, row.get('Date'), row.get('Closed_At'))
+            if hours is not None:
+                _add_resolution(conn, hours)
+
+
+def apply_update(conn, old, new):
+    for dim in DIMENSIONS + ['State']:
+        before = _state(old) if dim == 'State' else old.get(dim)
+        after = _state(new) if dim == 'State' else new.get(dim)
+        if before != after:
+            _bump(conn, dim, before, -1)
+            _bump(conn, dim, after, 1)
+    if _state(old) == 'open' and _state(new) == 'closed':
+        hours = _hours(conn, new.get('Date'), new.get('Closed_At'))
+        if hours is not None:
+            _add_resolution(conn, hours)
+
+
+def _fresh(conn):
+    counts = {}
+    for dim in DIMENSIONS:
+        for value, n in conn.execute(f"SELECT COALESCE({dim}, ''), COUNT(*) FROM cases GROUP BY 1"):
+            counts[(dim, value)] = n
+    for value, n in conn.execute(
+        f"SELECT CASE WHEN Status = ? THEN 'closed' ELSE 'open' END, COUNT(*) FROM cases GROUP BY 1", (CLOSED_STATUS,)
+    ):
+        counts[('State', value)] = n
+    hours = [max(h, 0.0) for (h,) in conn.execute(
+        f"SELECT {_HOURS_SQL} FROM cases WHERE Status = ? AND Closed_At IS NOT NULL AND {_HOURS_SQL} IS NOT NULL",
+        (CLOSED_STATUS,),
+    )]
+    stats = {}
+    if hours:
+        mean = sum(hours) / len(hours)
+        stats['all'] = (len(hours), mean, sum((h - mean) ** 2 for h in hours), min(hours), max(hours))
+    return counts, stats
+
+
+def rebuild(conn):
+    """Recompute every aggregate from ``cases`` (caller owns the transaction)."""
+    counts, stats = _fresh(conn)
+    conn.execute("DELETE FROM case_counts")
+    conn.execute("DELETE FROM resolution_stats")
+    conn.executemany("INSERT INTO case_counts (Dimension, Value, N) VALUES (?, ?, ?)",
+                     [(dim, value, n) for (dim, value), n in counts.items()])
+    conn.executemany(
+        "INSERT INTO resolution_stats (Scope, N, Mean_Hours, M2, Min_Hours, Max_Hours) VALUES (?, ?, ?, ?, ?, ?)",
+        [(scope, *values) for scope, values in stats.items()],
+    )
+
+
+def verify(conn, tolerance=1e-6):
+    """Return a list of mismatches between the materialized and recomputed aggregates."""
+    counts, stats = _fresh(conn)
+    stored = {(d, v): n for d, v, n in conn.execute("SELECT Dimension, Value, N FROM case_counts") if n}
+    problems = [f"{key}: stored={stored.get(key, 0)} actual={counts.get(key, 0)}"
+                for key in sorted(set(stored) | set(counts)) if stored.get(key, 0) != counts.get(key, 0)]
+    stored_stats = {row[0]: tuple(row[1:]) for row in conn.execute(
+        "SELECT Scope, N, Mean_Hours, M2, Min_Hours, Max_Hours FROM resolution_stats")}
+    for scope in sorted(set(stats) | set(stored_stats)):
+        a, b = stored_stats.get(scope), stats.get(scope)
+        if a is None or b is None or a[0] != b[0] or any(
+                not math.isclose(x, y, rel_tol=tolerance, abs_tol=tolerance) for x, y in zip(a[1:], b[1:])):
+            problems.append(f"resolution[{scope}]: stored={a} actual={b}")
+    return problems
+
+
+def read(conn):
+    """Dashboard numbers: a few indexed rows, independent of the number of cases."""
+    by = {dim: {} for dim in DIMENSIONS + ['State']}
+    for dim, value, n in conn.execute("SELECT Dimension, Value, N FROM case_counts WHERE N > 0"):
+        by.setdefault(dim, {})[value] = n
+    closed = by['State'].get('closed', 0)
+    active = by['State'].get('open', 0)
+    row = conn.execute("SELECT N, Mean_Hours, M2, Min_Hours, Max_Hours FROM resolution_stats WHERE Scope = 'all'").fetchone()
+    resolution = None
+    if row and row[0]:
+        n, mean, m2, lo, hi = row
+        resolution = {
+            'n': n,
+            'mean_days': mean / 24.0,
+            'std_days': math.sqrt(m2 / (n - 1)) / 24.0 if n > 1 else 0.0,
+            'min_days': lo / 24.0,
+            'max_days': hi / 24.0,
+        }
+    return {
+        'total': closed + active,
+        'closed': closed,
+        'active': active,
+        'by_department': by['Department'],
+        'by_status': by['Status'],
+        'by_handler': by['Current_Handler'],
+        'resolution': resolution,
+    }
+
+
+def combine(parts):
+    """Merge the ``read`` results of several stores (the hot file plus archive partitions)."""
+    out = {'total': 0, 'closed': 0, 'active': 0, 'by_department': Counter(), 'by_status': Counter(),
+           'by_handler': Counter(), 'resolution': None}
+    n, mean, m2, lo, hi = 0, 0.0, 0.0, math.inf, -math.inf
+    for part in parts:
+        for key in ('total', 'closed', 'active'):
+            out[key] += part[key]
+        for key in ('by_department', 'by_status', 'by_handler'):
+            out[key].update(part[key])
+        r = part['resolution']
+        if r:
+            # รวม mean/variance สองกลุ่ม (Chan et al.) ไม่ต้องอ่านเคสทีละตัว
+            n_b, m2_b = r['n'], r['std_days'] ** 2 * (r['n'] - 1)
+            delta = r['mean_days'] - mean
+            mean += delta * n_b / (n + n_b)
+            m2 += m2_b + delta ** 2 * n * n_b / (n + n_b)
+            n += n_b
+            lo, hi = min(lo, r['min_days']), max(hi, r['max_days'])
+    for key in ('by_department', 'by_status', 'by_handler'):
+        out[key] = dict(out[key])
+    if n:
+        out['resolution'] = {
+            'n': n,
+            'mean_days': mean,
+            'std_days': math.sqrt(m2 / (n - 1)) if n > 1 else 0.0,
+            'min_days': lo,
+            'max_days': hi,
+        }
+    return out
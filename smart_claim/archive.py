@@ -0,0 +1,256 @@
+"""Monthly archive partitions for closed cases.
+
+Closed cases older than ``RETENTION_DAYS`` are moved out of the hot store into
+one SQLite file per closing month (``archive/cases_YYYY-MM.db``), so writes,
+the dashboard aggregates and the Action Center only ever deal with open and
+recently closed cases. Every partition is an ordinary ``SQLiteCaseStore``.
+
+``PartitionedCaseStore`` puts the hot store and the partitions behind the
+``CaseStore`` interface: writes and task queries go to the hot store, lookups
+(``get_case``, ``find_cases``, ``case_history``, ...) fall through to the
+archive on demand, and exports/dashboard numbers cover both.
+
+    python -m smart_claim.archive run --days 90
+    python -m smart_claim.archive list
+    python -m smart_claim.archive clear 2025-11
+"""
+import os
+import re
+import heapq
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from smart_claim import aggregates
+from smart_claim.store import CaseStore, SQLiteCaseStore
+
+ARCHIVE_DIR = 'archive'
+RETENTION_DAYS = 90
+MOVE_BATCH = 1000
+HOT = 'hot'
+
+_PARTITION_RE = re.compile(r'^cases_(\d{4}-\d{2})\.db$')
+
+
+class PartitionedCaseStore(CaseStore):
+    def __init__(self, hot, archive_dir=ARCHIVE_DIR):
+        self.hot = hot
+        self.path = hot.path
+        self.previous_version = hot.previous_version
+        self.archive_dir = archive_dir
+        self._partitions = {}
+        self._lock = threading.Lock()
+
+    # ==========================================
+    # partitions
+    # ==========================================
+    def months(self):
+        """Archived months (``'YYYY-MM'``), newest first."""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        found = (_PARTITION_RE.match(name) for name in os.listdir(self.archive_dir))
+        return sorted((m.group(1) for m in found if m), reverse=True)
+
+    def partition(self, month):
+        """The ``SQLiteCaseStore`` of one archived month (created on first use)."""
+        with self._lock:
+            store = self._partitions.get(month)
+            if store is None:
+                os.makedirs(self.archive_dir, exist_ok=True)
+                store = SQLiteCaseStore(os.path.join(self.archive_dir, f"cases_{month}.db"))
+                self._partitions[month] = store
+            return store
+
+    def _archived(self):
+        return [self.partition(month) for month in self.months()]
+
+    def archive_closed(self, older_than_days=RETENTION_DAYS, now=None):
+        """Move cases closed more than ``older_than_days`` ago into their month's partition.
+
+        Returns ``{'YYYY-MM': moved}``. Safe to rerun after an interruption.
+        """
+        cutoff = ((now or datetime.now()) - timedelta(days=older_than_days)).strftime("%Y-%m-%d %H:%M")
+        moved = {}
+        for month, case_ids in sorted(self.hot.closed_before(cutoff).items()):
+            target = self.partition(month)
+            for i in range(0, len(case_ids), MOVE_BATCH):
+                # ผ่าน apply_batch: ถือ write lock ของไฟล์หลักตลอดการย้ายแต่ละ batch
+                ((n, error),) = self.hot.apply_batch([('move_cases', (target, case_ids[i:i + MOVE_BATCH]), {})])
+                if error is not None:
+                    raise error
+                moved[month] = moved.get(month, 0) + n
+        return moved
+
+    # ==========================================
+    # writes and open-case queries: hot store only
+    # ==========================================
+    def insert_case(self, record, event=None):
+        return self.hot.insert_case(record, event)
+
+    def insert_cases(self, records, events=None):
+        return self.hot.insert_cases(records, events)
+
+    def update_case(self, lot_id, changes, event=None, case_id=None, expected_version=None):
+        return self.hot.update_case(lot_id, changes, event, case_id, expected_version)
+
+    def apply_batch(self, ops):
+        return self.hot.apply_batch(ops)
+
+    def import_csv(self, csv_path):
+        return self.hot.import_csv(csv_path)
+
+    def task_page(self, handler=None, opened_before=None, newest_first=False, limit=20, offset=0):
+        return self.hot.task_page(handler, opened_before, newest_first, limit, offset)
+
+    def routing_feedback(self):
+        return self.hot.routing_feedback()
+
+    def eta_model(self):
+        return self.hot.eta_model()
+
+    def refit_eta(self):
+        return self.hot.refit_eta()
+
+    # ==========================================
+    # lookups: hot first, archive on demand
+    # ==========================================
+    def get_case(self, lot_id):
+        case = self.hot.get_case(lot_id)
+        if case is not None:
+            return case
+        for store in self._archived():
+            case = store.get_case(lot_id)
+            if case is not None:
+                return case
+        return None
+
+    def get_claim(self, case_id):
+        case = self.hot.get_claim(case_id)
+        if case is not None:
+            return case
+        for store in self._archived():
+            case = store.get_claim(case_id)
+            if case is not None:
+                return case
+        return None
+
+    def find_cases(self, lot_id):
+        found = self.hot.find_cases(lot_id)
+        for store in self._archived():
+            found.extend(store.find_cases(lot_id))
+        return sorted(found, key=lambda r: r['Case_ID'], reverse=True)
+
+    def search_lots(self, prefix, limit=20):
+        counts = {}
+        # แต่ละ partition คืน lot แรกๆ ตามลำดับอยู่แล้ว -> รวมแล้วตัด limit ได้ผลเท่ากับค้นทั้งหมด
+        for store in [self.hot] + self._archived():
+            for lot, n in store.search_lots(prefix, limit):
+                counts[lot] = counts.get(lot, 0) + n
+        return sorted(counts.items())[:limit]
+
+    def cases_by_id(self, case_ids):
+        return self._by_id('cases_by_id', case_ids)
+
+    def case_history(self, case_id):
+        history = self.hot.case_history(case_id)
+        if history:
+            return history
+        for store in self._archived():
+            history = store.case_history(case_id)
+            if history:
+                return history
+        return []
+
+    def case_histories(self, case_ids):
+        return self._by_id('case_histories', case_ids)
+
+    def case_versions(self, case_ids):
+        return self._by_id('case_versions', case_ids)
+
+    def _by_id(self, method, case_ids):
+        # เคสที่ไม่มีในไฟล์หลักต้องอยู่ใน archive -> ถามเฉพาะ id ที่ยังขาด
+        found = getattr(self.hot, method)(case_ids)
+        missing = [int(i) for i in case_ids if int(i) not in found]
+        for store in self._archived():
+            if not missing:
+                break
+            found.update(getattr(store, method)(missing))
+            missing = [i for i in missing if i not in found]
+        return found
+
+    def iter_complaints(self, after_id=0, chunksize=5000):
+        # Case_ID ไม่ซ้ำข้ามไฟล์ (AUTOINCREMENT ของไฟล์หลัก) -> merge ตาม Case_ID ได้เลย
+        streams = [(row for chunk in store.iter_complaints(after_id, chunksize) for row in chunk)
+                   for store in [self.hot] + self._archived()]
+        chunk = []
+        for row in heapq.merge(*streams):
+            chunk.append(row)
+            if len(chunk) == chunksize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    # ==========================================
+    # whole-table reads: archive (oldest month first) then hot
+    # ==========================================
+    def iter_cases(self, date_from=None, date_to=None, departments=None, statuses=None, chunksize=5000):
+        for store in reversed(self._archived()):
+            yield from store.iter_cases(date_from, date_to, departments, statuses, chunksize)
+        yield from self.hot.iter_cases(date_from, date_to, departments, statuses, chunksize)
+
+    def all_cases(self):
+        frames = [store.all_cases() for store in reversed(self._archived())] + [self.hot.all_cases()]
+        return pd.concat(frames, ignore_index=True)
+
+    def dashboard_stats(self):
+        return aggregates.combine([self.hot.dashboard_stats()] + [s.dashboard_stats() for s in self._archived()])
+
+    def data_version(self):
+        # ทุกไฟล์นับ version ของตัวเองขึ้นอย่างเดียว -> ผลรวมก็ขึ้นอย่างเดียว ใช้เป็น cache key ได้
+        return self.hot.data_version() + sum(store.data_version() for store in self._archived())
+
+    def clear(self, partition=None):
+        """Clear one partition (``'hot'`` or ``'YYYY-MM'``), or everything when ``partition`` is None."""
+        if partition in (None, HOT):
+            self.hot.clear()
+        for month in self.months():
+            if partition in (None, month):
+                self.partition(month).clear()
+
+
+def main(argv=None):
+    from smart_claim.store import open_store
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='tracking_db_v4_mcs.db')
+    parser.add_argument('--dir', default=ARCHIVE_DIR)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    r = sub.add_parser('run', help="move old closed cases into monthly partitions")
+    r.add_argument('--days', type=int, default=RETENTION_DAYS)
+    sub.add_parser('list', help="case counts of the hot store and every partition")
+    c = sub.add_parser('clear', help="delete every case of one partition ('hot' or YYYY-MM)")
+    c.add_argument('partition')
+    args = parser.parse_args(argv)
+
+    store = open_store(args.db, archive_dir=args.dir)
+    if args.cmd == 'run':
+        moved = store.archive_closed(args.days)
+        for month, n in moved.items():
+            print(f"{month}: moved {n:,} cases")
+        print(f"archived {sum(moved.values()):,} cases closed more than {args.days} days ago")
+    elif args.cmd == 'list':
+        print(f"{HOT:<8} {store.hot.dashboard_stats()['total']:>8,}")
+        for month in store.months():
+            print(f"{month:<8} {store.partition(month).dashboard_stats()['total']:>8,}")
+    elif args.cmd == 'clear':
+        if args.partition != HOT and args.partition not in store.months():
+            parser.error(f"no partition {args.partition!r}")
+        store.clear(args.partition)
+        print(f"cleared {args.partition}")
+
+
+if __name__ == '__main__':
+    main()
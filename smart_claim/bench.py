@@ -0,0 +1,431 @@
+"""Benchmarks and stress checks for the Smart Claim storage layer and the app pages.
+
+    python -m smart_claim.bench writes --cases 200 --updates 5000 --threads 32
+    python -m smart_claim.bench tasks --sizes 100 1000 10000
+    python -m smart_claim.bench export --sizes 10000 100000 --format xlsx
+    python -m smart_claim.bench reads --cases 10000 --sessions 30 --reads 20
+    python -m smart_claim.bench similar --cases 100000
+    python -m smart_claim.bench snapshot --sizes 10000 100000
+    python -m smart_claim.bench reports --cases 5000 --workers 1 4
+    python -m smart_claim.bench startup --budget 3000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from smart_claim.store import open_store
+from smart_claim.writer import WriteCoordinator
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+PAGE = os.path.join(ROOT, 'pages', 'NS-SUS Smart Claim & Tracking.py')
+# โมดูลหนักที่ไม่ควรถูก import ตอนเปิดหน้าครั้งแรก (ถ้าโผล่มาแปลว่ามีคนเผลอ import ไว้บนสุดของไฟล์)
+HEAVY_MODULES = ['sklearn', 'scipy', 'pyarrow', 'google.generativeai', 'PIL', 'xlsxwriter', 'openpyxl']
+
+
+def _record(lot_id, dept='QC'):
+    return {
+        'Lot_ID': lot_id, 'Date': '2026-01-01 08:00', 'Complaint': 'สนิมขึ้นที่ขอบเหล็ก',
+        'Department': dept, 'Status': f"Assigned to {dept}", 'Estimated_Days': 5,
+        'Current_Handler': dept, 'Final_Decision': "", 'Resolution_Note': "",
+    }
+
+
+def stress_writes(cases, updates, threads):
+    """Fire ``updates`` concurrent status updates and check none of them were lost."""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = open_store(os.path.join(tmp, 'bench.db'))
+        writer = WriteCoordinator(store)
+        for i in range(cases):
+            writer.insert_case(_record(f"LOT-{i:05d}"))
+
+        errors = []
+
+        def worker(tid):
+            futures = [
+                writer.submit('update_case', f"LOT-{n % cases:05d}", {'Status': 'Investigation Complete'},
+                              event={'Timestamp': '2026-01-02 09:00', 'Actor': 'QC',
+                                     'Action': 'forwarded', 'Note': f"upd-{n}"})
+                for n in range(tid, updates, threads)
+            ]
+            for fut in futures:
+                try:
+                    if not fut.result(60):
+                        errors.append('missing row')
+                except Exception as e:
+                    errors.append(repr(e))
+
+        t0 = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - t0
+        writer.close()
+
+        seen = set()
+        for i in range(cases):
+            seen.update(ev['Note'] for ev in store.case_history(store.get_case(f"LOT-{i:05d}")['Case_ID']))
+        lost = updates - len(seen & {f"upd-{n}" for n in range(updates)})
+
+        print(f"{updates} updates from {threads} threads in {elapsed:.2f}s "
+              f"({updates / elapsed:,.0f} writes/s, {writer.batches} commits)")
+        print(f"errors: {len(errors)}  lost updates: {lost}")
+        return lost == 0 and not errors
+
+
+def _ms(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat * 1000
+
+
+def task_rerun_latency(sizes, repeat=5):
+    """Action Center cost per rerun as the open backlog grows.
+
+    ``card`` is the data work of one card fragment rerun (its case row plus the
+    counters), ``page`` is one page of the task list and ``full`` is a complete
+    script run of the page as MCS (every open case visible) through AppTest.
+    """
+    from streamlit.testing.v1 import AppTest
+    import streamlit as st
+
+    page_path = os.path.abspath(PAGE)
+    cwd = os.getcwd()
+    print(f"{'backlog':>8} {'cards':>6} {'card ms':>8} {'page ms':>8} {'full ms':>8}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                store = open_store('tracking_db_v4_mcs.db')
+                depts = ['QC', 'QA', 'MCS']
+                records = [dict(_record(f"LOT-{i:05d}", depts[i % 3]), Date=f"2026-01-{1 + i % 28:02d} 08:00")
+                           for i in range(size)]
+                store.insert_cases(records)
+                lot = records[-1]['Lot_ID']
+
+                page_ms = _ms(lambda: store.task_page(limit=20), repeat)
+                card_ms = _ms(lambda: (store.get_case(lot), store.dashboard_stats()), repeat)
+
+                st.cache_resource.clear()
+                at = AppTest.from_file(page_path, default_timeout=300).run()
+                [s for s in at.selectbox if s.label == "Login As:"][0].set_value("MCS").run()
+                full_ms = _ms(at.run, repeat)
+                cards = sum(1 for b in at.button if b.label == "⚠️ Force Re-assign")
+                if at.exception:
+                    print(f"  page raised: {at.exception[0].value}")
+            finally:
+                os.chdir(cwd)
+        print(f"{size:>8,} {cards:>6} {card_ms:>8.2f} {page_ms:>8.2f} {full_ms:>8.1f}")
+
+
+def export_memory(sizes, fmt):
+    """Peak Python heap while exporting ``size`` cases (should not grow with size)."""
+    import tracemalloc
+    from smart_claim.export import export
+
+    print(f"{'cases':>8} {'format':>6} {'seconds':>8} {'peak MB':>8} {'file MB':>8} {'cached s':>8}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = open_store(os.path.join(tmp, 'bench.db'))
+            for start in range(0, size, 20000):
+                store.insert_cases([dict(_record(f"LOT-{i:07d}"), Date=f"20{20 + i % 6}-{1 + i % 12:02d}-01 08:00")
+                                    for i in range(start, min(size, start + 20000))])
+            out = os.path.join(tmp, 'exports')
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            path = export(store, fmt, export_dir=out)
+            elapsed = time.perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            t0 = time.perf_counter()
+            export(store, fmt, export_dir=out)
+            cached = time.perf_counter() - t0
+            print(f"{size:>8,} {fmt:>6} {elapsed:>8.2f} {peak / 2**20:>8.1f} "
+                  f"{os.path.getsize(path) / 2**20:>8.1f} {cached:>8.4f}")
+
+
+def read_latency(cases, sessions, reads, write_every):
+    """Full-table read latency from ``sessions`` threads, straight from SQLite vs. the shared cache."""
+    from smart_claim.cache import ReadCache
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = open_store(os.path.join(tmp, 'bench.db'))
+        store.insert_cases([_record(f"LOT-{i:06d}") for i in range(cases)])
+        cache = ReadCache(store)
+        modes = {'sqlite': store.all_cases, 'cache': lambda: cache.get('all_cases', store.all_cases)}
+
+        print(f"{'mode':>7} {'reads':>6} {'mean ms':>8} {'p95 ms':>8} {'reads/s':>8}")
+        for mode, read in modes.items():
+            latencies = []
+            lock = threading.Lock()
+            counter = [0]
+
+            def session():
+                mine = []
+                for _ in range(reads):
+                    with lock:
+                        counter[0] += 1
+                        n = counter[0]
+                    if write_every and n % write_every == 0:
+                        store.update_case("LOT-000000", {'Status': f"touch {n}"})
+                    t0 = time.perf_counter()
+                    read()
+                    mine.append(time.perf_counter() - t0)
+                with lock:
+                    latencies.extend(mine)
+
+            t0 = time.perf_counter()
+            pool = [threading.Thread(target=session) for _ in range(sessions)]
+            for t in pool:
+                t.start()
+            for t in pool:
+                t.join()
+            elapsed = time.perf_counter() - t0
+            latencies.sort()
+            mean = sum(latencies) / len(latencies)
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            print(f"{mode:>7} {len(latencies):>6} {mean * 1000:>8.2f} {p95 * 1000:>8.2f} "
+                  f"{len(latencies) / elapsed:>8,.0f}")
+        print(f"cache: {cache.stats()}")
+
+
+def _complaints(n, seed=7):
+    """Synthetic complaint texts: seed phrases with product/size/customer variations."""
+    import random
+    from smart_claim.routing import TRAINING_DATA
+
+    rng = random.Random(seed)
+    phrases = list(TRAINING_DATA['text'])
+    grades = ['SUS304', 'SUS316L', 'SUS430', 'SUS201', 'SUS409L']
+    forms = ['แผ่น', 'คอยล์', 'ท่อ', 'เส้น', 'ม้วน']
+    extras = ['ลูกค้าแจ้งด่วน', 'พบตอนรับของ', 'พบหลังตัด', 'ทั้งล็อต', 'บางม้วน', 'ขอเคลมเต็มจำนวน', '']
+    return [f"{rng.choice(phrases)} {rng.choice(forms)} {rng.choice(grades)} หนา {rng.choice([0.5, 0.8, 1.0, 1.2, 2.0, 3.0])} มม. "
+            f"{rng.choice(extras)} ลูกค้า C{rng.randrange(400):03d}" for _ in range(n)]
+
+
+def similar_latency(cases, queries, threshold):
+    """Build time, top-5 query latency and batch dedup time of the similar-complaint index."""
+    from smart_claim.similar import SimilarityIndex, find_duplicates
+
+    texts = _complaints(cases)
+    index = SimilarityIndex()
+    t0 = time.perf_counter()
+    index.add(list(range(1, cases + 1)), texts)
+    print(f"indexed {cases:,} complaints in {time.perf_counter() - t0:.2f}s")
+
+    probe = _complaints(queries, seed=11)
+    latencies = []
+    for text in probe:
+        t0 = time.perf_counter()
+        index.query(text, k=5)
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+    print(f"top-5 query: p50 {latencies[len(latencies) // 2] * 1000:.2f}ms  "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.2f}ms")
+
+    t0 = time.perf_counter()
+    for i, text in enumerate(probe[:100]):
+        index.add([cases + 1 + i], [text])
+        index.query(text, k=5)
+    print(f"add + query (incremental): {(time.perf_counter() - t0) / 100 * 1000:.2f}ms per case")
+
+    t0 = time.perf_counter()
+    pairs = find_duplicates(index, threshold)
+    print(f"dedup (>= {threshold}): {len(pairs):,} pairs in {time.perf_counter() - t0:.2f}s")
+
+
+def _legacy_csv(path, n, seed=7):
+    """A ``tracking_db_*.csv`` in the old single-file layout (with Action_History text)."""
+    import random
+    import pandas as pd
+
+    rng = random.Random(seed)
+    depts = ['QC', 'QA', 'MCS']
+    rows = []
+    for i, text in enumerate(_complaints(n, seed)):
+        dept = rng.choice(depts)
+        closed = rng.random() < 0.6
+        day = f"20{20 + i % 6}-{1 + i % 12:02d}-{1 + i % 28:02d} {8 + i % 10:02d}:00"
+        rows.append({
+            'Lot_ID': f"LOT-{i:07d}", 'Date': day, 'Complaint': text, 'Department': dept,
+            'Status': 'Case Closed' if closed else rng.choice([f"Assigned to {dept}", 'Investigation Complete']),
+            'Estimated_Days': rng.choice([3, 5, 7]), 'Current_Handler': 'MCS' if closed else dept,
+            'Action_History': f"[{day}] Case Created -> {dept}" + (
+                f" || [{day}] {dept}: investigated || [{day}] MCS: Closed" if closed else ""),
+            'Final_Decision': rng.choice(['Accept', 'Reject']) if closed else "",
+            'Resolution_Note': "ชดเชยตามจำนวนที่เสียหาย" if closed else "",
+        })
+    pd.DataFrame(rows).to_csv(path, index=False)
+
+
+def snapshot_reads(sizes, repeat):
+    """Load time and frame memory: legacy CSV vs. SQLite vs. the Parquet snapshot (full / projected)."""
+    import pandas as pd
+    from smart_claim import snapshot
+    from smart_claim.store import CASE_COLUMNS
+
+    projected = ['Lot_ID', 'Date', 'Complaint', 'Department', 'Status', 'Current_Handler']
+    print(f"{'cases':>8} {'read':<26} {'ms':>9} {'MB':>8}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, 'tracking_db_v4_mcs.csv')
+            _legacy_csv(csv_path, size)
+            store = open_store(os.path.join(tmp, 'bench.db'))
+            store.import_csv(csv_path)
+            snap_dir = os.path.join(tmp, 'snapshots')
+            t0 = time.perf_counter()
+            snapshot.current(store, snap_dir)
+            print(f"{size:>8,} {'snapshot build':<26} {(time.perf_counter() - t0) * 1000:>9.1f} "
+                  f"{os.path.getsize(snapshot.current(store, snap_dir)) / 2**20:>8.1f}")
+            reads = {
+                'csv (pd.read_csv)': lambda: pd.read_csv(csv_path),
+                'sqlite all_cases': store.all_cases,
+                'parquet all columns': lambda: snapshot.read(store, snapshot_dir=snap_dir),
+                'parquet Operational Log': lambda: snapshot.read(store, projected, snapshot_dir=snap_dir),
+                'parquet closed only': lambda: snapshot.read(store, CASE_COLUMNS, [('Status', '==', 'Case Closed')],
+                                                             snapshot_dir=snap_dir),
+            }
+            for name, read in reads.items():
+                df = read()
+                ms = _ms(read, repeat)
+                print(f"{size:>8,} {name:<26} {ms:>9.1f} {df.memory_usage(deep=True).sum() / 2**20:>8.1f}")
+
+
+def report_batch(cases, workers, change):
+    """Month-end report ZIP: cold (everything rendered) vs. warm (only changed cases re-rendered)."""
+    import io
+    from smart_claim.reports import batch_zip
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = open_store(os.path.join(tmp, 'bench.db'))
+        texts = _complaints(cases)
+        records, events = [], []
+        for i, text in enumerate(texts):
+            day = f"2026-09-{1 + i % 28:02d}"
+            records.append(dict(_record(f"LOT-{i:06d}"), Date=f"{day} 08:00", Complaint=text, Status='Case Closed',
+                                Current_Handler='MCS', Final_Decision='Accept', Closed_At=f"{day} 17:00",
+                                Resolution_Note="ชดเชยตามจำนวนที่เสียหาย"))
+            events.append({'Timestamp': f"{day} 08:00", 'Actor': 'AI', 'Action': 'created', 'Note': "Case Created"})
+        store.insert_cases(records, events)
+        print(f"{'workers':>7} {'run':<6} {'cases':>7} {'rendered':>9} {'seconds':>8} {'zip MB':>7}")
+        for n in workers:
+            report_dir = os.path.join(tmp, f"reports_{n}")
+            runs = [('cold', None), ('warm', None), ('edited', change)]
+            for name, edits in runs:
+                for lot in range(edits or 0):
+                    store.update_case(f"LOT-{lot:06d}", {'Resolution_Note': f"แก้ไขครั้งที่ {name}"})
+                buf = io.BytesIO()
+                t0 = time.perf_counter()
+                stats = batch_zip(store, buf, '2026-09-01', '2026-09-30', summary=True, report_dir=report_dir, workers=n)
+                elapsed = time.perf_counter() - t0
+                print(f"{n:>7} {name:<6} {stats['cases']:>7,} {stats['rendered']:>9,} {elapsed:>8.2f} "
+                      f"{len(buf.getvalue()) / 2**20:>7.1f}")
+
+
+_FIRST_RENDER = """
+import sys, time, json
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+ready = time.perf_counter()
+before = set(sys.modules)
+at = AppTest.from_file(sys.argv[1], default_timeout=120).run()
+first = time.perf_counter()
+at.run()
+rerun = time.perf_counter()
+loaded = set(sys.modules) - before
+print(json.dumps({
+    'first_ms': (first - ready) * 1000, 'rerun_ms': (rerun - first) * 1000,
+    'errors': [str(e.value) for e in at.exception],
+    'heavy': sorted({m for m in json.loads(sys.argv[2]) if m in loaded}),
+}))
+"""
+
+
+def startup(pages, budget_ms):
+    """Time to first render of each page in a fresh interpreter (cold imports, empty data dir)."""
+    pages = pages or ['Home.py'] + sorted(os.path.join('pages', f) for f in os.listdir(os.path.join(ROOT, 'pages'))
+                                          if f.endswith('.py'))
+    print(f"{'page':<40} {'first ms':>9} {'rerun ms':>9}  heavy imports")
+    over = []
+    for page in pages:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+            out = subprocess.run([sys.executable, '-c', _FIRST_RENDER, os.path.join(ROOT, page), json.dumps(HEAVY_MODULES)],
+                                 cwd=tmp, env=env, capture_output=True, text=True, timeout=600)
+        if out.returncode != 0:
+            print(f"{page:<40} failed:\n{out.stderr[-2000:]}")
+            over.append(page)
+            continue
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{page:<40} {r['first_ms']:>9.0f} {r['rerun_ms']:>9.0f}  {', '.join(r['heavy']) or '-'}")
+        for err in r['errors']:
+            print(f"    page raised: {err}")
+        if r['errors'] or (budget_ms and r['first_ms'] > budget_ms):
+            over.append(page)
+    if over:
+        print(f"over budget / failing: {', '.join(over)}")
+    return not over
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    w = sub.add_parser('writes', help="concurrent update stress test through the write coordinator")
+    w.add_argument('--cases', type=int, default=200)
+    w.add_argument('--updates', type=int, default=5000)
+    w.add_argument('--threads', type=int, default=32)
+    t = sub.add_parser('tasks', help="Action Center rerun latency vs. open backlog size")
+    t.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    t.add_argument('--repeat', type=int, default=5)
+    e = sub.add_parser('export', help="peak memory of a full-table export vs. table size")
+    e.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    e.add_argument('--format', choices=['csv', 'xlsx'], default='xlsx')
+    r = sub.add_parser('reads', help="full-table read latency with and without the shared read cache")
+    r.add_argument('--cases', type=int, default=10000)
+    r.add_argument('--sessions', type=int, default=30)
+    r.add_argument('--reads', type=int, default=20)
+    r.add_argument('--write-every', type=int, default=0, help="one case update per N reads (0 = read only)")
+    m = sub.add_parser('similar', help="similar-complaint index: build, query and dedup timings")
+    m.add_argument('--cases', type=int, default=100000)
+    m.add_argument('--queries', type=int, default=200)
+    m.add_argument('--threshold', type=float, default=0.95)
+    n = sub.add_parser('snapshot', help="case-table load time and memory: CSV vs. SQLite vs. Parquet snapshot")
+    n.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    n.add_argument('--repeat', type=int, default=3)
+    b = sub.add_parser('reports', help="batch resolution-report ZIP, cold vs. cached")
+    b.add_argument('--cases', type=int, default=5000)
+    b.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    b.add_argument('--change', type=int, default=50, help="cases edited before the last run")
+    s = sub.add_parser('startup', help="time to first render of Home.py and every page (fresh process each)")
+    s.add_argument('pages', nargs='*', help="paths relative to the repo root (default: all)")
+    s.add_argument('--budget', type=float, default=0, help="fail when a first render takes longer (ms)")
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'writes':
+        ok = stress_writes(args.cases, args.updates, args.threads)
+        raise SystemExit(0 if ok else 1)
+    elif args.cmd == 'tasks':
+        task_rerun_latency(args.sizes, args.repeat)
+    elif args.cmd == 'export':
+        export_memory(args.sizes, args.format)
+    elif args.cmd == 'reads':
+        read_latency(args.cases, args.sessions, args.reads, args.write_every)
+    elif args.cmd == 'similar':
+        similar_latency(args.cases, args.queries, args.threshold)
+    elif args.cmd == 'snapshot':
+        snapshot_reads(args.sizes, args.repeat)
+    elif args.cmd == 'reports':
+        report_batch(args.cases, args.workers, args.change)
+    elif args.cmd == 'startup':
+        raise SystemExit(0 if startup(args.pages, args.budget) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Process-wide read cache for case data, keyed by the store's data version.
+
+Every Streamlit session in the process shares one ``ReadCache``. A read first
+asks the store for its ``data_version`` (one indexed row); when it matches the
+version the entry was loaded at, the cached value is returned, otherwise it is
+reloaded once -- concurrent sessions asking for the same stale entry wait for
+that single load instead of all hitting the database. Writes bump the version,
+so there is nothing to invalidate by hand.
+
+DataFrames come back as shallow copies. pandas >= 3 (pinned in
+requirements.txt) always copies on write, so any change a caller makes lands
+in its own copy and the shared frame cannot be corrupted; on pandas 2 a shallow
+copy would share its data with every other session.
+"""
+import threading
+
+import pandas as pd
+
+
+class ReadCache:
+    def __init__(self, store):
+        self.store = store
+        self._entries = {}   # name -> (version, value)
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key_lock(self, name):
+        with self._lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name, loader, may_lag=False):
+        """Value of ``loader()`` for the current data version, loading it at most once.
+
+        With ``may_lag`` the loader returns ``(value, up_to_date)``. A value that is behind the
+        store (a snapshot still being rebuilt) is served but loaded again on the next read.
+        """
+        version = self.store.data_version()
+        entry = self._entries.get(name)
+        # < : only older entries reload; a session that read the version just before a write may be served the newer entry, never an older one
+        if entry is None or entry[0] < version:
+            with self._key_lock(name):
+                entry = self._entries.get(name)
+                if entry is None or entry[0] < version:
+                    self.misses += 1
+                    if may_lag:
+                        value, up_to_date = loader()
+                        entry = (version if up_to_date else -1, value)
+                    else:
+                        entry = (version, loader())
+                    self._entries[name] = entry
+                    return _frozen(entry[1])
+        self.hits += 1
+        return _frozen(entry[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': len(self._entries),
+        }
+
+
+def _frozen(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    return value
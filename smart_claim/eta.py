@@ -0,0 +1,186 @@
+"""Data-driven Estimated_Days from real case durations.
+
+Resolution time (creation -> closure) is modelled as log-normal per group:
+``all``, ``dept:<Department>`` and ``cluster:<Cluster>``. A complaint's cluster
+is the nearest seed phrase of the router's training set (hashed char n-grams,
+cosine), so clusters stay stable without any re-clustering.
+
+The per-group log-duration mean/variance live in ``eta_stats``. ``rebuild`` fits
+them from history in one vectorized pandas pass; afterwards ``apply_close``
+folds each newly closed case in (Welford) inside the closing transaction.
+
+    python -m smart_claim.eta fit
+    python -m smart_claim.eta show
+"""
+import math
+import argparse
+import threading
+
+import numpy as np
+import pandas as pd
+
+from smart_claim.aggregates import CLOSED_STATUS
+from smart_claim.intake import ESTIMATED_DAYS, DEFAULT_DAYS
+
+MIN_SAMPLES = 5          # จำนวนเคสขั้นต่ำก่อนจะเชื่อสถิติของกลุ่มนั้น
+BAND_Z = 1.2816          # ช่วง 10%-90%
+_MIN_HOURS = 1.0
+
+_seed_lock = threading.Lock()
+_seed = None
+
+
+def _seed_matrix():
+    global _seed
+    if _seed is None:
+        with _seed_lock:
+            if _seed is None:
+                from sklearn.feature_extraction.text import HashingVectorizer
+                from smart_claim.routing import TRAINING_DATA
+                vec = HashingVectorizer(analyzer='char_wb', ngram_range=(1, 3), n_features=2 ** 18,
+                                        alternate_sign=False, norm='l2')
+                _seed = (vec, vec.transform(TRAINING_DATA['text']).T.tocsr())
+    return _seed
+
+
+def complaint_clusters(texts):
+    """Cluster key (``c00``..) per complaint: the most similar seed phrase."""
+    texts = ['' if t is None else str(t) for t in texts]
+    if not texts:
+        return []
+    vec, seeds_t = _seed_matrix()
+    sims = (vec.transform(texts) @ seeds_t).toarray()
+    return [f"c{i:02d}" for i in sims.argmax(axis=1)]
+
+
+def create_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS eta_stats (
+            Group_Key TEXT PRIMARY KEY,
+            N INTEGER NOT NULL,
+            Mean_Log REAL NOT NULL,
+            M2_Log REAL NOT NULL
+        )
+    """)
+
+
+def _groups(department, cluster):
+    keys = ['all']
+    if department:
+        keys.append(f"dept:{department}")
+    if cluster:
+        keys.append(f"cluster:{cluster}")
+    return keys
+
+
+def apply_close(conn, row):
+    """Fold one newly closed case into its groups (caller owns the transaction)."""
+    if not row.get('Date') or not row.get('Closed_At'):
+        return
+    hours = conn.execute("SELECT (julianday(?) - julianday(?)) * 24.0", (row['Closed_At'], row['Date'])).fetchone()[0]
+    if hours is None:
+        return
+    x = math.log(max(hours, _MIN_HOURS) / 24.0)
+    cluster = row.get('Cluster')
+    if not cluster:
+        # เคสที่สร้างก่อนมี Cluster: จัดกลุ่มตอนปิดแล้วเก็บไว้เลย
+        cluster = complaint_clusters([row.get('Complaint')])[0]
+        conn.execute("UPDATE cases SET Cluster = ? WHERE Case_ID = ?", (cluster, row['Case_ID']))
+    for key in _groups(row.get('Department'), cluster):
+        found = conn.execute("SELECT N, Mean_Log, M2_Log FROM eta_stats WHERE Group_Key = ?", (key,)).fetchone()
+        n, mean, m2 = tuple(found) if found else (0, 0.0, 0.0)
+        n += 1
+        delta = x - mean
+        mean += delta / n
+        m2 += delta * (x - mean)
+        conn.execute("INSERT OR REPLACE INTO eta_stats (Group_Key, N, Mean_Log, M2_Log) VALUES (?, ?, ?, ?)",
+                     (key, n, mean, m2))
+
+
+def rebuild(conn):
+    """Fit every group from the closed-case history in one pass."""
+    df = pd.read_sql_query(
+        "SELECT rowid AS rid, Department, Complaint, Cluster, "
+        "(julianday(Closed_At) - julianday(Date)) * 24.0 AS Hours "
+        "FROM cases WHERE Status = ? AND Closed_At IS NOT NULL", conn, params=(CLOSED_STATUS,))
+    missing = df['Cluster'].isna()
+    if missing.any():
+        df.loc[missing, 'Cluster'] = complaint_clusters(df.loc[missing, 'Complaint'].tolist())
+        conn.executemany("UPDATE cases SET Cluster = ? WHERE rowid = ?",
+                         df.loc[missing, ['Cluster', 'rid']].itertuples(index=False, name=None))
+    df = df[df['Hours'].notna()]
+    x = np.log(np.maximum(df['Hours'].to_numpy(dtype=float), _MIN_HOURS) / 24.0)
+    long = pd.concat([
+        pd.DataFrame({'Group_Key': 'all', 'x': x}),
+        pd.DataFrame({'Group_Key': 'dept:' + df['Department'].astype(str).to_numpy(), 'x': x}),
+        pd.DataFrame({'Group_Key': 'cluster:' + df['Cluster'].astype(str).to_numpy(), 'x': x}),
+    ])
+    stats = long.groupby('Group_Key')['x'].agg(['size', 'mean', 'var'])
+    stats['m2'] = stats['var'].fillna(0.0) * (stats['size'] - 1)
+    conn.execute("DELETE FROM eta_stats")
+    conn.executemany("INSERT INTO eta_stats (Group_Key, N, Mean_Log, M2_Log) VALUES (?, ?, ?, ?)",
+                     [(k, int(n), float(m), float(m2)) for k, n, m, m2 in
+                      stats[['size', 'mean', 'm2']].itertuples(name=None)])
+    return len(df)
+
+
+class EtaModel:
+    """Snapshot of ``eta_stats`` (a few dozen rows) used to predict ETAs."""
+
+    def __init__(self, rows):
+        self.stats = {key: (n, mean, m2) for key, n, mean, m2 in rows}
+
+    @classmethod
+    def from_conn(cls, conn):
+        return cls(conn.execute("SELECT Group_Key, N, Mean_Log, M2_Log FROM eta_stats").fetchall())
+
+    def predict(self, department, cluster=None):
+        """``{'days', 'low', 'high', 'n', 'basis'}``; falls back to the fixed rule."""
+        for key in reversed(_groups(department, cluster)):  # cluster -> dept -> all
+            n, mean, m2 = self.stats.get(key, (0, 0.0, 0.0))
+            if n >= MIN_SAMPLES:
+                sd = math.sqrt(m2 / (n - 1)) if n > 1 else 0.0
+                return {
+                    'days': math.exp(mean),
+                    'low': math.exp(mean - BAND_Z * sd),
+                    'high': math.exp(mean + BAND_Z * sd),
+                    'n': n,
+                    'basis': key,
+                }
+        days = ESTIMATED_DAYS.get(department, DEFAULT_DAYS)
+        return {'days': float(days), 'low': None, 'high': None, 'n': 0, 'basis': 'rule'}
+
+    def estimated_days(self, departments, clusters):
+        """Whole days (median, rounded up) for many cases at once."""
+        cache = {}
+        out = []
+        for dept, cluster in zip(departments, clusters):
+            if (dept, cluster) not in cache:
+                cache[(dept, cluster)] = max(1, math.ceil(self.predict(dept, cluster)['days']))
+            out.append(cache[(dept, cluster)])
+        return out
+
+
+def main(argv=None):
+    from smart_claim.store import open_store
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='tracking_db_v4_mcs.db')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('fit', help="refit every group from the closed-case history")
+    sub.add_parser('show', help="print the fitted groups")
+    args = parser.parse_args(argv)
+
+    store = open_store(args.db)
+    if args.cmd == 'fit':
+        print(f"fitted on {store.refit_eta()} closed cases")
+    model = store.eta_model()
+    for key in sorted(model.stats):
+        n, mean, m2 = model.stats[key]
+        sd = math.sqrt(m2 / (n - 1)) if n > 1 else 0.0
+        print(f"{key:<16} n={n:<6} median={math.exp(mean):6.2f}d  "
+              f"band={math.exp(mean - BAND_Z * sd):.2f}-{math.exp(mean + BAND_Z * sd):.2f}d")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Filtered CSV/XLSX export of the case table.
+
+Rows are streamed from the store in chunks straight into the output file
+(XlsxWriter runs in ``constant_memory`` mode), so a multi-year export never
+holds the whole table in memory. Finished files are kept under ``exports/``
+keyed by the store's data version plus the filters, so asking for the same
+export again before anything changes is just a file read.
+
+    python -m smart_claim.export --format xlsx --from 2026-01-01 --dept QC -o qc.xlsx
+"""
+import os
+import json
+import shutil
+import hashlib
+import argparse
+
+import pandas as pd
+
+from smart_claim.store import CASE_COLUMNS
+
+EXPORT_DIR = 'exports'
+MAX_CACHED = 20
+CHUNKSIZE = 5000
+FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# คอลัมน์ที่เขียนลง Excel เป็นชนิดจริง (ไม่ใช่ข้อความ)
+_DATETIME_COLUMNS = {'Date', 'Closed_At'}
+_NUMBER_COLUMNS = {'Case_ID', 'Estimated_Days'}
+_COLUMN_WIDTHS = {'Lot_ID': 18, 'Date': 17, 'Complaint': 48, 'Status': 24, 'Closed_At': 17,
+                  'Final_Decision': 14, 'Resolution_Note': 40}
+
+
+def _filters(date_from=None, date_to=None, departments=None, statuses=None):
+    return {
+        'date_from': str(date_from) if date_from else None,
+        'date_to': str(date_to) if date_to else None,
+        'departments': sorted(departments or []),
+        'statuses': sorted(statuses or []),
+    }
+
+
+def cache_key(version, fmt, filters):
+    blob = json.dumps([version, fmt, filters], sort_keys=True)
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()[:16]
+
+
+def write_csv(chunks, path):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        header = True
+        for chunk in chunks:
+            chunk.to_csv(f, index=False, header=header)
+            header = False
+        if header:
+            f.write(','.join(CASE_COLUMNS) + '\n')
+
+
+def write_xlsx(chunks, path):
+    import xlsxwriter
+
+    # constant_memory: XlsxWriter flush ทีละแถวลงไฟล์ชั่วคราว หน่วยความจำไม่โตตามจำนวนแถว
+    wb = xlsxwriter.Workbook(path, {'constant_memory': True})
+    try:
+        ws = wb.add_worksheet('Cases')
+        bold = wb.add_format({'bold': True})
+        when = wb.add_format({'num_format': 'yyyy-mm-dd hh:mm'})
+        for c, col in enumerate(CASE_COLUMNS):
+            ws.set_column(c, c, _COLUMN_WIDTHS.get(col, 12))
+            ws.write_string(0, c, col, bold)
+        ws.freeze_panes(1, 0)
+        r = 0
+        for chunk in chunks:
+            for col in _DATETIME_COLUMNS:
+                chunk[col] = pd.to_datetime(chunk[col], format='%Y-%m-%d %H:%M', errors='coerce')
+            for rec in chunk[CASE_COLUMNS].itertuples(index=False, name=None):
+                r += 1
+                for c, (col, v) in enumerate(zip(CASE_COLUMNS, rec)):
+                    if v is None or (not isinstance(v, str) and pd.isna(v)):
+                        continue
+                    if col in _DATETIME_COLUMNS:
+                        ws.write_datetime(r, c, v.to_pydatetime(), when)
+                    elif col in _NUMBER_COLUMNS:
+                        ws.write_number(r, c, float(v))
+                    else:
+                        ws.write_string(r, c, str(v))
+        if r:
+            ws.autofilter(0, 0, r, len(CASE_COLUMNS) - 1)
+    finally:
+        wb.close()
+
+
+_WRITERS = {'csv': write_csv, 'xlsx': write_xlsx}
+
+
+def _prune(export_dir, keep):
+    files = sorted((os.path.join(export_dir, f) for f in os.listdir(export_dir) if not f.startswith('.')),
+                   key=os.path.getmtime, reverse=True)
+    for path in files[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def export(store, fmt='csv', date_from=None, date_to=None, departments=None, statuses=None,
+           export_dir=EXPORT_DIR, chunksize=CHUNKSIZE):
+    """Write (or reuse) the export for these filters; returns the file path."""
+    if fmt not in _WRITERS:
+        raise ValueError(f"unknown export format {fmt!r} (use one of {', '.join(_WRITERS)})")
+    filters = _filters(date_from, date_to, departments, statuses)
+    os.makedirs(export_dir, exist_ok=True)
+    path = os.path.join(export_dir, f"cases_{cache_key(store.data_version(), fmt, filters)}.{fmt}")
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+    tmp = os.path.join(export_dir, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    try:
+        _WRITERS[fmt](store.iter_cases(chunksize=chunksize, **{k: v or None for k, v in filters.items()}), tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    _prune(export_dir, MAX_CACHED)
+    return path
+
+
+def main(argv=None):
+    from smart_claim.store import open_store
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='tracking_db_v4_mcs.db')
+    parser.add_argument('--format', choices=list(FORMATS), default='csv')
+    parser.add_argument('--from', dest='date_from', help="YYYY-MM-DD (inclusive)")
+    parser.add_argument('--to', dest='date_to', help="YYYY-MM-DD (inclusive)")
+    parser.add_argument('--dept', action='append', help="repeatable")
+    parser.add_argument('--status', action='append', help="repeatable")
+    parser.add_argument('-o', '--output', required=True)
+    args = parser.parse_args(argv)
+
+    store = open_store(args.db)
+    path = export(store, args.format, args.date_from, args.date_to, args.dept, args.status)
+    shutil.copyfile(path, args.output)
+    print(f"wrote {args.output} ({os.path.getsize(args.output):,} bytes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""Bulk claim intake from CSV/XLSX.
+
+The file is read in chunks (pandas for CSV, openpyxl read-only mode for XLSX),
+each chunk is routed with one ``predict`` call and written with one store
+operation, so a distributor spreadsheet of thousands of complaints never has
+to be held in memory or written row by row.
+
+    python -m smart_claim.intake complaints.xlsx --chunksize 2000
+"""
+import re
+import time
+import argparse
+from datetime import datetime
+
+import pandas as pd
+
+# วันโดยประมาณตามแผนกที่ AI assign ให้ (กติกาเดิมของหน้า Submit & Log)
+ESTIMATED_DAYS = {'QA': 1, 'MCS': 2, 'QC': 5}
+DEFAULT_DAYS = 3
+
+# ชื่อหัวคอลัมน์ที่รับได้ (เทียบแบบตัดช่องว่าง/สัญลักษณ์และตัวพิมพ์เล็ก)
+COLUMN_ALIASES = {
+    'Lot_ID': ['lotid', 'lotno', 'lot', 'lotnumber'],
+    'Complaint': ['complaint', 'issue', 'issuecomplaint', 'description', 'problem'],
+}
+
+
+def estimated_days(departments):
+    return pd.Series(departments, dtype=object).map(ESTIMATED_DAYS).fillna(DEFAULT_DAYS).astype(int)
+
+
+def _normalize(name):
+    return re.sub(r'[^0-9a-z]', '', str(name).lower())
+
+
+def _resolve_columns(columns):
+    lookup = {_normalize(c): c for c in columns}
+    resolved = {}
+    for target, aliases in COLUMN_ALIASES.items():
+        for alias in [_normalize(target)] + aliases:
+            if alias in lookup:
+                resolved[lookup[alias]] = target
+                break
+        else:
+            raise ValueError(f"missing a {target} column (got: {', '.join(map(str, columns))})")
+    return resolved
+
+
+def iter_chunks(source, filename, chunksize=1000):
+    """Yield DataFrames with ``Lot_ID`` and ``Complaint`` columns (as str)."""
+    if str(filename).lower().endswith(('.xlsx', '.xlsm')):
+        from openpyxl import load_workbook
+        wb = load_workbook(source, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            mapping = _resolve_columns(header)
+            keep = [i for i, name in enumerate(header) if name in mapping]
+            names = [mapping[header[i]] for i in keep]
+            buf = []
+            for row in rows:
+                buf.append([row[i] if i < len(row) else None for i in keep])
+                if len(buf) >= chunksize:
+                    yield pd.DataFrame(buf, columns=names, dtype=object)
+                    buf = []
+            if buf:
+                yield pd.DataFrame(buf, columns=names, dtype=object)
+        finally:
+            wb.close()
+    else:
+        reader = pd.read_csv(source, chunksize=chunksize, dtype=str, encoding='utf-8-sig', keep_default_na=False)
+        mapping = None
+        for chunk in reader:
+            if mapping is None:
+                mapping = _resolve_columns(chunk.columns)
+            yield chunk[list(mapping)].rename(columns=mapping)
+
+
+class IntakeReport:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.chunks = 0
+        self.rejected = []  # (row number in file, Lot_ID, reason)
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def rejected_frame(self):
+        return pd.DataFrame(self.rejected, columns=['Row', 'Lot_ID', 'Reason'])
+
+
+def ingest(source, filename, router, sink, chunksize=1000, on_chunk=None, eta_model=None):
+    """Route and insert every complaint in ``source``.
+
+    ``sink`` is anything with ``insert_cases(records, events)`` returning the Lot
+    IDs it skipped because they already exist (the store or the WriteCoordinator).
+    With an ``eta_model`` (``store.eta_model()``) Estimated_Days comes from real
+    resolution times instead of the fixed per-department rule.
+    """
+    from smart_claim.eta import complaint_clusters
+
+    report = IntakeReport()
+    seen = set()
+    t0 = time.perf_counter()
+    first_row = 2  # แถวที่ 1 คือหัวตาราง
+    for chunk in iter_chunks(source, filename, chunksize):
+        report.chunks += 1
+        report.rows += len(chunk)
+        rownums = range(first_row, first_row + len(chunk))
+        first_row += len(chunk)
+
+        lots = chunk['Lot_ID'].fillna('').astype(str).str.strip()
+        texts = chunk['Complaint'].fillna('').astype(str).str.strip()
+        keep = []
+        for rownum, lot, text in zip(rownums, lots, texts):
+            if not lot:
+                report.rejected.append((rownum, lot, "missing Lot ID"))
+            elif not text:
+                report.rejected.append((rownum, lot, "missing complaint"))
+            elif lot in seen:
+                report.rejected.append((rownum, lot, "duplicate Lot ID in file"))
+            else:
+                seen.add(lot)
+                keep.append((rownum, lot, text))
+        if keep:
+            chunk_texts = [text for _, _, text in keep]
+            depts = router.predict(chunk_texts)
+            clusters = complaint_clusters(chunk_texts)
+            if eta_model is None:
+                days = estimated_days(depts)
+            else:
+                days = eta_model.estimated_days([str(d) for d in depts], clusters)
+            now = datetime.now().strftime("%Y-%m-%d %H:%M")
+            records, events = [], []
+            for (_, lot, text), dept, cluster, d in zip(keep, depts, clusters, days):
+                records.append({
+                    'Lot_ID': lot, 'Date': now, 'Complaint': text, 'Department': str(dept),
+                    'Status': f"Assigned to {dept}", 'Estimated_Days': int(d), 'Current_Handler': str(dept),
+                    'Final_Decision': "", 'Resolution_Note': "", 'Cluster': cluster,
+                })
+                events.append({'Timestamp': now, 'Actor': "AI", 'Action': "created",
+                               'Note': f"Case Created -> AI Assigned to {dept} (bulk import)"})
+            skipped = set(sink.insert_cases(records, events))
+            for rownum, lot, _ in keep:
+                if lot in skipped:
+                    report.rejected.append((rownum, lot, "Lot ID already has an open case"))
+            report.inserted += len(keep) - len(skipped)
+        report.elapsed = time.perf_counter() - t0
+        if on_chunk:
+            on_chunk(report)
+    report.elapsed = time.perf_counter() - t0
+    return report
+
+
+def main(argv=None):
+    from smart_claim.store import open_store
+    from smart_claim.routing import ComplaintRouter
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path')
+    parser.add_argument('--db', default='tracking_db_v4_mcs.db')
+    parser.add_argument('--chunksize', type=int, default=1000)
+    parser.add_argument('--rejects', help="write the rejection list to this CSV")
+    args = parser.parse_args(argv)
+
+    store = open_store(args.db)
+    with open(args.path, 'rb') as f:
+        report = ingest(f, args.path, ComplaintRouter(), store, args.chunksize, eta_model=store.eta_model(),
+                        on_chunk=lambda r: print(f"  chunk {r.chunks}: {r.rows} rows read, {r.inserted} inserted"))
+    print(f"{report.inserted}/{report.rows} cases imported in {report.elapsed:.2f}s "
+          f"({report.rows_per_sec:,.0f} rows/s), {len(report.rejected)} rejected")
+    if args.rejects and report.rejected:
+        report.rejected_frame().to_csv(args.rejects, index=False)
+        print(f"rejections written to {args.rejects}")
+
+
+if __name__ == '__main__':
+    main()
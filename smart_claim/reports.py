@@ -0,0 +1,248 @@
+"""Customer resolution reports, one at a time or as a month-end ZIP.
+
+Rendered reports are kept under ``reports/``, one file per case headed by the
+``Row_Version`` it was rendered from. The store bumps a case's ``Row_Version``
+whenever the case or its history changes, so a cached report is reused exactly
+until something it shows has changed. Nothing in a report depends on when it
+was rendered: it is dated by the day the case was closed.
+
+A batch walks the closed cases of the period in chunks; each chunk (versions,
+histories, rendering, cache files) is handled by a worker thread and the
+finished reports are streamed into the ZIP as chunks complete, so memory stays
+at a few chunks whatever the size of the period.
+
+    python -m smart_claim.reports batch --from 2026-09-01 --to 2026-09-30 --summary -o september.zip
+"""
+import os
+import shutil
+import zipfile
+import argparse
+import tempfile
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from smart_claim.aggregates import CLOSED_STATUS
+
+REPORT_DIR = 'reports'
+RENDER_VERSION = 2  # เปลี่ยนรูปแบบรายงานแล้วเพิ่มเลขนี้ (ไฟล์ที่ render ด้วยรูปแบบเก่าจะถูก render ใหม่)
+WORKERS = 4
+CHUNKSIZE = 200
+SUMMARY_COLUMNS = ['Case_ID', 'Lot_ID', 'Date', 'Closed_At', 'Days_To_Close', 'Department', 'Complaint',
+                   'Final_Decision', 'Resolution_Note', 'Report_File']
+
+
+def render(case, history, issued=None):
+    """Text of the official resolution report for one case, dated ``issued`` or the day it was closed."""
+    # วันที่มาจากเคส ไม่ใช่วันที่ render: ไฟล์ใน cache ให้ผลเหมือน render ใหม่ทุกครั้ง
+    issued = issued or str(case.get('Closed_At') or case.get('Date') or '')[:10]
+    history_lines = '\n    - '.join(f"[{ev['Timestamp']}] {ev['Note']}" for ev in history)
+    report = f"""
+    =======================================================
+    OFFICIAL CLAIM RESOLUTION REPORT
+    NS-SUS SMART CLAIM TRACKING SYSTEM
+    =======================================================
+    Date: {issued}
+    Reference Lot ID: {case['Lot_ID']}
+    
+    -------------------------------------------------------
+    CASE INFORMATION
+    -------------------------------------------------------
+    Issue Reported: {case['Complaint']}
+    Date Reported: {case['Date']}
+    Responsible Department: {case['Department']}
+    
+    -------------------------------------------------------
+    INVESTIGATION & RESOLUTION
+    -------------------------------------------------------
+    Status: {case['Status']}
+    
+    FINAL DECISION: [{case['Final_Decision']}]
+    
+    NOTE TO CUSTOMER:
+    {case['Resolution_Note']}
+    
+    -------------------------------------------------------
+    ACTION HISTORY:
+    {history_lines}
+    
+    -------------------------------------------------------
+    Thank you for your trust in NS-SUS Quality Standards.
+    
+    Sincerely,
+    Marketing & Customer Service (MCS) Team
+    =======================================================
+    """
+    return report
+
+
+def file_name(case):
+    return f"Resolution_Report_{case['Lot_ID']}_{case['Case_ID']}.txt"
+
+
+class ReportCache:
+    def __init__(self, report_dir=REPORT_DIR):
+        self.report_dir = report_dir
+        os.makedirs(report_dir, exist_ok=True)
+
+    def _path(self, case_id):
+        # โฟลเดอร์ละ 1000 เคส; ไฟล์เดียวต่อเคส บรรทัดแรกคือ RENDER_VERSION:Row_Version ที่ใช้ render
+        return os.path.join(self.report_dir, str(int(case_id) // 1000), f"{int(case_id)}.txt")
+
+    def get(self, case_id, version):
+        try:
+            with open(self._path(case_id), encoding='utf-8') as f:
+                stored, text = f.read().split('\n', 1)
+        except (FileNotFoundError, ValueError):
+            return None
+        return text if stored == f"{RENDER_VERSION}:{int(version)}" else None
+
+    def put(self, case_id, version, text):
+        path = self._path(case_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(f"{RENDER_VERSION}:{int(version)}\n{text}")
+        os.replace(tmp, path)
+
+
+def _reports(store, cases, cache):
+    """``[(case, text, was_cached), ...]`` for a list of case dicts."""
+    ids = [c['Case_ID'] for c in cases]
+    versions = store.case_versions(ids)
+    texts = {i: cache.get(i, versions.get(i, 0)) for i in ids}
+    missing = [i for i in ids if texts[i] is None]
+    histories = store.case_histories(missing) if missing else {}
+    out = []
+    for case in cases:
+        case_id = case['Case_ID']
+        cached = texts[case_id] is not None
+        if not cached:
+            texts[case_id] = render(case, histories.get(case_id, []))
+            cache.put(case_id, versions.get(case_id, 0), texts[case_id])
+        out.append((case, texts[case_id], cached))
+    return out
+
+
+def report(store, case, cache):
+    """Report text for one case, rendered only if the case changed since the cached copy."""
+    return _reports(store, [case], cache)[0][1]
+
+
+def _closed_in(store, closed_from, closed_to, departments, chunksize):
+    """Chunks (lists of case dicts) of cases closed between the two dates (inclusive)."""
+    lo = str(closed_from) if closed_from else None
+    hi = (pd.Timestamp(closed_to) + pd.Timedelta(days=1)).strftime("%Y-%m-%d") if closed_to else None
+    for chunk in store.iter_cases(departments=departments, statuses=[CLOSED_STATUS], chunksize=chunksize):
+        closed_at = chunk['Closed_At'].fillna('')
+        keep = closed_at != ''
+        if lo:
+            keep &= closed_at >= lo
+        if hi:
+            keep &= closed_at < hi
+        if keep.any():
+            chunk = chunk[keep].astype(object).where(chunk[keep].notna(), None)
+            yield chunk.to_dict('records')
+
+
+def _write_summary(rows, path):
+    import xlsxwriter
+
+    wb = xlsxwriter.Workbook(path, {'constant_memory': True})
+    try:
+        ws = wb.add_worksheet('Reports')
+        bold = wb.add_format({'bold': True})
+        for c, col in enumerate(SUMMARY_COLUMNS):
+            ws.set_column(c, c, {'Complaint': 40, 'Resolution_Note': 40, 'Report_File': 36}.get(col, 14))
+            ws.write_string(0, c, col, bold)
+        ws.freeze_panes(1, 0)
+        for r, row in enumerate(rows, start=1):
+            for c, col in enumerate(SUMMARY_COLUMNS):
+                v = row.get(col)
+                if v is None or v == '':
+                    continue
+                if isinstance(v, (int, float)):
+                    ws.write_number(r, c, v)
+                else:
+                    ws.write_string(r, c, str(v))
+        if rows:
+            ws.autofilter(0, 0, len(rows), len(SUMMARY_COLUMNS) - 1)
+    finally:
+        wb.close()
+
+
+def batch_zip(store, out, closed_from=None, closed_to=None, departments=None, summary=False,
+              report_dir=REPORT_DIR, workers=WORKERS, chunksize=CHUNKSIZE):
+    """Write the reports of every case closed in the period into the ZIP ``out`` (path or file object).
+
+    Returns ``{'cases': n, 'rendered': n, 'cached': n}``.
+    """
+    cache = ReportCache(report_dir)
+    stats = {'cases': 0, 'rendered': 0, 'cached': 0}
+    rows = []
+    with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED) as zf, \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix='report') as pool:
+        chunks = _closed_in(store, closed_from, closed_to, departments, chunksize)
+        pending = []
+        # ส่ง chunk ให้ worker ล่วงหน้าไม่เกิน workers * 2 งาน: ไม่อ่านทั้งช่วงเข้าหน่วยความจำ
+        for chunk in chunks:
+            pending.append(pool.submit(_reports, store, chunk, cache))
+            if len(pending) >= workers * 2:
+                _drain(pending.pop(0).result(), zf, stats, rows if summary else None)
+        for fut in pending:
+            _drain(fut.result(), zf, stats, rows if summary else None)
+        if summary:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'summary.xlsx')
+                _write_summary(rows, path)
+                zf.write(path, 'summary.xlsx')
+    return stats
+
+
+def _parse_time(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M")
+    except (TypeError, ValueError):
+        return None
+
+
+def _drain(done, zf, stats, rows):
+    for case, text, cached in done:
+        name = file_name(case)
+        zf.writestr(name, text)
+        stats['cases'] += 1
+        stats['cached' if cached else 'rendered'] += 1
+        if rows is not None:
+            opened, closed = _parse_time(case['Date']), _parse_time(case['Closed_At'])
+            days = round((closed - opened).total_seconds() / 86400, 1) if opened and closed else None
+            rows.append(dict({col: case.get(col) for col in SUMMARY_COLUMNS}, Days_To_Close=days, Report_File=name))
+
+
+def main(argv=None):
+    from smart_claim.store import open_store
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='tracking_db_v4_mcs.db')
+    parser.add_argument('--archive-dir', default='archive')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    b = sub.add_parser('batch', help="ZIP of the resolution reports of every case closed in a period")
+    b.add_argument('--from', dest='closed_from', help="closed on or after YYYY-MM-DD")
+    b.add_argument('--to', dest='closed_to', help="closed on or before YYYY-MM-DD")
+    b.add_argument('--dept', action='append', help="repeatable")
+    b.add_argument('--summary', action='store_true', help="add summary.xlsx")
+    b.add_argument('--workers', type=int, default=WORKERS)
+    b.add_argument('-o', '--output', required=True)
+    args = parser.parse_args(argv)
+
+    store = open_store(args.db, archive_dir=args.archive_dir)
+    t0 = datetime.now()
+    tmp = args.output + '.tmp'
+    stats = batch_zip(store, tmp, args.closed_from, args.closed_to, args.dept, args.summary, workers=args.workers)
+    shutil.move(tmp, args.output)
+    print(f"{stats['cases']:,} reports ({stats['rendered']:,} rendered, {stats['cached']:,} from cache) "
+          f"in {(datetime.now() - t0).total_seconds():.2f}s -> {args.output}")
+
+
+if __name__ == '__main__':
+    main()
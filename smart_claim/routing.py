@@ -0,0 +1,389 @@
+"""Complaint routing model: versioned artifacts, lazy loading, online updates.
+
+Models are trained offline (or once, on the very first prediction when no
+artifact exists yet) and saved under ``models/complaint_router/vNNNN/`` with a
+``meta.json`` holding the training-data hash. The page only loads an artifact
+on its first prediction, memory-mapped, so a fresh server process neither
+retrains nor imports sklearn until a complaint actually has to be routed.
+
+The router uses hashed character n-grams (no vocabulary, works on unsegmented
+Thai) with a ``partial_fit`` classifier, so every MCS "Force Re-assign" is
+learned immediately and snapshotted as a new version every few corrections.
+
+    python -m smart_claim.routing train
+    python -m smart_claim.routing list
+    python -m smart_claim.routing pin v0002
+    python -m smart_claim.routing rollback
+    python -m smart_claim.routing evaluate --db tracking_db_v4_mcs.db
+"""
+import os
+import json
+import hashlib
+import argparse
+import copy
+import threading
+from datetime import datetime
+
+MODEL_DIR = os.path.join('models', 'complaint_router')
+PIN_FILE = 'PINNED'
+ARTIFACT = 'model.joblib'
+DEPARTMENTS = ['QC', 'QA', 'MCS']
+SNAPSHOT_EVERY = 20  # บันทึกเป็นเวอร์ชันใหม่ทุกๆ กี่ครั้งที่ MCS แก้การ assign
+
+# ข้อมูลตั้งต้นที่ใช้สอน AI (ย้ายมาจาก load_model() ในหน้า Smart Claim)
+TRAINING_DATA = {
+    'text': [
+        'สนิมขึ้นที่ขอบเหล็ก', 'สินค้าบุบ', 'ขนาดความหนาไม่ได้ตามสเปค',
+        'ผิวเหล็กเป็นรอยขีดข่วน', 'ความแข็งไม่ได้มาตรฐาน', 'สีเคลือบหลุดร่อน',
+        'มีคราบน้ำมันเยอะเกินไป', 'เหล็กยืดตัวไม่ได้', 'ขอบเหล็กคมเกินไป',
+        'ค่า Yield Strength ต่ำ', 'Defect ที่ผิว', 'รอยกดทับ', 'เหล็กแตก',
+        'ใบ COA ไม่ตรงกับสินค้า', 'เอกสารรับรองคุณภาพผิด', 'หาใบเซอร์ไม่เจอ',
+        'ระบุเกรดเหล็กในใบส่งของผิด', 'ไม่ผ่านมาตรฐาน ISO', 'ตรวจสอบย้อนกลับไม่ได้',
+        'สเปคในระบบไม่ตรงกับป้าย', 'เอกสารประกอบการเคลมไม่ครบ', 'Label ผิด',
+        'ส่งของล่าช้ากว่ากำหนด', 'ติดต่อฝ่ายขายไม่ได้', 'พนักงานขับรถพูดจาไม่สุภาพ',
+        'ส่งสินค้าผิดสถานที่', 'แพ็คเกจจิ้งเสียหายจากการขนส่ง', 'ขอใบเสนอราคาช้า',
+        'ประสานงานยอดแย่', 'รถขนส่งมาไม่ตรงเวลา', 'แจ้งสถานะสินค้าผิด',
+        'ค่าขนส่งแพงเกินไป', 'บริการหลังการขายไม่ดี'
+    ],
+    'department': [
+        'QC', 'QC', 'QC', 'QC', 'QC', 'QC',
+        'QC', 'QC', 'QC', 'QC', 'QC', 'QC', 'QC',
+        'QA', 'QA', 'QA', 'QA', 'QA', 'QA',
+        'QA', 'QA', 'QA',
+        'MCS', 'MCS', 'MCS', 'MCS', 'MCS', 'MCS',
+        'MCS', 'MCS', 'MCS', 'MCS', 'MCS'
+    ]
+}
+
+
+def data_hash(texts, labels):
+    h = hashlib.sha256()
+    for text, label in zip(texts, labels):
+        h.update(f"{label}\t{text}\n".encode('utf-8'))
+    return h.hexdigest()
+
+
+class OnlineRouterModel:
+    """Hashed char n-gram features + MultinomialNB, updatable with ``partial_fit``."""
+
+    def __init__(self, n_features=2 ** 18, ngram_range=(1, 3), alpha=0.1):
+        from sklearn.feature_extraction.text import HashingVectorizer
+        from sklearn.naive_bayes import MultinomialNB
+        self.vectorizer = HashingVectorizer(analyzer='char_wb', ngram_range=ngram_range, n_features=n_features,
+                                            alternate_sign=False, norm='l2')
+        self.clf = MultinomialNB(alpha=alpha)
+
+    @property
+    def classes_(self):
+        return self.clf.classes_
+
+    def describe(self):
+        lo, hi = self.vectorizer.ngram_range
+        return f"HashingVectorizer(char_wb {lo}-{hi}) -> {type(self.clf).__name__}"
+
+    def partial_fit(self, texts, labels):
+        classes = None if hasattr(self.clf, 'classes_') else DEPARTMENTS
+        self.clf.partial_fit(self.vectorizer.transform(list(texts)), list(labels), classes=classes)
+        return self
+
+    def fit(self, texts, labels):
+        return self.partial_fit(texts, labels)
+
+    def predict(self, texts):
+        return self.clf.predict(self.vectorizer.transform(list(texts)))
+
+
+def build_model():
+    return OnlineRouterModel()
+
+
+def describe_estimator(model):
+    if hasattr(model, 'describe'):
+        return model.describe()
+    return ' -> '.join(type(step).__name__ for _, step in getattr(model, 'steps', [('', model)]))
+
+
+# ==========================================
+# Registry (หนึ่งโฟลเดอร์ต่อหนึ่งเวอร์ชัน)
+# ==========================================
+def list_versions(model_dir=MODEL_DIR):
+    if not os.path.isdir(model_dir):
+        return []
+    return sorted(d for d in os.listdir(model_dir)
+                  if d.startswith('v') and os.path.exists(os.path.join(model_dir, d, 'meta.json')))
+
+
+def read_meta(version, model_dir=MODEL_DIR):
+    with open(os.path.join(model_dir, version, 'meta.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def pinned_version(model_dir=MODEL_DIR):
+    env = os.environ.get('CLAIM_ROUTER_VERSION')
+    if env:
+        return env
+    path = os.path.join(model_dir, PIN_FILE)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return f.read().strip() or None
+    return None
+
+
+def active_version(model_dir=MODEL_DIR):
+    """The pinned version if any, otherwise the newest one."""
+    versions = list_versions(model_dir)
+    pinned = pinned_version(model_dir)
+    if pinned:
+        if pinned not in versions:
+            raise FileNotFoundError(f"pinned router version {pinned} not found in {model_dir}")
+        return pinned
+    return versions[-1] if versions else None
+
+
+def pin(version, model_dir=MODEL_DIR):
+    if version not in list_versions(model_dir):
+        raise FileNotFoundError(f"router version {version} not found in {model_dir}")
+    _write_atomic(os.path.join(model_dir, PIN_FILE), version)
+
+
+def unpin(model_dir=MODEL_DIR):
+    path = os.path.join(model_dir, PIN_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def rollback(model_dir=MODEL_DIR):
+    """Pin the version just before the active one; returns it."""
+    versions = list_versions(model_dir)
+    current = active_version(model_dir)
+    idx = versions.index(current) if current in versions else -1
+    if idx <= 0:
+        raise RuntimeError("no older router version to roll back to")
+    pin(versions[idx - 1], model_dir)
+    return versions[idx - 1]
+
+
+def _write_atomic(path, text):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def save_version(model, meta, model_dir=MODEL_DIR):
+    import joblib
+    versions = list_versions(model_dir)
+    version = f"v{int(versions[-1][1:]) + 1 if versions else 1:04d}"
+    final = os.path.join(model_dir, version)
+    tmp = final + '.tmp'
+    os.makedirs(tmp, exist_ok=True)
+    # ไม่บีบอัด เพื่อให้โหลดแบบ mmap ได้
+    joblib.dump(model, os.path.join(tmp, ARTIFACT))
+    meta = {**meta, 'version': version}
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, final)
+    return meta
+
+
+def train(texts=None, labels=None, model_dir=MODEL_DIR, force=False):
+    """Fit a router and save it as a new version.
+
+    Training on data whose hash matches the newest version is a no-op unless
+    ``force`` is set, so re-running the command is reproducible.
+    """
+    import sklearn
+    if texts is None:
+        texts, labels = TRAINING_DATA['text'], TRAINING_DATA['department']
+    digest = data_hash(texts, labels)
+    model = build_model()
+    versions = list_versions(model_dir)
+    if versions and not force:
+        latest = read_meta(versions[-1], model_dir)
+        if latest.get('data_sha256') == digest and latest.get('estimator') == describe_estimator(model):
+            return latest
+
+    model.fit(list(texts), list(labels))
+    return save_version(model, {
+        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'data_sha256': digest,
+        'n_samples': len(texts),
+        'n_updates': 0,
+        'classes': [str(c) for c in model.classes_],
+        'estimator': describe_estimator(model),
+        'sklearn_version': sklearn.__version__,
+    }, model_dir)
+
+
+def load(version=None, model_dir=MODEL_DIR, mmap=True):
+    import joblib
+    version = version or active_version(model_dir)
+    if version is None:
+        raise FileNotFoundError(f"no router artifact in {model_dir}")
+    model = joblib.load(os.path.join(model_dir, version, ARTIFACT), mmap_mode='r' if mmap else None)
+    return model, read_meta(version, model_dir)
+
+
+class ComplaintRouter:
+    """Loads the active artifact on the first ``predict`` call and learns from overrides."""
+
+    def __init__(self, model_dir=MODEL_DIR, version=None, snapshot_every=SNAPSHOT_EVERY):
+        self.model_dir = model_dir
+        self.version = version
+        self.snapshot_every = snapshot_every
+        self.meta = None
+        self.pending = 0  # จำนวน correction ที่ยังไม่ได้ snapshot
+        self._pending_hash = None
+        self._model = None
+        self._writable = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    if not list_versions(self.model_dir):
+                        # ครั้งแรกสุดที่ยังไม่มี artifact: เทรนจากข้อมูลตั้งต้นแล้วเก็บไว้
+                        train(model_dir=self.model_dir)
+                    self._model, self.meta = load(self.version, self.model_dir)
+        return self._model
+
+    def predict(self, texts):
+        return self._ensure_loaded().predict(list(texts))
+
+    def learn(self, text, department):
+        """Apply one MCS correction (a single ``partial_fit`` step).
+
+        Returns False when the loaded artifact is not an online model.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            if not hasattr(self._model, 'partial_fit'):
+                return False
+            if not self._writable:
+                # artifact ที่ mmap มาเป็น read-only ต้องโหลดแบบปกติก่อนแก้ค่า
+                self._model, self.meta = load(self.meta['version'], self.model_dir, mmap=False)
+                self._writable = True
+            self._model.partial_fit([text], [department])
+            self._pending_hash = hashlib.sha256(
+                f"{self._pending_hash or self.meta['data_sha256']}|{department}\t{text}".encode('utf-8')).hexdigest()
+            self.pending += 1
+            if self.snapshot_every and self.pending >= self.snapshot_every:
+                self._snapshot()
+        return True
+
+    def snapshot(self):
+        with self._lock:
+            if self.pending:
+                self._snapshot()
+        return self.meta
+
+    def _snapshot(self):
+        import sklearn
+        self.meta = save_version(self._model, {
+            'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'data_sha256': self._pending_hash,
+            'parent': self.meta['version'],
+            'n_samples': self.meta['n_samples'] + self.pending,
+            'n_updates': self.meta.get('n_updates', 0) + self.pending,
+            'classes': [str(c) for c in self._model.classes_],
+            'estimator': describe_estimator(self._model),
+            'sklearn_version': sklearn.__version__,
+        }, self.model_dir)
+        self.pending = 0
+        self._pending_hash = None
+
+    def describe(self):
+        """Short label for the UI without forcing a load."""
+        if self.meta:
+            return self.meta['version'] + (f" +{self.pending} online updates" if self.pending else "")
+        try:
+            version = self.version or active_version(self.model_dir)
+        except FileNotFoundError as e:
+            return str(e)
+        return f"{version} (not loaded)" if version else "untrained"
+
+
+def evaluate(feedback, base_version=None, model_dir=MODEL_DIR):
+    """Replay MCS corrections in time order (predict first, then learn).
+
+    ``feedback`` is a DataFrame with Timestamp, Complaint and Corrected columns.
+    Returns one row per week: cases, accuracy of the frozen base model and
+    accuracy of the online router at the moment each case was routed.
+    """
+    import pandas as pd
+    if base_version:
+        frozen, _ = load(base_version, model_dir, mmap=False)
+    else:
+        frozen = build_model().fit(TRAINING_DATA['text'], TRAINING_DATA['department'])
+    online = copy.deepcopy(frozen)
+    if not hasattr(online, 'partial_fit'):
+        raise ValueError("base version is not an online model")
+
+    feedback = feedback.sort_values('Timestamp')
+    static_hits = frozen.predict(feedback['Complaint'].astype(str).tolist()) == feedback['Corrected'].to_numpy()
+    online_hits = []
+    for text, label in zip(feedback['Complaint'].astype(str), feedback['Corrected']):
+        online_hits.append(online.predict([text])[0] == label)
+        online.partial_fit([text], [label])
+
+    weeks = pd.to_datetime(feedback['Timestamp'], errors='coerce').dt.to_period('W').astype(str)
+    result = pd.DataFrame({'Week': weeks.to_numpy(), 'static': static_hits, 'online': online_hits})
+    summary = result.groupby('Week', sort=True).agg(
+        Cases=('online', 'size'), Static_Accuracy=('static', 'mean'), Online_Accuracy=('online', 'mean'))
+    summary['Online_Cumulative'] = result['online'].cumsum().groupby(result['Week']).last() / \
+        result.groupby('Week').size().cumsum()
+    return summary.reset_index()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    tr = sub.add_parser('train', help="train on the built-in dataset (or a CSV with text,department)")
+    tr.add_argument('--csv')
+    tr.add_argument('--force', action='store_true')
+    sub.add_parser('list')
+    p = sub.add_parser('pin')
+    p.add_argument('version')
+    sub.add_parser('unpin')
+    sub.add_parser('rollback')
+    ev = sub.add_parser('evaluate', help="replay the MCS override history and report routing accuracy over time")
+    ev.add_argument('--db', default='tracking_db_v4_mcs.db')
+    ev.add_argument('--base', help="version to start from (default: a fresh model on the built-in dataset)")
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'train':
+        texts = labels = None
+        if args.csv:
+            import pandas as pd
+            df = pd.read_csv(args.csv)
+            texts, labels = df['text'].astype(str).tolist(), df['department'].astype(str).tolist()
+        meta = train(texts, labels, model_dir=args.model_dir, force=args.force)
+        print(f"{meta['version']}: {meta['n_samples']} samples, data {meta['data_sha256'][:12]}")
+    elif args.cmd == 'list':
+        active = active_version(args.model_dir)
+        for v in list_versions(args.model_dir):
+            meta = read_meta(v, args.model_dir)
+            mark = '*' if v == active else ' '
+            print(f"{mark} {v}  {meta['created_at']}  n={meta['n_samples']}  data={meta['data_sha256'][:12]}  {meta['estimator']}")
+    elif args.cmd == 'pin':
+        pin(args.version, args.model_dir)
+        print(f"pinned {args.version}")
+    elif args.cmd == 'unpin':
+        unpin(args.model_dir)
+        print("unpinned (latest version is active)")
+    elif args.cmd == 'rollback':
+        print(f"rolled back to {rollback(args.model_dir)}")
+    elif args.cmd == 'evaluate':
+        from smart_claim.store import open_store
+        feedback = open_store(args.db).routing_feedback()
+        if feedback.empty:
+            print("no MCS overrides recorded yet")
+            return
+        summary = evaluate(feedback, args.base, args.model_dir)
+        print(summary.to_string(index=False, float_format=lambda x: f"{x:.1%}"))
+
+
+if __name__ == '__main__':
+    main()
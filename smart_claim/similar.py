@@ -0,0 +1,266 @@
+"""Similar-complaint search over every case in the store.
+
+Complaints are hashed into character n-gram vectors (no vocabulary to refit,
+so new cases can be added one at a time). The index has two parts:
+
+* a merged segment: the case vectors plus an inverted index (n-gram -> cases)
+  that leaves out n-grams found in more than ``MAX_DF`` of the cases. A query
+  scores candidates through the inverted index and then computes the exact
+  cosine for the best ``CANDIDATES`` only;
+* a small delta of recently added cases that is scanned directly and merged
+  every ``MERGE_EVERY`` cases.
+
+``sync`` pulls cases with a Case_ID above the last one indexed, so inserts
+from any path (single create, bulk intake, another process) show up on the
+next query without hooking every writer.
+
+    python -m smart_claim.similar query "สนิมขึ้นที่ขอบเหล็ก"
+    python -m smart_claim.similar dedup --threshold 0.9 --out duplicates.csv
+"""
+import time
+import argparse
+import threading
+
+import numpy as np
+import pandas as pd
+
+N_FEATURES = 2 ** 20
+MERGE_EVERY = 2000
+MIN_SIMILARITY = 0.5   # ต่ำกว่านี้ถือว่าไม่ใช่ปัญหาเดียวกัน
+MAX_DF = 0.2           # n-gram ที่อยู่ในเคสเกิน 20% ไม่ใช้หา candidate
+MIN_DF_CAP = 50
+CANDIDATES = 200       # จำนวน candidate ที่คิด cosine จริงต่อ query
+DEDUP_CANDIDATES = 2000
+
+_vectorizer = None
+_vectorizer_lock = threading.Lock()
+
+
+def _get_vectorizer():
+    # import sklearn (~1.7s) ตอนใช้ครั้งแรก ไม่ใช่ตอนเปิดหน้า
+    global _vectorizer
+    if _vectorizer is None:
+        with _vectorizer_lock:
+            if _vectorizer is None:
+                from sklearn.feature_extraction.text import HashingVectorizer
+                _vectorizer = HashingVectorizer(analyzer='char_wb', ngram_range=(2, 4), n_features=N_FEATURES,
+                                                alternate_sign=False, norm='l2', dtype=np.float32)
+    return _vectorizer
+
+
+def vectorize(texts):
+    rows = _get_vectorizer().transform(['' if t is None else str(t) for t in texts]).tocsr()
+    rows.sort_indices()
+    return rows
+
+
+def _row_dots(rows, q):
+    """Dot product of each row of ``rows`` (CSR) with the single-row vector ``q``.
+
+    Matches the row entries against q's sorted feature ids; a scipy matmul here
+    would allocate index arrays the size of the whole hashed feature space per call.
+    """
+    q_idx, q_val = q.indices, q.data
+    if not len(q_idx):
+        return np.zeros(rows.shape[0])
+    pos = np.minimum(np.searchsorted(q_idx, rows.indices), len(q_idx) - 1)
+    weights = np.where(q_idx[pos] == rows.indices, q_val[pos], 0.0) * rows.data
+    owner = np.repeat(np.arange(rows.shape[0]), np.diff(rows.indptr))
+    return np.bincount(owner, weights=weights, minlength=rows.shape[0])
+
+
+class SimilarityIndex:
+    def __init__(self, merge_every=MERGE_EVERY):
+        self.merge_every = merge_every
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        import scipy.sparse as sp
+
+        with self._lock:
+            self.last_id = 0
+            self._ids = np.empty(0, dtype=np.int64)        # merged segment: Case_ID per row of _docs
+            self._docs = sp.csr_matrix((0, N_FEATURES), dtype=np.float32)
+            self._postings = sp.csr_matrix((N_FEATURES, 0), dtype=np.float32)
+            self._delta_ids, self._delta_rows, self._delta = [], [], None
+
+    def __len__(self):
+        return len(self._ids) + len(self._delta_ids)
+
+    def add(self, case_ids, texts):
+        """Index new cases (Case_IDs must be increasing across calls)."""
+        self._append(case_ids, texts)
+        self._maybe_merge()
+
+    def _append(self, case_ids, texts):
+        if not len(case_ids):
+            return
+        rows = vectorize(texts)
+        with self._lock:
+            self._delta_ids.extend(int(i) for i in case_ids)
+            self._delta_rows.append(rows)
+            self._delta = None
+            self.last_id = max(self.last_id, int(case_ids[-1]))
+
+    def _maybe_merge(self):
+        with self._lock:
+            if len(self._delta_ids) >= self.merge_every:
+                self._merge()
+
+    def _merge(self):
+        import scipy.sparse as sp
+
+        self._docs = sp.vstack([self._docs] + self._delta_rows, format='csr')
+        self._ids = np.concatenate([self._ids, np.asarray(self._delta_ids, dtype=np.int64)])
+        self._delta_ids, self._delta_rows, self._delta = [], [], None
+        # n-gram ที่พบในเคสจำนวนมาก (เช่น "มม.", "ลูกค้า") ไม่ช่วยแยกเคส -> ไม่เก็บใน inverted index
+        postings = self._docs.T.tocsr()
+        cap = max(MIN_DF_CAP, int(MAX_DF * len(self._ids)))
+        keep = (np.diff(postings.indptr) <= cap).astype(np.float32)
+        postings = (sp.diags(keep) @ postings).tocsr()
+        postings.eliminate_zeros()
+        self._postings = postings
+
+    def sync(self, store, chunksize=5000):
+        """Add every case the store has beyond ``last_id``; returns how many were added."""
+        added = 0
+        for chunk in store.iter_complaints(after_id=self.last_id, chunksize=chunksize):
+            ids, texts = zip(*chunk)
+            self._append(ids, texts)
+            added += len(ids)
+        # merge ครั้งเดียวหลังอ่านครบ (ตอนเปิด index ครั้งแรกอาจมีเป็นแสนเคส)
+        self._maybe_merge()
+        return added
+
+    def _snapshot(self):
+        import scipy.sparse as sp
+
+        with self._lock:
+            if self._delta is None and self._delta_rows:
+                self._delta = sp.vstack(self._delta_rows, format='csr')
+            return (self._ids, self._docs, self._postings,
+                    np.asarray(self._delta_ids, dtype=np.int64), self._delta)
+
+    def query(self, text, k=5, min_similarity=MIN_SIMILARITY, before=None):
+        """``[(Case_ID, similarity), ...]`` best first, optionally only Case_IDs below ``before``."""
+        q = vectorize([text])
+        ids, docs, postings, delta_ids, delta = self._snapshot()
+        found_ids, found_scores = [], []
+        if len(ids):
+            # คะแนนคร่าวๆ จาก n-gram ที่ไม่ซ้ำบ่อย -> เลือก candidate -> คิด cosine จริงเฉพาะ candidate
+            rough = (q @ postings).tocsr()
+            cand, partial = rough.indices, rough.data
+            if before is not None:
+                earlier = ids[cand] < before
+                cand, partial = cand[earlier], partial[earlier]
+            if len(cand) > CANDIDATES:
+                cand = cand[np.argpartition(-partial, CANDIDATES)[:CANDIDATES]]
+            if len(cand):
+                found_ids.append(ids[cand])
+                found_scores.append(_row_dots(docs[cand], q))
+        if delta is not None:
+            found_ids.append(delta_ids)
+            found_scores.append(_row_dots(delta, q))
+        if not found_ids:
+            return []
+        cand_ids, scores = np.concatenate(found_ids), np.concatenate(found_scores)
+        mask = scores >= min_similarity
+        if before is not None:
+            mask &= cand_ids < before
+        cand_ids, scores = cand_ids[mask], scores[mask]
+        order = np.lexsort((-cand_ids, -scores))[:k]   # คะแนนเท่ากัน -> เคสล่าสุดก่อน
+        return [(int(cand_ids[i]), float(scores[i])) for i in order]
+
+
+def similar_cases(index, store, text, k=5, min_similarity=MIN_SIMILARITY):
+    """Top-k similar past cases as row dicts (with ``Similarity``), best first."""
+    index.sync(store)
+    hits = index.query(text, k * 2, min_similarity)
+    rows = store.cases_by_id([case_id for case_id, _ in hits])
+    # เคสที่ถูกลบ/ย้ายไปแล้วจะไม่มีใน store -> ข้าม
+    return [dict(rows[case_id], Similarity=score) for case_id, score in hits if case_id in rows][:k]
+
+
+def find_duplicates(index, threshold=0.9, candidates=DEDUP_CANDIDATES):
+    """Pairs (later Case_ID, earlier Case_ID, similarity) at or above ``threshold``.
+
+    Each case is compared only with earlier cases that share an uncommon n-gram
+    with it (the best ``candidates`` of them), never all-pairs.
+    """
+    with index._lock:
+        if index._delta_rows:
+            index._merge()
+    ids, docs, postings, _, _ = index._snapshot()
+    dense = np.zeros(N_FEATURES, dtype=np.float32)
+    pairs = []
+    for start in range(0, len(ids), 1000):
+        block = docs[start:start + 1000]
+        rough = (block @ postings).tocsr()
+        for r in range(block.shape[0]):
+            row = start + r
+            lo, hi = rough.indptr[r], rough.indptr[r + 1]
+            cand, partial = rough.indices[lo:hi], rough.data[lo:hi]
+            earlier = cand < row
+            cand, partial = cand[earlier], partial[earlier]
+            if not len(cand):
+                continue
+            if len(cand) > candidates:
+                cand = cand[np.argpartition(-partial, candidates)[:candidates]]
+            q_idx = block.indices[block.indptr[r]:block.indptr[r + 1]]
+            dense[q_idx] = block.data[block.indptr[r]:block.indptr[r + 1]]
+            rows = docs[cand]
+            owner = np.repeat(np.arange(len(cand)), np.diff(rows.indptr))
+            exact = np.bincount(owner, weights=dense[rows.indices] * rows.data, minlength=len(cand))
+            dense[q_idx] = 0.0
+            hit = exact >= threshold
+            pairs.extend(zip(ids[row].repeat(hit.sum()).tolist(), ids[cand[hit]].tolist(), exact[hit].tolist()))
+    return pairs
+
+
+def main(argv=None):
+    from smart_claim.store import open_store
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='tracking_db_v4_mcs.db')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    q = sub.add_parser('query', help="show the cases most similar to a complaint")
+    q.add_argument('text')
+    q.add_argument('-k', type=int, default=5)
+    d = sub.add_parser('dedup', help="list near-duplicate complaints in the existing backlog")
+    d.add_argument('--threshold', type=float, default=0.9)
+    d.add_argument('--out', help="write the pairs to this CSV")
+    args = parser.parse_args(argv)
+
+    store = open_store(args.db)
+    index = SimilarityIndex()
+    t0 = time.perf_counter()
+    index.sync(store)
+    print(f"indexed {len(index):,} cases in {time.perf_counter() - t0:.2f}s")
+
+    if args.cmd == 'query':
+        t0 = time.perf_counter()
+        rows = similar_cases(index, store, args.text, args.k, min_similarity=0.0)
+        print(f"query took {(time.perf_counter() - t0) * 1000:.1f}ms")
+        for r in rows:
+            print(f"{r['Similarity']:.2f}  {r['Lot_ID']:<16} {r['Status']:<24} {r['Final_Decision'] or '-':<12} {r['Complaint']}")
+    elif args.cmd == 'dedup':
+        t0 = time.perf_counter()
+        pairs = find_duplicates(index, args.threshold)
+        rows = store.cases_by_id(sorted({i for p in pairs for i in p[:2]}))
+        out = pd.DataFrame([
+            {'Case_ID': a, 'Lot_ID': rows[a]['Lot_ID'], 'Complaint': rows[a]['Complaint'],
+             'Duplicate_Of': b, 'Duplicate_Of_Lot': rows[b]['Lot_ID'], 'Final_Decision': rows[b]['Final_Decision'],
+             'Similarity': round(s, 3)}
+            for a, b, s in pairs if a in rows and b in rows
+        ], columns=['Case_ID', 'Lot_ID', 'Complaint', 'Duplicate_Of', 'Duplicate_Of_Lot', 'Final_Decision', 'Similarity'])
+        print(f"{len(out):,} near-duplicate pairs (>= {args.threshold}) in {time.perf_counter() - t0:.2f}s")
+        if args.out:
+            out.to_csv(args.out, index=False)
+            print(f"written to {args.out}")
+        else:
+            print(out.head(20).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
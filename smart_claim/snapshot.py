@@ -0,0 +1,180 @@
+"""Columnar (Parquet) snapshot of the case table for the read-heavy views.
+
+The snapshot is written from the store in chunks and tagged with the store's
+data version. ``read`` rebuilds it on the first read after a write; the page
+uses ``read_latest``, which starts that rebuild on a background thread and
+keeps serving the previous snapshot until the new one is in place, so a write
+never makes a reader wait for a full export. Enum-like columns are dictionary encoded
+and come back as pandas categoricals, ``Date``/``Closed_At`` as datetimes,
+and readers ask only for the columns (and rows) they render:
+
+    read(store, ['Lot_ID', 'Date', 'Status'])
+    read(store, filters=[('Status', '==', 'Case Closed')])
+
+    python -m smart_claim.snapshot build
+"""
+import os
+import glob
+import argparse
+import functools
+import threading
+
+import pandas as pd
+
+from smart_claim.store import CASE_COLUMNS
+
+SNAPSHOT_DIR = 'snapshots'
+CHUNKSIZE = 20000
+
+CATEGORY_COLUMNS = ['Department', 'Status', 'Current_Handler', 'Final_Decision', 'Cluster']
+DATETIME_COLUMNS = ['Date', 'Closed_At']
+
+_build_lock = threading.Lock()
+_building = set()   # (snapshot_dir, store name) ที่กำลัง build อยู่เบื้องหลัง
+
+
+@functools.cache
+def schema():
+    # pyarrow import ตอน build snapshot ครั้งแรก ไม่ใช่ตอนเปิดหน้า
+    import pyarrow as pa
+
+    types = {
+        'Case_ID': pa.int64(),
+        'Estimated_Days': pa.int64(),
+        **{col: pa.dictionary(pa.int32(), pa.string()) for col in CATEGORY_COLUMNS},
+        **{col: pa.timestamp('s') for col in DATETIME_COLUMNS},
+    }
+    return pa.schema([(col, types.get(col, pa.string())) for col in CASE_COLUMNS])
+
+
+def _typed(chunk):
+    import pyarrow as pa
+
+    for col in DATETIME_COLUMNS:
+        chunk[col] = pd.to_datetime(chunk[col], format='%Y-%m-%d %H:%M', errors='coerce')
+    chunk['Estimated_Days'] = pd.to_numeric(chunk['Estimated_Days'], errors='coerce').astype('Int64')
+    return pa.Table.from_pandas(chunk[CASE_COLUMNS], schema=schema(), preserve_index=False)
+
+
+def write(chunks, path):
+    """Write DataFrame chunks of ``CASE_COLUMNS`` as one Parquet file (one row group per chunk)."""
+    import pyarrow.parquet as pq
+
+    with pq.ParquetWriter(path, schema(), compression='zstd') as writer:
+        for chunk in chunks:
+            writer.write_table(_typed(chunk))
+
+
+def _name(store):
+    return os.path.splitext(os.path.basename(store.path))[0]
+
+
+def _versions(store, snapshot_dir):
+    """``{version: path}`` of the snapshots of ``store`` on disk."""
+    out = {}
+    for path in glob.glob(os.path.join(snapshot_dir, f"{glob.escape(_name(store))}.v*.parquet")):
+        version = path[:-len('.parquet')].rsplit('.v', 1)[1]
+        if version.isdigit():
+            out[int(version)] = path
+    return out
+
+
+def _build(store, snapshot_dir, chunksize):
+    # เลข version อ่านก่อนดึงข้อมูล: ถ้ามีการเขียนระหว่าง build ไฟล์จะใหม่กว่าเลขที่ติดไว้ ไม่มีทางเก่ากว่า
+    version = store.data_version()
+    path = os.path.join(snapshot_dir, f"{_name(store)}.v{version}.parquet")
+    with _build_lock:
+        if os.path.exists(path):
+            return version, path
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            write(store.iter_cases(chunksize=chunksize), tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        for old_version, old in _versions(store, snapshot_dir).items():
+            if old_version < version:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass  # ยังมี reader เปิดอยู่ (Windows) -> ลบรอบหน้า
+    return version, path
+
+
+def current(store, snapshot_dir=SNAPSHOT_DIR, chunksize=CHUNKSIZE):
+    """Path of the snapshot for the store's current data version, building it if needed."""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = _versions(store, snapshot_dir).get(store.data_version())
+    return path or _build(store, snapshot_dir, chunksize)[1]
+
+
+def latest(store, snapshot_dir=SNAPSHOT_DIR, chunksize=CHUNKSIZE):
+    """``(version, path)`` of the newest snapshot on disk, starting a background rebuild if it is behind the store.
+
+    Only the very first snapshot of a store is built while the caller waits.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    versions = _versions(store, snapshot_dir)
+    if not versions:
+        return _build(store, snapshot_dir, chunksize)
+    version = max(versions)
+    if version < store.data_version():
+        key = (os.path.abspath(snapshot_dir), _name(store))
+        with _build_lock:
+            start = key not in _building
+            _building.add(key)
+        if start:
+            def run():
+                try:
+                    _build(store, snapshot_dir, chunksize)
+                finally:
+                    with _build_lock:
+                        _building.discard(key)
+            threading.Thread(target=run, name='snapshot-build', daemon=True).start()
+    return version, versions[version]
+
+
+def _read(path, columns, filters):
+    df = pd.read_parquet(path, columns=columns, filters=filters)
+    for col in df.columns.intersection(CATEGORY_COLUMNS):
+        # แต่ละ row group มี dictionary ของตัวเอง -> รวม category ที่ไม่ถูกใช้แล้วทิ้ง
+        df[col] = df[col].cat.remove_unused_categories()
+    return df
+
+
+def read(store, columns=None, filters=None, snapshot_dir=SNAPSHOT_DIR):
+    """Case table (only ``columns``, only rows matching ``filters``) from the current snapshot."""
+    return _read(current(store, snapshot_dir), columns, filters)
+
+
+def read_latest(store, columns=None, filters=None, snapshot_dir=SNAPSHOT_DIR):
+    """``(version, frame)`` like ``read`` but from ``latest``: may be a few writes behind while a rebuild runs."""
+    for _ in range(3):
+        version, path = latest(store, snapshot_dir)
+        try:
+            return version, _read(path, columns, filters)
+        except FileNotFoundError:
+            continue  # build ใหม่เสร็จและลบไฟล์นี้ไปพอดี -> เอาไฟล์ใหม่
+    return store.data_version(), read(store, columns, filters, snapshot_dir)
+
+
+def main(argv=None):
+    import pyarrow.parquet as pq
+    from smart_claim.store import open_store
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='tracking_db_v4_mcs.db')
+    parser.add_argument('--dir', default=SNAPSHOT_DIR)
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('build', help="write the snapshot for the current data version")
+    args = parser.parse_args(argv)
+
+    store = open_store(args.db)
+    path = current(store, args.dir)
+    meta = pq.ParquetFile(path).metadata
+    print(f"{path}: {meta.num_rows:,} cases, {meta.num_row_groups} row groups, {os.path.getsize(path):,} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,795 @@
+"""Case storage for the Smart Claim page.
+
+The page talks to a ``CaseStore``; the default backend is an embedded SQLite
+database in WAL mode so that creating or updating a case touches one row
+instead of rewriting the whole table.
+
+    python -m smart_claim.store import-csv tracking_db_v3_mcs.csv
+"""
+import os
+import re
+import sqlite3
+import threading
+import argparse
+from datetime import datetime
+
+import pandas as pd
+
+from smart_claim import aggregates, eta
+from smart_claim.aggregates import CLOSED_STATUS
+
+CASE_COLUMNS = ['Case_ID', 'Lot_ID', 'Date', 'Complaint', 'Department', 'Status', 'Estimated_Days',
+                'Current_Handler', 'Final_Decision', 'Resolution_Note', 'Closed_At', 'Cluster']
+EVENT_COLUMNS = ['Timestamp', 'Actor', 'Action', 'Note']
+
+
+class DuplicateCaseError(ValueError):
+    """Raised by ``insert_case`` when the Lot ID already has an open case."""
+
+
+class StaleCaseError(ValueError):
+    """Raised by ``update_case`` when the case's Row_Version is no longer the one the caller read."""
+
+
+class CaseStore:
+    """Interface ที่หน้า Smart Claim ใช้ (backend ไหนก็ได้ที่ทำตามนี้)"""
+
+    def insert_case(self, record, event=None):
+        raise NotImplementedError
+
+    def insert_cases(self, records, events=None):
+        """Insert many cases at once; returns the Lot IDs skipped as duplicates."""
+        raise NotImplementedError
+
+    def update_case(self, lot_id, changes, event=None, case_id=None, expected_version=None):
+        """Update one case; returns False when the Lot ID (or its claim ``case_id``) does not exist.
+
+        Without ``case_id`` the lot's current claim (see ``get_case``) is updated. With
+        ``expected_version`` the write raises ``StaleCaseError`` unless the case still has that Row_Version.
+        """
+        raise NotImplementedError
+
+    def get_case(self, lot_id):
+        """The lot's open case, or its most recent one once everything is closed."""
+        raise NotImplementedError
+
+    def get_claim(self, case_id):
+        """One case by Case_ID, including its Row_Version; None when it does not exist."""
+        raise NotImplementedError
+
+    def find_cases(self, lot_id):
+        """Every case (claim) filed for one Lot ID, newest first."""
+        raise NotImplementedError
+
+    def search_lots(self, prefix, limit=20):
+        """``[(Lot_ID, number of cases), ...]`` for Lot IDs starting with ``prefix``."""
+        raise NotImplementedError
+
+    def cases_by_id(self, case_ids):
+        """``{Case_ID: case dict}`` for the given ids (missing ids are left out)."""
+        raise NotImplementedError
+
+    def iter_complaints(self, after_id=0, chunksize=5000):
+        """Yield lists of ``(Case_ID, Complaint)`` for cases above ``after_id``, in Case_ID order."""
+        raise NotImplementedError
+
+    def case_history(self, case_id):
+        """Events of one case, oldest first (``EVENT_COLUMNS`` dicts)."""
+        raise NotImplementedError
+
+    def case_histories(self, case_ids):
+        """``{Case_ID: [event dict, ...]}`` for many cases in one go (cases without events are left out)."""
+        raise NotImplementedError
+
+    def case_versions(self, case_ids):
+        """``{Case_ID: Row_Version}``; the version changes whenever the case or its history does."""
+        raise NotImplementedError
+
+    def task_page(self, handler=None, opened_before=None, newest_first=False, limit=20, offset=0):
+        """One page of open cases (DataFrame) and the number of open cases matching the filters."""
+        raise NotImplementedError
+
+    def iter_cases(self, date_from=None, date_to=None, departments=None, statuses=None, chunksize=5000):
+        """Yield DataFrame chunks of ``CASE_COLUMNS`` matching the filters, oldest first."""
+        raise NotImplementedError
+
+    def data_version(self):
+        """Counter bumped by every write to the case data; use it as a cache key."""
+        raise NotImplementedError
+
+    def all_cases(self):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def import_csv(self, csv_path):
+        raise NotImplementedError
+
+    def apply_batch(self, ops):
+        raise NotImplementedError
+
+    def dashboard_stats(self):
+        """Precomputed dashboard numbers (see ``smart_claim.aggregates.read``)."""
+        raise NotImplementedError
+
+    def routing_feedback(self):
+        """MCS re-assignments as labelled routing examples, oldest first."""
+        raise NotImplementedError
+
+    def eta_model(self):
+        """Current ``smart_claim.eta.EtaModel`` (fitted resolution-time groups)."""
+        raise NotImplementedError
+
+    def refit_eta(self):
+        """Refit ``eta_stats`` from the closed-case history; returns the number of cases used."""
+        raise NotImplementedError
+
+
+# ==========================================
+# Schema migrations (PRAGMA user_version)
+# ==========================================
+def _migrate_v1(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cases (
+            Lot_ID TEXT PRIMARY KEY,
+            Date TEXT,
+            Complaint TEXT,
+            Department TEXT,
+            Status TEXT,
+            Estimated_Days INTEGER,
+            Current_Handler TEXT,
+            Action_History TEXT,
+            Final_Decision TEXT,
+            Resolution_Note TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cases_status ON cases(Status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cases_handler ON cases(Current_Handler)")
+
+
+_HISTORY_ENTRY = re.compile(r"^\[(?P<ts>[^\]]*)\]\s*(?P<note>.*)$", re.S)
+
+
+def classify_note(note):
+    """Guess (actor, action) for a free-text note from the old Action_History string."""
+    if note.startswith("Case Created"):
+        return "AI", "created"
+    if "Manual Override" in note:
+        return "MCS", "reassigned"
+    dept, sep, rest = note.partition(":")
+    if sep and dept.strip() in ("QC", "QA", "MCS"):
+        return dept.strip(), "closed" if dept.strip() == "MCS" else "forwarded"
+    return None, "note"
+
+
+def parse_history(history):
+    """Split a legacy ``"[ts] note || [ts] note"`` string into event dicts."""
+    events = []
+    if not history:
+        return events
+    for part in str(history).split(' || '):
+        m = _HISTORY_ENTRY.match(part.strip())
+        ts, note = (m.group('ts'), m.group('note')) if m else (None, part.strip())
+        actor, action = classify_note(note)
+        events.append({'Timestamp': ts, 'Actor': actor, 'Action': action, 'Note': note})
+    return events
+
+
+def _migrate_v2(conn):
+    # Action_History (string ที่ต่อยาวขึ้นเรื่อยๆ) -> ตาราง event แบบ append-only
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS case_events (
+            Event_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Lot_ID TEXT NOT NULL,
+            Timestamp TEXT,
+            Actor TEXT,
+            Action TEXT,
+            Note TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_lot ON case_events(Lot_ID, Event_ID)")
+    rows = conn.execute("SELECT Lot_ID, Action_History FROM cases ORDER BY rowid").fetchall()
+    conn.executemany(
+        "INSERT INTO case_events (Lot_ID, Timestamp, Actor, Action, Note) VALUES (?, ?, ?, ?, ?)",
+        [(lot_id, *(ev[c] for c in EVENT_COLUMNS)) for lot_id, history in rows for ev in parse_history(history)],
+    )
+    conn.execute("ALTER TABLE cases DROP COLUMN Action_History")
+
+
+def _backfill_closed_at(conn, key='Lot_ID'):
+    # เวลาปิดเคส = event 'closed' ล่าสุดของเคสนั้น (key = Case_ID เมื่อ lot หนึ่งมีหลาย claim)
+    conn.execute(f"""
+        UPDATE cases SET Closed_At = (
+            SELECT MAX(e.Timestamp) FROM case_events e WHERE e.{key} = cases.{key} AND e.Action = 'closed'
+        )
+        WHERE Status = ? AND Closed_At IS NULL
+    """, (CLOSED_STATUS,))
+
+
+def _migrate_v3(conn):
+    conn.execute("ALTER TABLE cases ADD COLUMN Closed_At TEXT")
+    _backfill_closed_at(conn)
+    aggregates.create_tables(conn)
+    aggregates.rebuild(conn)
+
+
+def _migrate_v4(conn):
+    # การแก้ assign ของ MCS = ข้อมูล label ที่ดีที่สุดสำหรับสอน router
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS routing_feedback (
+            Feedback_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Timestamp TEXT,
+            Lot_ID TEXT,
+            Complaint TEXT,
+            Predicted TEXT,
+            Corrected TEXT
+        )
+    """)
+    conn.execute("""
+        INSERT INTO routing_feedback (Timestamp, Lot_ID, Complaint, Predicted, Corrected)
+        SELECT e.Timestamp, e.Lot_ID, c.Complaint, NULL, c.Department
+        FROM case_events e JOIN cases c ON c.Lot_ID = e.Lot_ID
+        WHERE e.Action = 'reassigned'
+          AND e.Event_ID = (SELECT MAX(Event_ID) FROM case_events x WHERE x.Lot_ID = e.Lot_ID AND x.Action = 'reassigned')
+        ORDER BY e.Event_ID
+    """)
+
+
+def _migrate_v5(conn):
+    conn.execute("ALTER TABLE cases ADD COLUMN Cluster TEXT")
+    eta.create_tables(conn)
+    eta.rebuild(conn)
+
+
+def _migrate_v6(conn):
+    # partial index ของเคสที่ยังเปิดอยู่: หน้า Action Center อ่านทีละหน้าโดยไม่ต้องแตะเคสที่ปิดแล้ว
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_cases_open_handler ON cases(Current_Handler, Date) "
+                 f"WHERE Status != '{aggregates.CLOSED_STATUS}'")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_cases_open_date ON cases(Date) "
+                 f"WHERE Status != '{aggregates.CLOSED_STATUS}'")
+
+
+def _migrate_v7(conn):
+    # data_version: เพิ่มทุกครั้งที่ข้อมูลเคสเปลี่ยน ใช้เป็น key ของ cache (export ฯลฯ)
+    conn.execute("CREATE TABLE IF NOT EXISTS store_meta (Key TEXT PRIMARY KEY, Value INTEGER NOT NULL)")
+    conn.execute("INSERT OR IGNORE INTO store_meta (Key, Value) VALUES ('data_version', 0)")
+
+
+def _touch(conn):
+    conn.execute("UPDATE store_meta SET Value = Value + 1 WHERE Key = 'data_version'")
+
+
+def _migrate_v8(conn):
+    # Case_ID เป็น key แทน Lot_ID: lot เดียวมีได้หลาย claim แต่เปิดค้างได้ทีละ claim
+    cols = ("Lot_ID, Date, Complaint, Department, Status, Estimated_Days, Current_Handler, "
+            "Final_Decision, Resolution_Note, Closed_At, Cluster")
+    conn.execute("""
+        CREATE TABLE cases_v8 (
+            Case_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Lot_ID TEXT,
+            Date TEXT,
+            Complaint TEXT,
+            Department TEXT,
+            Status TEXT,
+            Estimated_Days INTEGER,
+            Current_Handler TEXT,
+            Final_Decision TEXT,
+            Resolution_Note TEXT,
+            Closed_At TEXT,
+            Cluster TEXT
+        )
+    """)
+    conn.execute(f"INSERT INTO cases_v8 (Case_ID, {cols}) SELECT rowid, {cols} FROM cases ORDER BY rowid")
+    conn.execute("DROP TABLE cases")
+    conn.execute("ALTER TABLE cases_v8 RENAME TO cases")
+    conn.execute("CREATE INDEX idx_cases_status ON cases(Status)")
+    conn.execute("CREATE INDEX idx_cases_handler ON cases(Current_Handler)")
+    conn.execute("CREATE INDEX idx_cases_lot ON cases(Lot_ID, Case_ID)")
+    conn.execute(f"CREATE UNIQUE INDEX idx_cases_open_lot ON cases(Lot_ID) WHERE Status != '{CLOSED_STATUS}'")
+    conn.execute(f"CREATE INDEX idx_cases_open_handler ON cases(Current_Handler, Date) WHERE Status != '{CLOSED_STATUS}'")
+    conn.execute(f"CREATE INDEX idx_cases_open_date ON cases(Date) WHERE Status != '{CLOSED_STATUS}'")
+
+    conn.execute("ALTER TABLE case_events ADD COLUMN Case_ID INTEGER")
+    conn.execute("UPDATE case_events SET Case_ID = (SELECT c.Case_ID FROM cases c WHERE c.Lot_ID = case_events.Lot_ID)")
+    conn.execute("CREATE INDEX idx_events_case ON case_events(Case_ID, Event_ID)")
+
+
+def _migrate_v9(conn):
+    # เลข version ต่อเคส: เพิ่มทุกครั้งที่เคสหรือ history ของมันเปลี่ยน (key ของ report ที่ render ไว้)
+    conn.execute("ALTER TABLE cases ADD COLUMN Row_Version INTEGER NOT NULL DEFAULT 0")
+
+
+# (version, function) -- append only, never edit a released step
+MIGRATIONS = [
+    (1, _migrate_v1),
+    (2, _migrate_v2),
+    (3, _migrate_v3),
+    (4, _migrate_v4),
+    (5, _migrate_v5),
+    (6, _migrate_v6),
+    (7, _migrate_v7),
+    (8, _migrate_v8),
+    (9, _migrate_v9),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(conn):
+    """Bring ``conn`` up to SCHEMA_VERSION; each step runs exactly once per DB."""
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+        with conn:
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+    return current
+
+
+class SQLiteCaseStore(CaseStore):
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        self.previous_version = migrate(conn)
+
+    # หนึ่ง connection ต่อหนึ่ง thread (Streamlit รันแต่ละ session คนละ thread)
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def insert_case(self, record, event=None):
+        conn = self._connect()
+        with conn:
+            return self._insert_case(conn, record, event)
+
+    def insert_cases(self, records, events=None):
+        conn = self._connect()
+        with conn:
+            return self._insert_cases(conn, records, events)
+
+    def update_case(self, lot_id, changes, event=None, case_id=None, expected_version=None):
+        conn = self._connect()
+        with conn:
+            return self._update_case(conn, lot_id, changes, event, case_id, expected_version)
+
+    def apply_batch(self, ops):
+        """Run ``[(method_name, args, kwargs), ...]`` in one transaction.
+
+        Each op gets its own savepoint, so one failing op (e.g. a duplicate Lot ID)
+        does not roll back the rest of the batch. Returns ``[(result, error), ...]``.
+        """
+        conn = self._connect()
+        outcomes = []
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for name, args, kwargs in ops:
+                conn.execute("SAVEPOINT op")
+                try:
+                    result = getattr(self, '_' + name)(conn, *args, **kwargs)
+                    conn.execute("RELEASE op")
+                    outcomes.append((result, None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    outcomes.append((None, e))
+        return outcomes
+
+    # --- single-row writes; caller owns the transaction ---
+    def _insert_case(self, conn, record, event=None):
+        row = {col: record.get(col) for col in CASE_COLUMNS}
+        try:
+            cur = conn.execute(
+                f"INSERT INTO cases ({', '.join(CASE_COLUMNS)}) VALUES ({', '.join('?' * len(CASE_COLUMNS))})",
+                [row[col] for col in CASE_COLUMNS],
+            )
+        except sqlite3.IntegrityError:
+            raise DuplicateCaseError(f"Lot {row['Lot_ID']} already has an open case") from None
+        row['Case_ID'] = cur.lastrowid
+        aggregates.apply_insert(conn, row)
+        _touch(conn)
+        if event:
+            self._append_event(conn, row, event)
+        return row['Case_ID']
+
+    def _insert_cases(self, conn, records, events=None):
+        rows = [{col: r.get(col) for col in CASE_COLUMNS} for r in records]
+        lots = [str(r['Lot_ID']) for r in rows]
+        existing = set()
+        for i in range(0, len(lots), 500):
+            part = lots[i:i + 500]
+            existing.update(lot for (lot,) in conn.execute(
+                f"SELECT Lot_ID FROM cases WHERE Lot_ID IN ({', '.join('?' * len(part))}) AND Status != ?",
+                part + [CLOSED_STATUS]))
+        fresh = []
+        for i, row in enumerate(rows):
+            if lots[i] not in existing:
+                existing.add(lots[i])
+                fresh.append(i)
+        last_id = conn.execute("SELECT COALESCE(MAX(Case_ID), 0) FROM cases").fetchone()[0]
+        conn.executemany(
+            f"INSERT INTO cases ({', '.join(CASE_COLUMNS)}) VALUES ({', '.join('?' * len(CASE_COLUMNS))})",
+            [[rows[i][col] for col in CASE_COLUMNS] for i in fresh],
+        )
+        aggregates.apply_inserts(conn, [rows[i] for i in fresh])
+        if fresh:
+            _touch(conn)
+        if events:
+            case_ids = dict(conn.execute("SELECT Lot_ID, Case_ID FROM cases WHERE Case_ID > ?", (last_id,)).fetchall())
+            conn.executemany(
+                "INSERT INTO case_events (Case_ID, Lot_ID, Timestamp, Actor, Action, Note) VALUES (?, ?, ?, ?, ?, ?)",
+                [[case_ids[lots[i]], lots[i]] + [events[i].get(col) for col in EVENT_COLUMNS] for i in fresh],
+            )
+        fresh_set = set(fresh)
+        return [lots[i] for i in range(len(rows)) if i not in fresh_set]
+
+    def _current(self, conn, lot_id):
+        # claim ที่ยังเปิดอยู่ก่อน (มีได้ไม่เกินหนึ่ง) ไม่งั้นเอา claim ล่าสุด
+        row = conn.execute("SELECT * FROM cases WHERE Lot_ID = ? ORDER BY Status = ?, Case_ID DESC LIMIT 1",
+                           (str(lot_id), CLOSED_STATUS)).fetchone()
+        return dict(row) if row else None
+
+    def _claim(self, conn, case_id):
+        row = conn.execute("SELECT * FROM cases WHERE Case_ID = ?", (int(case_id),)).fetchone()
+        return dict(row) if row else None
+
+    def _update_case(self, conn, lot_id, changes, event=None, case_id=None, expected_version=None):
+        if case_id is None:
+            old = self._current(conn, lot_id)
+        else:
+            # claim ที่ผู้ใช้เห็นอยู่จริง ไม่ใช่ claim "ปัจจุบัน" ของ lot ซึ่งอาจเป็นคนละอันแล้ว
+            old = self._claim(conn, case_id)
+            if old is not None and old['Lot_ID'] != str(lot_id):
+                old = None
+        if old is None:
+            return False
+        if expected_version is not None and old['Row_Version'] != int(expected_version):
+            raise StaleCaseError(f"Case {old['Case_ID']} (lot {old['Lot_ID']}) changed since it was read "
+                                 f"(version {expected_version} -> {old['Row_Version']})")
+        changes = dict(changes)
+        if changes.get('Status') == CLOSED_STATUS and old['Status'] != CLOSED_STATUS and 'Closed_At' not in changes:
+            changes['Closed_At'] = (event or {}).get('Timestamp') or datetime.now().strftime("%Y-%m-%d %H:%M")
+        if changes or event:
+            conn.execute(f"UPDATE cases SET {''.join(f'{col} = ?, ' for col in changes)}Row_Version = Row_Version + 1 "
+                         f"WHERE Case_ID = ?", list(changes.values()) + [old['Case_ID']])
+        if changes:
+            new = {**old, **changes}
+            aggregates.apply_update(conn, old, new)
+            if old['Status'] != CLOSED_STATUS and new['Status'] == CLOSED_STATUS:
+                eta.apply_close(conn, new)
+            _touch(conn)
+        if event:
+            self._append_event(conn, old, event)
+            if event.get('Action') == 'reassigned' and changes.get('Department', old['Department']) != old['Department']:
+                conn.execute(
+                    "INSERT INTO routing_feedback (Timestamp, Lot_ID, Complaint, Predicted, Corrected) VALUES (?, ?, ?, ?, ?)",
+                    (event.get('Timestamp'), str(lot_id), old['Complaint'], old['Department'], changes['Department']),
+                )
+        return True
+
+    def _append_event(self, conn, case, event):
+        conn.execute(
+            "INSERT INTO case_events (Case_ID, Lot_ID, Timestamp, Actor, Action, Note) VALUES (?, ?, ?, ?, ?, ?)",
+            [case['Case_ID'], str(case['Lot_ID'])] + [event.get(col) for col in EVENT_COLUMNS],
+        )
+
+    def get_case(self, lot_id):
+        return self._current(self._connect(), lot_id)
+
+    def get_claim(self, case_id):
+        return self._claim(self._connect(), case_id)
+
+    def find_cases(self, lot_id):
+        rows = self._connect().execute(
+            f"SELECT {', '.join(CASE_COLUMNS)} FROM cases WHERE Lot_ID = ? ORDER BY Case_ID DESC", (str(lot_id),)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def search_lots(self, prefix, limit=20):
+        # ช่วงของ index (Lot_ID >= prefix AND < prefix + U+10FFFF) แทน LIKE ที่ SQLite ใช้ index ไม่ได้
+        prefix = str(prefix)
+        return [tuple(r) for r in self._connect().execute(
+            "SELECT Lot_ID, COUNT(*) FROM cases WHERE Lot_ID >= ? AND Lot_ID < ? GROUP BY Lot_ID ORDER BY Lot_ID LIMIT ?",
+            (prefix, prefix + '\U0010ffff', int(limit)))]
+
+    def cases_by_id(self, case_ids):
+        case_ids = [int(i) for i in case_ids]
+        found = {}
+        for i in range(0, len(case_ids), 500):
+            part = case_ids[i:i + 500]
+            for row in self._connect().execute(
+                    f"SELECT {', '.join(CASE_COLUMNS)} FROM cases WHERE Case_ID IN ({', '.join('?' * len(part))})", part):
+                found[row['Case_ID']] = dict(row)
+        return found
+
+    def iter_complaints(self, after_id=0, chunksize=5000):
+        cur = self._connect().execute(
+            "SELECT Case_ID, Complaint FROM cases WHERE Case_ID > ? ORDER BY Case_ID", (int(after_id),))
+        while True:
+            rows = cur.fetchmany(chunksize)
+            if not rows:
+                break
+            yield [tuple(r) for r in rows]
+
+    def case_history(self, case_id):
+        rows = self._connect().execute(
+            f"SELECT {', '.join(EVENT_COLUMNS)} FROM case_events WHERE Case_ID = ? ORDER BY Event_ID", (int(case_id),)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def case_histories(self, case_ids):
+        case_ids = [int(i) for i in case_ids]
+        found = {}
+        for i in range(0, len(case_ids), 500):
+            part = case_ids[i:i + 500]
+            for row in self._connect().execute(
+                    f"SELECT Case_ID, {', '.join(EVENT_COLUMNS)} FROM case_events "
+                    f"WHERE Case_ID IN ({', '.join('?' * len(part))}) ORDER BY Case_ID, Event_ID", part):
+                found.setdefault(row['Case_ID'], []).append({col: row[col] for col in EVENT_COLUMNS})
+        return found
+
+    def case_versions(self, case_ids):
+        case_ids = [int(i) for i in case_ids]
+        found = {}
+        for i in range(0, len(case_ids), 500):
+            part = case_ids[i:i + 500]
+            found.update(self._connect().execute(
+                f"SELECT Case_ID, Row_Version FROM cases WHERE Case_ID IN ({', '.join('?' * len(part))})", part))
+        return found
+
+    def dashboard_stats(self):
+        return aggregates.read(self._connect())
+
+    def rebuild_aggregates(self):
+        conn = self._connect()
+        with conn:
+            aggregates.rebuild(conn)
+
+    def verify_aggregates(self):
+        return aggregates.verify(self._connect())
+
+    def routing_feedback(self):
+        return pd.read_sql_query(
+            "SELECT Timestamp, Lot_ID, Complaint, Predicted, Corrected FROM routing_feedback ORDER BY Feedback_ID",
+            self._connect())
+
+    def eta_model(self):
+        return eta.EtaModel.from_conn(self._connect())
+
+    def refit_eta(self):
+        conn = self._connect()
+        with conn:
+            return eta.rebuild(conn)
+
+    def task_page(self, handler=None, opened_before=None, newest_first=False, limit=20, offset=0):
+        # Status ต้องเป็น literal ตรงกับเงื่อนไขของ partial index ไม่งั้น SQLite จะไม่ใช้ index
+        where, params = [f"Status != '{aggregates.CLOSED_STATUS}'"], []
+        if handler:
+            where.append("Current_Handler = ?")
+            params.append(handler)
+        if opened_before:
+            where.append("Date <= ?")
+            params.append(opened_before)
+        where = ' AND '.join(where)
+        conn = self._connect()
+        total = conn.execute(f"SELECT COUNT(*) FROM cases WHERE {where}", params).fetchone()[0]
+        page = pd.read_sql_query(
+            f"SELECT {', '.join(CASE_COLUMNS)} FROM cases WHERE {where} "
+            f"ORDER BY Date {'DESC' if newest_first else 'ASC'}, rowid LIMIT ? OFFSET ?",
+            conn, params=params + [int(limit), int(offset)])
+        return page, total
+
+    def iter_cases(self, date_from=None, date_to=None, departments=None, statuses=None, chunksize=5000):
+        where, params = [], []
+        if date_from:
+            where.append("Date >= ?")
+            params.append(str(date_from))
+        if date_to:
+            # Date เก็บเป็น 'YYYY-MM-DD HH:MM' -> รวมทั้งวันของ date_to
+            where.append("Date < ?")
+            params.append((pd.Timestamp(date_to) + pd.Timedelta(days=1)).strftime("%Y-%m-%d"))
+        for col, values in (('Department', departments), ('Status', statuses)):
+            if values:
+                where.append(f"{col} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+        sql = f"SELECT {', '.join(CASE_COLUMNS)} FROM cases"
+        if where:
+            sql += " WHERE " + ' AND '.join(where)
+        # อ่านทีละ chunk ไม่ต้องโหลดทั้งตารางเข้าหน่วยความจำ
+        yield from pd.read_sql_query(sql + " ORDER BY rowid", self._connect(), params=params, chunksize=chunksize)
+
+    def data_version(self):
+        return self._connect().execute("SELECT Value FROM store_meta WHERE Key = 'data_version'").fetchone()[0]
+
+    def all_cases(self):
+        return pd.read_sql_query(f"SELECT {', '.join(CASE_COLUMNS)} FROM cases ORDER BY rowid", self._connect())
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            self._clear(conn)
+
+    def _clear(self, conn):
+        conn.execute("DELETE FROM cases")
+        conn.execute("DELETE FROM case_events")
+        conn.execute("DELETE FROM case_counts")
+        conn.execute("DELETE FROM resolution_stats")
+        conn.execute("DELETE FROM routing_feedback")
+        conn.execute("DELETE FROM eta_stats")
+        _touch(conn)
+
+    # --- archive partitions (see smart_claim.archive) ---
+    def closed_before(self, cutoff):
+        """``{'YYYY-MM': [Case_ID, ...]}`` of cases closed before ``cutoff``, grouped by closing month."""
+        months = {}
+        for case_id, month in self._connect().execute(
+                "SELECT Case_ID, substr(COALESCE(Closed_At, Date), 1, 7) FROM cases "
+                "WHERE Status = ? AND COALESCE(Closed_At, Date) < ? ORDER BY Case_ID", (CLOSED_STATUS, str(cutoff))):
+            months.setdefault(month, []).append(case_id)
+        return months
+
+    def copy_cases(self, source_path, case_ids):
+        """Copy cases and their events from another store file, keeping their Case_IDs."""
+        conn = self._connect()
+        conn.execute("ATTACH DATABASE ? AS src", (source_path,))
+        try:
+            with conn:
+                for i in range(0, len(case_ids), 500):
+                    part = [int(c) for c in case_ids[i:i + 500]]
+                    marks = ', '.join('?' * len(part))
+                    # INSERT OR REPLACE: ย้ายซ้ำ (เช่นรอบก่อนค้างกลางทาง) ได้ผลเหมือนเดิม
+                    conn.execute(f"INSERT OR REPLACE INTO cases ({', '.join(CASE_COLUMNS)}, Row_Version) "
+                                 f"SELECT {', '.join(CASE_COLUMNS)}, Row_Version FROM src.cases "
+                                 f"WHERE Case_ID IN ({marks})", part)
+                    conn.execute(f"DELETE FROM case_events WHERE Case_ID IN ({marks})", part)
+                    conn.execute(f"INSERT INTO case_events (Case_ID, Lot_ID, {', '.join(EVENT_COLUMNS)}) "
+                                 f"SELECT Case_ID, Lot_ID, {', '.join(EVENT_COLUMNS)} FROM src.case_events "
+                                 f"WHERE Case_ID IN ({marks}) ORDER BY Event_ID", part)
+                aggregates.rebuild(conn)
+                _touch(conn)
+        finally:
+            conn.execute("DETACH DATABASE src")
+
+    def _move_cases(self, conn, target, case_ids):
+        """Move closed cases into ``target`` (another store); run through ``apply_batch`` so the
+        write lock is held from the copy to the delete and no update can slip in between."""
+        ids = []
+        for i in range(0, len(case_ids), 500):
+            part = [int(c) for c in case_ids[i:i + 500]]
+            ids.extend(c for (c,) in conn.execute(
+                f"SELECT Case_ID FROM cases WHERE Case_ID IN ({', '.join('?' * len(part))}) AND Status = ?",
+                part + [CLOSED_STATUS]))
+        if not ids:
+            return 0
+        # copy ลง partition (commit ของมันเอง) ก่อนค่อยลบจากไฟล์นี้: ถ้าพังกลางทาง เคสจะซ้ำ ไม่หาย
+        target.copy_cases(self.path, ids)
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            conn.execute(f"DELETE FROM case_events WHERE Case_ID IN ({', '.join('?' * len(part))})", part)
+            conn.execute(f"DELETE FROM cases WHERE Case_ID IN ({', '.join('?' * len(part))})", part)
+        # eta_stats ไม่แตะ: เวลาปิดเคสของเคสที่ย้ายไปแล้วยังใช้ประมาณ ETA ต่อ
+        aggregates.rebuild(conn)
+        _touch(conn)
+        return len(ids)
+
+    def import_csv(self, csv_path):
+        """One-shot import of a legacy ``tracking_db_*.csv`` file.
+
+        Every row becomes its own claim, in file order (the old ``save_to_db``
+        appended a row per claim, so repeated Lot IDs are earlier claims of the
+        same lot). A lot can have only one open claim: an open row followed by a
+        later row of the same lot, or whose lot already has an open claim in the
+        store, is closed as superseded (no ``Closed_At``, so it does not count
+        towards resolution times). Returns the number of imported rows.
+        """
+        df = pd.read_csv(csv_path, dtype={'Lot_ID': str})
+        for col in CASE_COLUMNS + ['Action_History']:
+            if col not in df.columns:
+                df[col] = None
+        # เหมือน init_db() เดิม: เคสเก่าที่ยังไม่มีคนรับผิดชอบ -> ให้แผนกที่ถูก assign
+        mask = (df['Current_Handler'] == "System") | (df['Current_Handler'].isnull())
+        df.loc[mask, 'Current_Handler'] = df.loc[mask, 'Department']
+        df = df[df['Lot_ID'].notna()].reset_index(drop=True)
+        df['Case_ID'] = None
+        df['Estimated_Days'] = pd.to_numeric(df['Estimated_Days'], errors='coerce')
+
+        conn = self._connect()
+        open_lots = {lot for (lot,) in conn.execute("SELECT Lot_ID FROM cases WHERE Status != ?", (CLOSED_STATUS,))}
+        superseded = (df['Status'] != CLOSED_STATUS) & (df.duplicated('Lot_ID', keep='last') | df['Lot_ID'].isin(open_lots))
+        # เปิดค้างได้ทีละ claim ต่อ lot (idx_cases_open_lot): claim ก่อนหน้าถูกปิดเพราะมี claim ใหม่กว่ามาแทน
+        superseded_at = df.groupby('Lot_ID')['Date'].shift(-1).fillna(datetime.now().strftime("%Y-%m-%d %H:%M"))
+        df.loc[superseded, 'Status'] = CLOSED_STATUS
+        df.loc[superseded, ['Current_Handler', 'Final_Decision']] = ["Completed", "Superseded"]
+        df.loc[superseded, 'Resolution_Note'] = "Superseded by a later claim for this lot (legacy import)"
+
+        rows = [
+            tuple(None if pd.isna(v) else (int(v) if col == 'Estimated_Days' else str(v))
+                  for col, v in zip(CASE_COLUMNS, rec))
+            for rec in df[CASE_COLUMNS].itertuples(index=False, name=None)
+        ]
+        with conn:
+            last_id = conn.execute("SELECT COALESCE(MAX(Case_ID), 0) FROM cases").fetchone()[0]
+            conn.executemany(
+                f"INSERT INTO cases ({', '.join(CASE_COLUMNS)}) VALUES ({', '.join('?' * len(CASE_COLUMNS))})",
+                rows,
+            )
+            case_ids = [c for (c,) in conn.execute("SELECT Case_ID FROM cases WHERE Case_ID > ? ORDER BY Case_ID", (last_id,))]
+            conn.executemany(
+                "INSERT INTO case_events (Case_ID, Lot_ID, Timestamp, Actor, Action, Note) VALUES (?, ?, ?, ?, ?, ?)",
+                [(case_id, str(lot_id), *(ev[c] for c in EVENT_COLUMNS))
+                 for case_id, lot_id, history in zip(case_ids, df['Lot_ID'], df['Action_History'])
+                 for ev in parse_history(None if pd.isna(history) else history)],
+            )
+            _backfill_closed_at(conn, key='Case_ID')
+            # หลัง backfill: claim ที่ถูกแทนไม่มี Closed_At จะได้ไม่ถูกนับเป็นเวลาปิดเคส
+            conn.executemany(
+                "INSERT INTO case_events (Case_ID, Lot_ID, Timestamp, Actor, Action, Note) VALUES (?, ?, ?, ?, ?, ?)",
+                [(case_ids[i], str(df.at[i, 'Lot_ID']), str(superseded_at[i]), "System", "closed",
+                  "Closed on import: superseded by a later claim for this lot")
+                 for i in df.index[superseded]],
+            )
+            aggregates.rebuild(conn)
+            eta.rebuild(conn)
+            _touch(conn)
+        return len(rows)
+
+
+BACKENDS = {
+    'sqlite': SQLiteCaseStore,
+}
+
+
+def open_store(path, backend='sqlite', legacy_csv=None, archive_dir=None):
+    """Open (and migrate) the case store.
+
+    When the store is brand new and ``legacy_csv`` exists, its rows are imported
+    once and the CSV is renamed to ``*.imported`` so it is never read again.
+    With ``archive_dir`` the store also reads the monthly archive partitions
+    there (see ``smart_claim.archive``).
+    """
+    store = BACKENDS[os.environ.get('CLAIM_STORE_BACKEND', backend)](path)
+    if legacy_csv and store.previous_version == 0 and os.path.exists(legacy_csv):
+        store.import_csv(legacy_csv)
+        os.replace(legacy_csv, legacy_csv + '.imported')
+    if archive_dir:
+        from smart_claim.archive import PartitionedCaseStore
+        store = PartitionedCaseStore(store, archive_dir)
+    return store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Smart Claim case store tools")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    imp = sub.add_parser('import-csv', help="import a legacy CSV database into the store")
+    imp.add_argument('csv_path')
+    imp.add_argument('--db', default='tracking_db_v4_mcs.db')
+    agg = sub.add_parser('aggregates', help="verify (and optionally rebuild) the dashboard aggregates")
+    agg.add_argument('--db', default='tracking_db_v4_mcs.db')
+    agg.add_argument('--rebuild', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'import-csv':
+        store = open_store(args.db)
+        n = store.import_csv(args.csv_path)
+        print(f"Imported {n} cases from {args.csv_path} into {args.db}")
+    elif args.cmd == 'aggregates':
+        store = open_store(args.db)
+        problems = store.verify_aggregates()
+        for p in problems:
+            print(p)
+        print("aggregates OK" if not problems else f"{len(problems)} mismatches")
+        if problems and args.rebuild:
+            store.rebuild_aggregates()
+            print("rebuilt from cases")
+
+
+if __name__ == '__main__':
+    main()
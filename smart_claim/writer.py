@@ -0,0 +1,96 @@
+"""Process-wide write coordinator for the case store.
+
+Streamlit runs every browser session on its own thread, so writes from many
+operators arrive at the same time. Instead of letting each session write on its
+own, sessions put requests on a bounded queue and one background thread applies
+them in batches, one transaction per batch. Every request gets a ``Future`` that
+resolves once its batch is committed, so the calling session knows whether its
+own write went through.
+"""
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class WriteQueueFull(RuntimeError):
+    """The writer is saturated and did not accept the request in time."""
+
+
+_STOP = object()
+
+
+class WriteCoordinator:
+    def __init__(self, store, max_queue=1000, max_batch=200, batch_window=0.002):
+        self.store = store
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.batches = 0
+        self.ops = 0
+        self._thread = threading.Thread(target=self._run, name="claim-writer", daemon=True)
+        self._thread.start()
+
+    # ==========================================
+    # API ฝั่ง session
+    # ==========================================
+    def submit(self, name, *args, timeout=5.0, **kwargs):
+        """Queue ``store.<name>(*args, **kwargs)``; returns a Future (the ack)."""
+        fut = Future()
+        try:
+            self._queue.put((name, args, kwargs, fut), timeout=timeout)
+        except queue.Full:
+            raise WriteQueueFull(f"claim writer queue is full ({self._queue.maxsize} pending)") from None
+        return fut
+
+    def insert_case(self, record, event=None, timeout=30.0):
+        return self.submit('insert_case', record, event=event).result(timeout)
+
+    def insert_cases(self, records, events=None, timeout=60.0):
+        return self.submit('insert_cases', records, events=events).result(timeout)
+
+    def update_case(self, lot_id, changes, event=None, case_id=None, expected_version=None, timeout=30.0):
+        return self.submit('update_case', lot_id, changes, event=event, case_id=case_id,
+                           expected_version=expected_version).result(timeout)
+
+    def close(self, timeout=10.0):
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    # ==========================================
+    # writer thread
+    # ==========================================
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = False
+            # เก็บ request ที่เข้ามาพร้อมๆ กันไว้ commit ทีเดียว
+            while len(batch) < self.max_batch:
+                try:
+                    nxt = self._queue.get(timeout=self.batch_window)
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stop = True
+                    break
+                batch.append(nxt)
+            self._apply(batch)
+            if stop:
+                return
+
+    def _apply(self, batch):
+        try:
+            outcomes = self.store.apply_batch([(name, args, kwargs) for name, args, kwargs, _ in batch])
+        except Exception as e:
+            for *_, fut in batch:
+                fut.set_exception(e)
+            return
+        self.batches += 1
+        self.ops += len(batch)
+        for (*_, fut), (result, error) in zip(batch, outcomes):
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)